@@ -1,549 +1,1654 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, g, request, jsonify
 from twilio.twiml.messaging_response import MessagingResponse
 import logging
 import uuid
-import json
 import os
+import atexit
+import hmac
+import json
+import re
+import threading
+import time
 from datetime import datetime, timedelta
 
-# Try to import APScheduler, but make it optional
-try:
-    from apscheduler.schedulers.background import BackgroundScheduler
-    scheduler = BackgroundScheduler()
-    scheduler.start()
-    scheduler_available = True
-except ImportError:
-    scheduler_available = False
-    logging.warning("APScheduler not available. Reminder functionality disabled.")
-
-# Try to initialize Twilio client
-try:
-    from twilio.rest import Client
-    # Twilio credentials - replace with your actual credentials
-    TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', 'your_account_sid')
-    TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', 'your_auth_token')
-    TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', 'whatsapp:+14155238886')
-    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-    twilio_available = True
-except Exception as e:
-    twilio_available = False
-    logging.warning(f"Twilio client initialization failed: {str(e)}. Outgoing messages disabled.")
-
-app = Flask(__name__)
+from storage import open_storage, work_status, ALREADY_SELECTED, FULL, NOT_FOUND, OPEN, PAST, WORK_STATUSES
+from outbox import Outbox, DeliveryEngine, SharedTokenBucket, TwilioTransport, FakeTransport
+from router import CommandRouter, Message, split_message
+from cache import ResponseCache
+from dedup import ReplyLog
+from ratelimit import SenderLimiter
+from roster import Roster, Broadcaster
+from sessions import SessionStore, SessionNamespace
+from backups import BackupManager, BackupError
+from archive import Archive, ArchiveError
+from stats import StaffingStats
+from digest import AdminDigest
+from reminders import ReminderScheduler, parse_event_time, event_time, TIME_FORMAT, SCHEDULED, SENT, MISSED
+from lazy import Lazy
+from tenants import Directory, Tenant, WorkspaceLocal, WorkspaceDict, DEFAULT_TENANT, current_workspace, leave
+from metrics import Registry, SlowRequestProfiler
+
+# Importing this module has no side effects: the Twilio client, storage and
+# background threads below are Lazy, built on first use or by
+# start_services(), which create_app() and the first request call
+
+# Twilio credentials - replace with your actual credentials
+TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', 'your_account_sid')
+TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', 'your_auth_token')
+TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', 'whatsapp:+14155238886')
+
+def build_twilio_client():
+    """Initialize the Twilio client, or return None if it cannot be initialized."""
+    try:
+        from twilio.rest import Client
+        return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    except Exception as e:
+        logging.warning(f"Twilio client initialization failed: {str(e)}. Outgoing messages disabled.")
+        return None
+
+twilio_client = Lazy(build_twilio_client)
+
+def twilio_available():
+    return bool(twilio_client)
+
+bp = Blueprint('bot', __name__)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Global variables
-admin_number = "whatsapp:+919353692621"  # WhatsApp format with 'whatsapp:' prefix
+admin_number = os.environ.get('ADMIN_NUMBER', "whatsapp:+919353692621")  # WhatsApp format with 'whatsapp:' prefix
+
+# One process can serve several businesses (tenants), each with its own admin
+# numbers, sender numbers and workspace: works, current selection, roster,
+# reminders, backups, archive and analytics, with the files in TENANTS_DIR/<name>.
+# They are listed in TENANTS_FILE; without it there is a single tenant whose
+# admin is admin_number and whose files are where the settings below say.
+# Workspaces are built when their tenant first gets a message, unless marked
+# preload, except for the reminder schedulers, which start with the app
+TENANTS_FILE = os.environ.get('TENANTS_FILE')
+TENANTS_DIR = os.environ.get('TENANTS_DIR', 'tenants')
+
+# Builders of the per-tenant services, filled in below
+workspace_services = {}
+
+def build_tenants():
+    if TENANTS_FILE:
+        return Directory.from_file(TENANTS_FILE, TENANTS_DIR, workspace_services)
+    return Directory([Tenant(DEFAULT_TENANT, [admin_number], preload=True)], workspace_services, DEFAULT_TENANT)
+
+tenants = Lazy(build_tenants)
+
+def per_tenant(name, build):
+    """Register a per-tenant service and return a proxy to the current tenant's one."""
+    workspace_services[name] = build
+    return WorkspaceLocal(tenants, name)
+
+def per_tenant_dict(name, build):
+    workspace_services[name] = build
+    return WorkspaceDict(tenants, name)
+
+def workspace():
+    """The workspace of the tenant being served."""
+    return current_workspace(tenants)
 
-# Data structure for work opportunities
-work_opportunities = {}  # Dictionary to store work details, keyed by work_id
-current_work_id = None  # The active work ID that workers are responding to
-admin_state = {}  # Store admin state for multi-step operations
+def tenant_namespace(kind):
+    """Session namespace of the current tenant; the single tenant keeps the plain names."""
+    name = workspace().name
+    return kind if name == DEFAULT_TENANT else f"{name}/{kind}"
+
+# Metrics served at /metrics in the Prometheus text format. With METRICS_DIR
+# set, each worker process writes its metrics there every
+# METRICS_FLUSH_INTERVAL seconds and /metrics adds up all processes
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+# Sample the stacks of /whatsapp requests and report the ones slower than
+# this many milliseconds (off unless set)
+PROFILE_SLOW_REQUESTS_MS = os.environ.get('PROFILE_SLOW_REQUESTS_MS')
+
+metrics = Registry(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+request_seconds = metrics.histogram('whatsapp_request_seconds', "Time to handle a /whatsapp request", ['role'])
+command_seconds = metrics.histogram('whatsapp_command_seconds', "Time spent in each command's handler", ['command'])
+command_errors = metrics.counter('whatsapp_command_errors_total', "Command handlers that raised an error", ['command'])
+save_seconds = metrics.histogram('storage_save_seconds', "Time taken to write a journal batch or a snapshot", ['kind'])
+load_seconds = metrics.histogram('storage_load_seconds', "Time taken to load persisted data")
+send_seconds = metrics.histogram('outbound_send_seconds', "Twilio send latency")
+send_errors = metrics.counter('outbound_send_errors_total', "Twilio sends that failed")
+delivery_updates = metrics.counter('outbound_messages_total', "Outbound message attempts by result", ['status'])
+retried_requests = metrics.counter('whatsapp_retried_requests_total', "Retried /whatsapp requests answered with the stored reply")
+slow_profiler = SlowRequestProfiler(float(PROFILE_SLOW_REQUESTS_MS) / 1000) if PROFILE_SLOW_REQUESTS_MS else None
+
+def observe_command(name, elapsed, failed):
+    command_seconds.observe(elapsed, name)
+    if failed:
+        command_errors.inc(name)
+
+def observe_send(elapsed, error):
+    send_seconds.observe(elapsed)
+    if error is not None:
+        send_errors.inc()
+
+# Storage settings - "json" keeps work opportunities in memory and persists
+# them to the data file plus its change journal, "sqlite" keeps them in an
+# indexed SQLite database shared by all processes
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+DATA_FILE = os.environ.get('CATERING_DATA_FILE', 'catering_data.json')
+DB_FILE = os.environ.get('CATERING_DB_FILE', 'catering_data.db')
+JOURNAL_FSYNC = os.environ.get('JOURNAL_FSYNC', 'batch')  # always, batch or never
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get('JOURNAL_FLUSH_INTERVAL', '0.05'))
+JOURNAL_COMPACT_EVERY = int(os.environ.get('JOURNAL_COMPACT_EVERY', '500'))
+# json or pickle - pickle snapshots are smaller and load faster (json engine only)
+SNAPSHOT_FORMAT = os.environ.get('SNAPSHOT_FORMAT', 'json')
+
+def build_store():
+    """Open the storage engine and load persisted work opportunities into it."""
+    journal_options = dict(fsync=JOURNAL_FSYNC, flush_interval=JOURNAL_FLUSH_INTERVAL, compact_every=JOURNAL_COMPACT_EVERY)
+    if STORAGE_BACKEND == 'json':
+        journal_options['snapshot_format'] = SNAPSHOT_FORMAT
+        journal_options['on_write'] = lambda kind, elapsed: save_seconds.observe(elapsed, kind)
+    engine = open_storage(STORAGE_BACKEND, workspace().path(DATA_FILE), workspace().path(DB_FILE), **journal_options)
+    try:
+        with load_seconds.time():
+            engine.load()
+    except Exception as e:
+        logger.error(f"Error loading data: {str(e)}")
+    atexit.register(engine.close)
+    return engine
+
+# Storage for work opportunities, selections, reminders and the current work ID
+store = per_tenant('store', build_store)
 
-# Load data on startup
 def load_data():
-    """Load work opportunities and current work ID from a file if it exists."""
-    global work_opportunities, current_work_id
-    filename = 'catering_data.json'
-    if os.path.exists(filename):
-        try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
-                work_opportunities = data.get('work_opportunities', {})
-                current_work_id = data.get('current_work_id', None)
-            logger.info("Data loaded from file.")
-        except Exception as e:
-            logger.error(f"Error loading data: {str(e)}")
-    else:
-        logger.info("No data file found. Starting fresh.")
+    """Load persisted work opportunities into the storage engine, if not loaded yet."""
+    return store.get()
+
+# Backups are taken by a background thread as gzipped snapshots, with deltas
+# against the last full backup in between, and pruned to keep the newest
+# backup of each of the last BACKUP_KEEP_HOURLY hours and BACKUP_KEEP_DAILY days.
+# /restore is only enabled when BACKUP_TOKEN is set
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL = float(os.environ.get('BACKUP_INTERVAL', '3600'))
+BACKUP_FULL_INTERVAL = float(os.environ.get('BACKUP_FULL_INTERVAL', '86400'))
+BACKUP_INCREMENTAL = os.environ.get('BACKUP_INCREMENTAL', '1') == '1'
+BACKUP_KEEP_HOURLY = int(os.environ.get('BACKUP_KEEP_HOURLY', '24'))
+BACKUP_KEEP_DAILY = int(os.environ.get('BACKUP_KEEP_DAILY', '7'))
+BACKUP_TOKEN = os.environ.get('BACKUP_TOKEN')
+
+def build_backup_manager():
+    manager = BackupManager(
+        store.get(),
+        workspace().path(BACKUP_DIR),
+        interval=BACKUP_INTERVAL,
+        full_interval=BACKUP_FULL_INTERVAL,
+        incremental=BACKUP_INCREMENTAL,
+        keep_hourly=BACKUP_KEEP_HOURLY,
+        keep_daily=BACKUP_KEEP_DAILY
+    )
+    manager.start()
+    atexit.register(manager.stop)
+    return manager
+
+backup_manager = per_tenant('backup_manager', build_backup_manager)
+
+# Works whose event was more than ARCHIVE_AFTER_DAYS ago are moved every
+# ARCHIVE_INTERVAL seconds into compressed monthly segments in ARCHIVE_DIR,
+# so storage only holds active and upcoming works. Works whose time could
+# not be read go ARCHIVE_UNDATED_AFTER_DAYS after they were created. HISTORY
+# and ARCHIVE read them back
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', '3600'))
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', '7'))
+ARCHIVE_UNDATED_AFTER_DAYS = float(os.environ.get('ARCHIVE_UNDATED_AFTER_DAYS', '30'))
+
+def build_archive():
+    work_archive = Archive(store.get(), workspace().path(ARCHIVE_DIR), interval=ARCHIVE_INTERVAL,
+                           after_days=ARCHIVE_AFTER_DAYS, undated_after_days=ARCHIVE_UNDATED_AFTER_DAYS)
+    work_archive.start()
+    atexit.register(work_archive.close)
+    return work_archive
 
-def save_data():
-    """Save work opportunities and current work ID to a file."""
-    filename = 'catering_data.json'
+archive = per_tenant('archive', build_archive)
+
+# Staffing analytics (claim times, fill rates, claims per worker) are updated
+# on every create, claim and delete, and served by STATS and /stats
+STATS_FILE = os.environ.get('STATS_FILE', 'stats.db')
+
+def build_staffing_stats():
+    """Open the analytics database, counting the stored works the first time."""
+    stats_file = workspace().path(STATS_FILE)
+    staffing = StaffingStats(stats_file)
+    if staffing.is_empty():
+        added = staffing.backfill(store.list_works())
+        if added:
+            logger.info(f"Counted {added} existing work opportunities in {stats_file}.")
+    atexit.register(staffing.close)
+    return staffing
+
+staffing_stats = per_tenant('staffing_stats', build_staffing_stats)
+
+def record_stats(event, *args):
+    """Update the analytics; a failure there is logged and never fails the request."""
     try:
-        data = {
-            'work_opportunities': work_opportunities,
-            'current_work_id': current_work_id
-        }
-        with open(filename, 'w') as f:
-            json.dump(data, f)
-        logger.info("Data saved to file.")
+        getattr(staffing_stats, event)(*args)
     except Exception as e:
-        logger.error(f"Error saving data: {str(e)}")
+        logger.error(f"Error updating staffing stats ({event}): {str(e)}")
 
-load_data()
+# Outgoing messages are queued in a durable outbox and sent by a pool of
+# sender threads, rate limited to the Twilio sender's messages per second.
+# Each tenant sends from its first sender number, or TWILIO_PHONE_NUMBER.
+# OUTBOUND_TRANSPORT=fake records sends in memory instead (benchmarks and
+# tests), and off leaves messages queued in the outbox. The rate is kept in
+# OUTBOUND_RATE_FILE, shared by all worker processes and tenants, per sender
+# number. Sent and failed messages are kept for OUTBOUND_RETENTION_DAYS
+OUTBOUND_TRANSPORT = os.environ.get('OUTBOUND_TRANSPORT', 'twilio')
+OUTBOX_FILE = os.environ.get('OUTBOX_FILE', 'outbox.db')
+OUTBOUND_RATE_FILE = os.environ.get('OUTBOUND_RATE_FILE', 'send_rate.db')
+OUTBOUND_RATE = float(os.environ.get('OUTBOUND_RATE', '10'))
+OUTBOUND_WORKERS = int(os.environ.get('OUTBOUND_WORKERS', '4'))
+OUTBOUND_MAX_ATTEMPTS = int(os.environ.get('OUTBOUND_MAX_ATTEMPTS', '5'))
+OUTBOUND_RETENTION_DAYS = float(os.environ.get('OUTBOUND_RETENTION_DAYS', '7'))
+
+def record_delivery(message, status, error):
+    """Record a reminder message's delivery status on its work's reminders entry."""
+    delivery_updates.inc(status)
+    if message['work_id'] and message['reminder_id']:
+        store.update_delivery(message['work_id'], message['reminder_id'], message['to_number'], status)
+
+def build_delivery_engine():
+    """Open the outbox and, when there is a transport to send with, start the sender threads."""
+    tenant_workspace = workspace()
+    sender = tenant_workspace.tenant.numbers[0] if tenant_workspace.tenant.numbers else TWILIO_PHONE_NUMBER
+    transport = None
+    if OUTBOUND_TRANSPORT == 'fake':
+        transport = FakeTransport()
+    elif OUTBOUND_TRANSPORT == 'twilio':
+        client = twilio_client.get()
+        transport = TwilioTransport(client, sender) if client is not None else None
+    engine = DeliveryEngine(
+        Outbox(tenant_workspace.path(OUTBOX_FILE)),
+        transport,
+        workers=OUTBOUND_WORKERS,
+        bucket=SharedTokenBucket(OUTBOUND_RATE_FILE, sender, OUTBOUND_RATE),
+        max_attempts=OUTBOUND_MAX_ATTEMPTS,
+        retention=OUTBOUND_RETENTION_DAYS * 86400,
+        # Called from the sender threads
+        on_status=tenant_workspace.bind(record_delivery),
+        on_send=observe_send
+    )
+    if transport is not None:
+        engine.start()
+        atexit.register(engine.stop)
+    return engine
+
+delivery_engine = per_tenant('delivery_engine', build_delivery_engine)
 
 # Function to send reminders
 def send_reminder(work_id, message):
-    """Send a reminder to all workers for a specific work opportunity"""
-    if not scheduler_available or not twilio_available:
-        logger.error("Cannot send reminder - scheduler or Twilio client not available")
-        return
+    """Queue a reminder to all workers for a specific work opportunity.
+
+    Returns True if messages were queued, False if there was nobody to send
+    them to or the work does not exist.
+    """
+    work = store.get_work(work_id)
+    if work is None:
+        logger.error(f"Cannot send reminder - Work ID {work_id} not found")
+        return False
     
-    if work_id in work_opportunities:
-        work = work_opportunities[work_id]
-        workers = work["selected_workers"]
-        
-        if not workers:
-            logger.info(f"No workers to send reminder for {work_id}")
-            return
-        
-        for worker in workers:
-            try:
-                twilio_client.messages.create(
-                    body=f"REMINDER for {work['title']}: {message}",
-                    from_=TWILIO_PHONE_NUMBER,
-                    to=worker
-                )
-                logger.info(f"Sent reminder to {worker} for {work['title']}")
-            except Exception as e:
-                logger.error(f"Error sending reminder to {worker}: {str(e)}")
-        
-        # Add reminder to work record
-        if "reminders" not in work:
-            work["reminders"] = []
-        
-        work["reminders"].append({
-            "message": message,
-            "sent_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "recipients": len(workers)
-        })
-        
-        # Save data after sending reminders
-        save_data()
-        
-        logger.info(f"Reminder sent to {len(workers)} workers for {work['title']}")
+    workers = work["selected_workers"]
+    if not workers:
+        logger.info(f"No workers to send reminder for {work_id}")
+        return False
+    
+    # Add reminder to work record first, so delivery statuses can be
+    # recorded on it as the messages go out
+    reminder_id = str(uuid.uuid4())[:8]
+    store.add_reminder(work_id, {
+        "id": reminder_id,
+        "message": message,
+        "sent_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "recipients": len(workers),
+        "deliveries": {worker: "queued" for worker in workers}
+    })
+    
+    # Queue one message per worker - the delivery engine sends them
+    for worker in workers:
+        delivery_engine.enqueue(
+            worker,
+            f"REMINDER for {work['title']}: {message}",
+            work_id=work_id,
+            reminder_id=reminder_id
+        )
+    
+    logger.info(f"Reminder queued for {len(workers)} workers for {work['title']}")
+    return True
+
+# Scheduled reminders are persisted on their work and fired by a single
+# elected process, which rebuilds its queue from storage at startup
+REMINDER_LOCK_FILE = os.environ.get('REMINDER_LOCK_FILE', 'scheduler.lock')
+REMINDER_RESYNC_INTERVAL = float(os.environ.get('REMINDER_RESYNC_INTERVAL', '30'))
+REMINDER_MISFIRE_GRACE = float(os.environ.get('REMINDER_MISFIRE_GRACE', '3600'))
+
+def reminder_job(work_id, reminder):
+    """Turn a stored scheduled reminder into a scheduler job."""
+    return {
+        "id": reminder["id"],
+        "work_id": work_id,
+        "message": reminder["message"],
+        "run_at": datetime.strptime(reminder["scheduled_for"], TIME_FORMAT).timestamp()
+    }
+
+def load_pending_reminders():
+    """Return scheduler jobs for every reminder still waiting to be sent."""
+    return [reminder_job(work_id, reminder) for work_id, reminder in store.pending_reminders()]
+
+def fire_reminder(job):
+    # Only a reminder that went to the outbox counts as sent
+    queued = send_reminder(job['work_id'], job['message'])
+    store.set_reminder_status(job['work_id'], job['id'], SENT if queued else MISSED)
+
+def skip_reminder(job):
+    store.set_reminder_status(job['work_id'], job['id'], MISSED)
+
+def build_reminder_scheduler():
+    # The callbacks run on the scheduler thread
+    tenant_workspace = workspace()
+    scheduler = ReminderScheduler(
+        tenant_workspace.bind(fire_reminder),
+        tenant_workspace.bind(load_pending_reminders),
+        tenant_workspace.path(REMINDER_LOCK_FILE),
+        resync_interval=REMINDER_RESYNC_INTERVAL,
+        misfire_grace=REMINDER_MISFIRE_GRACE,
+        on_missed=tenant_workspace.bind(skip_reminder)
+    )
+    scheduler.start()
+    atexit.register(scheduler.stop)
+    return scheduler
+
+reminder_scheduler = per_tenant('reminder_scheduler', build_reminder_scheduler)
+
+# Twilio retries webhooks that time out, with the same MessageSid. The reply
+# to each MessageSid is kept in a SQLite file shared by all worker processes,
+# so a retry gets the original reply back instead of being handled again
+DEDUP_FILE = os.environ.get('DEDUP_FILE', 'dedup.db')
+DEDUP_TTL = float(os.environ.get('DEDUP_TTL', '3600'))
+DEDUP_MAX_ENTRIES = int(os.environ.get('DEDUP_MAX_ENTRIES', '10000'))
+DEDUP_WAIT = float(os.environ.get('DEDUP_WAIT', '10'))
+
+def build_reply_log():
+    log = ReplyLog(DEDUP_FILE, ttl=DEDUP_TTL, max_entries=DEDUP_MAX_ENTRIES, wait=DEDUP_WAIT)
+    atexit.register(log.close)
+    return log
+
+reply_log = Lazy(build_reply_log)
+
+# Inbound messages are rate limited per sender before anything else is done
+# for them (only a retry of a message already answered is replayed first),
+# with separate limits for the admin and for workers: on average
+# *_RATE_LIMIT messages a minute, with bursts of up to *_RATE_BURST (0 for
+# either turns a limit off). The first message over the limit gets a short warning, the
+# rest an empty reply. Buckets are kept per process, for at most
+# RATE_LIMIT_MAX_SENDERS senders, and shared by all tenants
+ADMIN_RATE_LIMIT = float(os.environ.get('ADMIN_RATE_LIMIT', '120'))
+ADMIN_RATE_BURST = int(os.environ.get('ADMIN_RATE_BURST', '30'))
+WORKER_RATE_LIMIT = float(os.environ.get('WORKER_RATE_LIMIT', '20'))
+WORKER_RATE_BURST = int(os.environ.get('WORKER_RATE_BURST', '8'))
+RATE_LIMIT_MAX_SENDERS = int(os.environ.get('RATE_LIMIT_MAX_SENDERS', '10000'))
+
+rate_limiters = {
+    'admin': SenderLimiter(ADMIN_RATE_LIMIT / 60, ADMIN_RATE_BURST, RATE_LIMIT_MAX_SENDERS),
+    'worker': SenderLimiter(WORKER_RATE_LIMIT / 60, WORKER_RATE_BURST, RATE_LIMIT_MAX_SENDERS)
+}
+
+# Every worker who messages the bot joins the roster. BROADCAST announces a
+# work to a tagged segment of it, BROADCAST_BATCH_SIZE workers every
+# BROADCAST_INTERVAL seconds, until everyone was told or the work is full
+ROSTER_FILE = os.environ.get('ROSTER_FILE', 'roster.db')
+BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', '100'))
+BROADCAST_INTERVAL = float(os.environ.get('BROADCAST_INTERVAL', '2'))
+
+def build_roster():
+    roster = Roster(workspace().path(ROSTER_FILE))
+    atexit.register(roster.close)
+    return roster
+
+roster = per_tenant('roster', build_roster)
+
+def prepare_broadcast(work_id):
+    """Return (message, numbers to skip) while a work still needs workers, else why the broadcast stops."""
+    work = store.get_work(work_id)
+    if work is None:
+        return "deleted"
+    status = work_status(work, datetime.now().strftime(TIME_FORMAT))
+    if status != OPEN:
+        return status
+    text = f"📣 New work opportunity!\n\nEvent: {work['title']}\nLocation: {work['location']}\nTime: {work['time']}\nPayment: {work['payment']}\nPositions: {len(work['selected_workers'])}/{work['required_workers']} filled\n\nReply 'Yes {work_id}' to confirm your availability."
+    return text, set(work['selected_workers'])
+
+def send_broadcast_message(number, text, work_id):
+    delivery_engine.enqueue(number, text, work_id=work_id)
+
+def build_broadcaster():
+    # The callbacks run on the broadcaster thread
+    tenant_workspace = workspace()
+    broadcaster = Broadcaster(
+        roster.get(),
+        tenant_workspace.bind(prepare_broadcast),
+        tenant_workspace.bind(send_broadcast_message),
+        batch_size=BROADCAST_BATCH_SIZE,
+        interval=BROADCAST_INTERVAL
+    )
+    broadcaster.start()
+    atexit.register(broadcaster.stop)
+    return broadcaster
+
+broadcaster = per_tenant('broadcaster', build_broadcaster)
+
+# Admins hear about sign-ups in digests: the sign-ups of ADMIN_DIGEST_WINDOW
+# seconds (0 sends each on its own) go out as one message, while a work that
+# fills up is announced right away. The digest's thread queues the messages,
+# so claims never wait for them
+ADMIN_DIGEST_WINDOW = float(os.environ.get('ADMIN_DIGEST_WINDOW', '60'))
+
+def notify_admin(number, text):
+    delivery_engine.enqueue(number, text)
+
+def build_admin_digest():
+    tenant_workspace = workspace()
+    digest = AdminDigest(tenant_workspace.bind(notify_admin), tenant_workspace.tenant.admins, window=ADMIN_DIGEST_WINDOW)
+    digest.start()
+    atexit.register(digest.stop)
+    return digest
+
+admin_digest = per_tenant('admin_digest', build_admin_digest)
+
+# Multi-step conversations (interactive CREATE and REMIND) and LIST cursors
+# are kept in a SQLite session store shared by all worker processes, so any
+# process can handle the next message. Sessions expire SESSION_TTL seconds
+# after their last message. Each tenant has its own namespaces in the store
+SESSION_FILE = os.environ.get('SESSION_FILE', 'sessions.db')
+SESSION_TTL = float(os.environ.get('SESSION_TTL', '1800'))
+SESSION_SWEEP_INTERVAL = float(os.environ.get('SESSION_SWEEP_INTERVAL', '60'))
+
+def build_session_store():
+    session_store = SessionStore(SESSION_FILE, ttl=SESSION_TTL, sweep_interval=SESSION_SWEEP_INTERVAL)
+    session_store.start()
+    atexit.register(session_store.close)
+    return session_store
+
+sessions = Lazy(build_session_store)
+admin_state = per_tenant_dict('admin_state', lambda: SessionNamespace(sessions, tenant_namespace('admin')))  # Admin state for multi-step operations
+
+def start_metrics_writer():
+    metrics.start()
+    atexit.register(metrics.stop)
+    return metrics
+
+metrics_writer = Lazy(start_metrics_writer)
+
+# Started for a tenant when its workspace is first used
+WORKSPACE_SERVICES = ('store', 'roster', 'staffing_stats', 'delivery_engine', 'reminder_scheduler', 'broadcaster', 'admin_digest', 'backup_manager', 'archive')
+
+def start_services():
+    """Load the reply log and start the session sweeper and metrics writer, every tenant's reminder scheduler and the preloaded tenants' workspaces, if not started yet."""
+    for service in (reply_log, sessions, metrics_writer):
+        service.get()
+    # Reminders must fire after a restart whether or not their tenant gets
+    # a message; the scheduler loads the tenant's storage only in the
+    # process elected to fire them
+    for tenant_workspace in tenants.every():
+        tenant_workspace.start(('reminder_scheduler',))
+    for preloaded in tenants.preloaded():
+        start_workspace(preloaded)
+
+def start_workspace(tenant_workspace):
+    """Load a tenant's storage, roster and analytics and start its sender threads, reminder scheduler, broadcaster, admin digest, backups and archiving, if not started yet."""
+    tenant_workspace.start(WORKSPACE_SERVICES)
+
+def schedule_reminder(work_id, work, message, hours):
+    """Persist a reminder for hours before the event and queue it.
+
+    Returns (reminder_time, event_at). reminder_time is None when it would
+    already be in the past. When the event time cannot be understood,
+    event_at is None and the reminder is set for hours from now instead.
+    """
+    event_at = event_time(work)
+    if event_at is not None:
+        reminder_time = event_at - timedelta(hours=hours)
+        if reminder_time <= datetime.now():
+            return None, event_at
     else:
-        logger.error(f"Cannot send reminder - Work ID {work_id} not found")
+        reminder_time = datetime.now() + timedelta(hours=hours)
+    
+    reminder = {
+        "id": str(uuid.uuid4())[:8],
+        "message": message,
+        "hours_before": hours,
+        "scheduled_for": reminder_time.strftime(TIME_FORMAT),
+        "status": SCHEDULED
+    }
+    store.add_scheduled_reminder(work_id, reminder)
+    reminder_scheduler.schedule(reminder_job(work_id, reminder))
+    return reminder_time, event_at
 
-@app.route('/whatsapp', methods=['POST'])
-def whatsapp():
-    # Declare global variables at the beginning of the function
-    global current_work_id
+def reminder_set_message(work, message, hours, reminder_time, event_at):
+    """Build the admin confirmation for a scheduled reminder."""
+    if event_at is not None:
+        when = f"Will be sent {hours} hours before the event ({event_at.strftime('%Y-%m-%d %H:%M')})"
+    else:
+        when = f"Could not read the event time '{work['time']}', so it will be sent {hours} hours from now"
+    return f"✅ Reminder set for {work['title']}!\n\nMessage: {message}\n{when}\nScheduled for: {reminder_time.strftime('%Y-%m-%d %H:%M')}"
+
+# Commands are routed through a registry: each message is tokenized once and
+# its handler found with a single lookup, with per-command timing counters
+router = CommandRouter(observe=observe_command)
+
+# Read-only replies are rendered once and served from an LRU cache. Replies
+# built from a work are keyed on its version, which changes with the work.
+# RESPONSE_CACHE_SIZE=0 turns the cache off
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '512'))
+response_cache = per_tenant('response_cache', lambda: ResponseCache(RESPONSE_CACHE_SIZE))
+
+# LIST shows this many works per page, and remembers where each admin's last
+# page ended so LIST next continues from there
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', '10'))
+list_cursors = per_tenant_dict('list_cursors', lambda: SessionNamespace(sessions, tenant_namespace('list')))
+
+# Any number of works can be open at once. Workers reply YES <work ID>, or
+# YES 2 for the second work in the list INFO last showed them. The lists are
+# kept in the session store, so any process can resolve the number
+info_choices = per_tenant_dict('info_choices', lambda: SessionNamespace(sessions, tenant_namespace('info')))
+
+# Values read when /metrics is served, per tenant; services not started yet are left out
+def per_workspace(name, read):
+    """Return a /metrics callback reading read(service) from every workspace whose service name is built."""
+    def values():
+        if not tenants.built:
+            return None
+        result = {}
+        for tenant_workspace in tenants.loaded():
+            if not tenant_workspace.built(name):
+                continue
+            value = read(tenant_workspace.service(name).get())
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    result[(tenant_workspace.name,) + (labels if isinstance(labels, tuple) else (labels,))] = v
+            elif value is not None:
+                result[tenant_workspace.name] = value
+        return result
+    return values
+
+metrics.counter_callback('storage_bytes_written_total', "Bytes written to the data file and its journal",
+                         per_workspace('store', lambda engine: engine.bytes_written), ['tenant'])
+metrics.counter_callback('response_cache_requests_total', "Cached reply lookups by result",
+                         per_workspace('response_cache', lambda cache: {'hit': cache.hits, 'miss': cache.misses}),
+                         ['tenant', 'result'])
+metrics.gauge('work_opportunities', "Stored work opportunities",
+              per_workspace('store', lambda engine: engine.count_works()), ['tenant'], mode='max')
+metrics.gauge('reminder_queue_depth', "Reminders waiting to be sent",
+              per_workspace('reminder_scheduler', lambda scheduler: scheduler.pending), ['tenant'])
+metrics.gauge('outbox_messages', "Outbound messages in the outbox by state",
+              per_workspace('delivery_engine', lambda engine: engine.outbox.counts()), ['tenant', 'status'], mode='max')
+metrics.gauge('sessions', "Live conversation sessions by kind",
+              lambda: sessions.counts() if sessions.built else None, ['namespace'], mode='max')
+metrics.counter_callback('session_evictions_total', "Expired sessions deleted",
+                         lambda: sessions.evictions if sessions.built else None)
+metrics.gauge('archived_works', "Work opportunities moved to the archive",
+              per_workspace('archive', lambda work_archive: work_archive.count()), ['tenant'], mode='max')
+metrics.counter_callback('whatsapp_rate_limit_total', "Inbound messages allowed or shed by the per-sender rate limit",
+                         lambda: {(role, result): getattr(limiter, result)
+                                  for role, limiter in rate_limiters.items() for result in ('allowed', 'shed')},
+                         ['role', 'result'])
+metrics.gauge('rate_limit_senders', "Senders with a rate limit bucket",
+              lambda: {role: len(limiter) for role, limiter in rate_limiters.items()}, ['role'])
+metrics.gauge('roster_workers', "Workers in the roster",
+              per_workspace('roster', lambda workers: workers.count()), ['tenant'], mode='max')
+metrics.counter_callback('admin_notifications_total', "Admin notifications sent, by kind (digest or full)",
+                         per_workspace('admin_digest', lambda digest: dict(digest.sent)), ['tenant', 'kind'])
+metrics.counter_callback('admin_digest_signups_total', "Sign-ups recorded for admin digests",
+                         per_workspace('admin_digest', lambda digest: digest.signups), ['tenant'])
+metrics.gauge('tenants_loaded', "Tenants whose workspace has been built",
+              lambda: len(tenants.loaded()) if tenants.built else None)
+
+def current_work_key():
+    """Return (work_id, version) for the current work, or (None, None) if there is none."""
+    current_work_id = store.get_current_work_id()
+    version = store.work_version(current_work_id) if current_work_id else None
+    if version is None:
+        return None, None
+    return current_work_id, version
+
+def current_work():
+    """Return (work_id, work) for the current work, or (None, None) if there is none."""
+    current_work_id = store.get_current_work_id()
+    work = store.get_work(current_work_id) if current_work_id else None
+    if work is None:
+        return None, None
+    return current_work_id, work
+
+def create_work(title, location, time, required_workers, payment):
+    """Store a new work opportunity, make it the current work and return its ID."""
+    # Create work ID
+    work_id = str(uuid.uuid4())[:8]  # Short UUID
     
-    # Get the message and sender's phone number
-    incoming_msg = request.values.get('Body', '').strip()
-    sender = request.values.get('From', '')
+    # Store work details and set it as the current work
+    event_at = parse_event_time(time)
+    store.create_work(work_id, {
+        "title": title,
+        "location": location,
+        "time": time,
+        "event_at": event_at.strftime(TIME_FORMAT) if event_at else None,
+        "required_workers": required_workers,
+        "payment": payment,
+        "selected_workers": [],
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
+    record_stats('record_created', work_id, required_workers)
+    return work_id
+
+# Interactive CREATE - one handler per step, each moving to the next step.
+# Step handlers get the session the router was given, already loaded
+@router.step('creating_event', 'title')
+def create_step_title(message, session, resp):
+    session['data']['title'] = message.text
+    session['step'] = 'location'
+    admin_state[message.sender] = session
+    resp.message("Great! Now send the location:")
+
+@router.step('creating_event', 'location')
+def create_step_location(message, session, resp):
+    session['data']['location'] = message.text
+    session['step'] = 'time'
+    admin_state[message.sender] = session
+    resp.message("When is this event? (date and time):")
+
+@router.step('creating_event', 'time')
+def create_step_time(message, session, resp):
+    session['data']['time'] = message.text
+    session['step'] = 'workers'
+    admin_state[message.sender] = session
+    resp.message("How many workers are needed? (number only):")
+
+@router.step('creating_event', 'workers')
+def create_step_workers(message, session, resp):
+    try:
+        session['data']['required_workers'] = int(message.text)
+        session['step'] = 'payment'
+        admin_state[message.sender] = session
+        resp.message("What is the payment for workers?")
+    except ValueError:
+        resp.message("Please enter a valid number for workers needed.")
+
+@router.step('creating_event', 'payment')
+def create_step_payment(message, session, resp):
+    data = session['data']
+    data['payment'] = message.text
     
-    logger.info(f"Received message: '{incoming_msg}' from {sender}")
+    work_id = create_work(data['title'], data['location'], data['time'], data['required_workers'], data['payment'])
     
-    # Initialize response
-    resp = MessagingResponse()
+    # Clear admin state
+    admin_state.pop(message.sender)
     
-    # Admin commands
-    if sender == admin_number:
-        # Check if admin is in the middle of creating an event or reminder
-        if sender in admin_state:
-            if admin_state[sender]['action'] == 'creating_event':
-                step = admin_state[sender]['step']
-                data = admin_state[sender]['data']
-                
-                if step == 'title':
-                    data['title'] = incoming_msg
-                    admin_state[sender]['step'] = 'location'
-                    resp.message("Great! Now send the location:")
-                elif step == 'location':
-                    data['location'] = incoming_msg
-                    admin_state[sender]['step'] = 'time'
-                    resp.message("When is this event? (date and time):")
-                elif step == 'time':
-                    data['time'] = incoming_msg
-                    admin_state[sender]['step'] = 'workers'
-                    resp.message("How many workers are needed? (number only):")
-                elif step == 'workers':
-                    try:
-                        data['required_workers'] = int(incoming_msg)
-                        admin_state[sender]['step'] = 'payment'
-                        resp.message("What is the payment for workers?")
-                    except ValueError:
-                        resp.message("Please enter a valid number for workers needed.")
-                elif step == 'payment':
-                    data['payment'] = incoming_msg
-                    
-                    # Create work ID
-                    work_id = str(uuid.uuid4())[:8]  # Short UUID
-                    
-                    # Store work details
-                    work_opportunities[work_id] = {
-                        "title": data['title'],
-                        "location": data['location'],
-                        "time": data['time'],
-                        "required_workers": data['required_workers'],
-                        "payment": data['payment'],
-                        "selected_workers": [],
-                        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                    
-                    # Set as current work
-                    current_work_id = work_id
-                    
-                    # Clear admin state
-                    del admin_state[sender]
-                    
-                    resp.message(f"✅ Work opportunity created!\n\nID: {work_id}\nEvent: {data['title']}\nLocation: {data['location']}\nTime: {data['time']}\nWorkers: {data['required_workers']}\nPayment: {data['payment']}\n\nWorkers can now reply 'Yes' to confirm.")
-                
-                return str(resp)
-            
-            elif admin_state[sender]['action'] == 'creating_reminder':
-                step = admin_state[sender]['step']
-                data = admin_state[sender]['data']
-                
-                if step == 'message':
-                    data['message'] = incoming_msg
-                    admin_state[sender]['step'] = 'hours'
-                    resp.message("How many hours before the event should this reminder be sent?")
-                elif step == 'hours':
-                    try:
-                        hours = int(incoming_msg)
-                        if hours <= 0:
-                            resp.message("Hours must be a positive number. Please try again:")
-                            return str(resp)
-                        
-                        data['hours'] = hours
-                        work_id = data['work_id']
-                        
-                        # Schedule the reminder
-                        work = work_opportunities[work_id]
-                        event_time_str = work['time']
-                        
-                        # Try to parse the event time - this is a simplification
-                        # In production, you'd want more robust datetime parsing
-                        try:
-                            # For now, just schedule it for X hours from now as a demonstration
-                            reminder_time = datetime.now() + timedelta(hours=hours)
-                            
-                            # Schedule the reminder
-                            scheduler.add_job(
-                                send_reminder,
-                                'date',
-                                run_date=reminder_time,
-                                args=[work_id, data['message']]
-                            )
-                            
-                            # Record the scheduled reminder
-                            if "scheduled_reminders" not in work:
-                                work["scheduled_reminders"] = []
-                            
-                            work["scheduled_reminders"].append({
-                                "message": data['message'],
-                                "hours_before": hours,
-                                "scheduled_for": reminder_time.strftime("%Y-%m-%d %H:%M:%S")
-                            })
-                            
-                            # Clear admin state
-                            del admin_state[sender]
-                            
-                            resp.message(f"✅ Reminder set for {work['title']}!\n\nMessage: {data['message']}\nWill be sent {hours} hours before the event\nScheduled for: {reminder_time.strftime('%Y-%m-%d %H:%M')}")
-                            
-                        except Exception as e:
-                            logger.error(f"Error scheduling reminder: {str(e)}")
-                            resp.message(f"Could not schedule reminder. Please try again later.")
-                            del admin_state[sender]
-                    except ValueError:
-                        resp.message("Please enter a valid number for hours.")
-                
-                return str(resp)
+    resp.message(f"✅ Work opportunity created!\n\nID: {work_id}\nEvent: {data['title']}\nLocation: {data['location']}\nTime: {data['time']}\nWorkers: {data['required_workers']}\nPayment: {data['payment']}\n\nWorkers can now reply 'Yes {work_id}' to confirm.")
+
+# Interactive REMIND
+@router.step('creating_reminder', 'message')
+def remind_step_message(message, session, resp):
+    session['data']['message'] = message.text
+    session['step'] = 'hours'
+    admin_state[message.sender] = session
+    resp.message("How many hours before the event should this reminder be sent?")
+
+@router.step('creating_reminder', 'hours')
+def remind_step_hours(message, session, resp):
+    data = session['data']
+    try:
+        hours = int(message.text)
+    except ValueError:
+        resp.message("Please enter a valid number for hours.")
+        return
+    if hours <= 0:
+        resp.message("Hours must be a positive number. Please try again:")
+        return
+    
+    data['hours'] = hours
+    work_id = data['work_id']
+    
+    # Schedule the reminder relative to the event time
+    work = store.get_work(work_id)
+    
+    try:
+        reminder_time, event_at = schedule_reminder(work_id, work, data['message'], hours)
+        if reminder_time is None:
+            resp.message(f"The event starts at {event_at.strftime('%Y-%m-%d %H:%M')}, less than {hours} hours from now. Please enter fewer hours:")
+            return
         
-        # CREATE command - Start the interactive creation process
-        elif incoming_msg.lower() == "create":
-            admin_state[sender] = {
-                'action': 'creating_event',
-                'step': 'title',
-                'data': {}
-            }
-            resp.message("Let's create a new work opportunity.\n\nWhat's the event name?")
+        # Clear admin state
+        admin_state.pop(message.sender)
         
-        # Original CREATE command - Format: CREATE Event Name, Location, Time, Workers Needed, Payment
-        elif incoming_msg.lower().startswith("create "):
-            try:
-                # Remove the "CREATE " prefix
-                work_details = incoming_msg[7:].split(",")
-                if len(work_details) < 5:
-                    resp.message("Invalid format. Use: CREATE Event Name, Location, Time, Workers Needed, Payment")
-                    return str(resp)
-                
-                title = work_details[0].strip()
-                location = work_details[1].strip()
-                time = work_details[2].strip()
-                try:
-                    required_workers = int(work_details[3].strip())
-                except ValueError:
-                    resp.message("Workers needed must be a number.")
-                    return str(resp)
-                payment = work_details[4].strip()
-                
-                # Create work ID
-                work_id = str(uuid.uuid4())[:8]  # Short UUID
-                
-                # Store work details
-                work_opportunities[work_id] = {
-                    "title": title,
-                    "location": location,
-                    "time": time,
-                    "required_workers": required_workers,
-                    "payment": payment,
-                    "selected_workers": [],
-                    "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-                
-                # Set as current work
-                current_work_id = work_id
-                
-                resp.message(f"✅ Work opportunity created!\n\nID: {work_id}\nEvent: {title}\nLocation: {location}\nTime: {time}\nWorkers: {required_workers}\nPayment: {payment}\n\nWorkers can now reply 'Yes' to confirm.")
-            except Exception as e:
-                logger.error(f"Error creating work: {str(e)}")
-                resp.message("Error creating work opportunity. Please check format and try again.")
+        resp.message(reminder_set_message(work, data['message'], hours, reminder_time, event_at))
         
-        # LIST command - List all work opportunities
-        elif incoming_msg.lower() == "list":
-            if not work_opportunities:
-                resp.message("No work opportunities available.")
-            else:
-                work_list = "📋 Available Work Opportunities:\n\n"
-                for work_id, work in work_opportunities.items():
-                    work_list += f"ID: {work_id}\nEvent: {work['title']}\nTime: {work['time']}\nWorkers: {len(work['selected_workers'])}/{work['required_workers']}\n\n"
-                resp.message(work_list)
+    except Exception as e:
+        logger.error(f"Error scheduling reminder: {str(e)}")
+        resp.message(f"Could not schedule reminder. Please try again later.")
+        admin_state.pop(message.sender)
+
+# CREATE command - Start the interactive creation process
+@router.command('admin', 'CREATE')
+def admin_create(message, resp):
+    admin_state[message.sender] = {
+        'action': 'creating_event',
+        'step': 'title',
+        'data': {}
+    }
+    resp.message("Let's create a new work opportunity.\n\nWhat's the event name?")
+
+# Original CREATE command - Format: CREATE Event Name, Location, Time, Workers Needed, Payment
+@router.command('admin', 'CREATE', args=True)
+def admin_create_one_step(message, resp):
+    try:
+        work_details = message.args.split(",")
+        if len(work_details) < 5:
+            resp.message("Invalid format. Use: CREATE Event Name, Location, Time, Workers Needed, Payment")
+            return
         
-        # SELECT command - Set current work ID for incoming responses
-        elif incoming_msg.lower().startswith("select "):
-            work_id = incoming_msg[7:].strip()
-            if work_id in work_opportunities:
-                current_work_id = work_id
-                work = work_opportunities[work_id]
-                resp.message(f"Selected work ID: {work_id}\nEvent: {work['title']}\nResponses will now be assigned to this event.")
-            else:
-                resp.message(f"Work ID {work_id} not found. Use LIST to see available work opportunities.")
+        title = work_details[0].strip()
+        location = work_details[1].strip()
+        time = work_details[2].strip()
+        try:
+            required_workers = int(work_details[3].strip())
+        except ValueError:
+            resp.message("Workers needed must be a number.")
+            return
+        payment = work_details[4].strip()
         
-        # STATUS command - Check status of a specific work or all work
-        elif incoming_msg.lower() == "status" or incoming_msg.lower() == "count":
-            if current_work_id and current_work_id in work_opportunities:
-                work = work_opportunities[current_work_id]
-                if not work["selected_workers"]:
-                    resp.message(f"No workers selected yet for {work['title']}. Need {work['required_workers']} workers.")
-                else:
-                    worker_numbers = "\n".join([num.replace("whatsapp:", "") for num in work["selected_workers"]])
-                    resp.message(f"Current status for {work['title']}: {len(work['selected_workers'])}/{work['required_workers']} workers selected.\n\nSelected workers:\n{worker_numbers}")
-            else:
-                resp.message("No active work selected. Use SELECT command to choose a work ID.")
+        work_id = create_work(title, location, time, required_workers, payment)
+        
+        resp.message(f"✅ Work opportunity created!\n\nID: {work_id}\nEvent: {title}\nLocation: {location}\nTime: {time}\nWorkers: {required_workers}\nPayment: {payment}\n\nWorkers can now reply 'Yes {work_id}' to confirm.")
+    except Exception as e:
+        logger.error(f"Error creating work: {str(e)}")
+        resp.message("Error creating work opportunity. Please check format and try again.")
+
+# LIST command - List work opportunities one page at a time
+@router.command('admin', 'LIST')
+def admin_list(message, resp):
+    list_page(message.sender, resp)
+
+# LIST with arguments: LIST open|full|past|all, LIST next, LIST page 3,
+# LIST open page 2
+@router.command('admin', 'LIST', args=True)
+def admin_list_filtered(message, resp):
+    words = message.args.lower().split()
+    if words == ['next']:
+        cursor = list_cursors.get(message.sender)
+        if cursor is None or cursor['after'] is None:
+            resp.message("No more work opportunities. Send LIST to start again.")
+        else:
+            list_page(message.sender, resp, cursor['status'], cursor['page'] + 1, cursor['after'])
+        return
+
+    status, page = None, 1
+    if words and words[0] in WORK_STATUSES + ('all',):
+        status = None if words[0] == 'all' else words[0]
+        words = words[1:]
+    if len(words) == 2 and words[0] == 'page' and words[1].isdigit() and int(words[1]) > 0:
+        page = int(words[1])
+        words = []
+    if words:
+        resp.message("Use: LIST, LIST open|full|past|all, LIST page 3 or LIST next")
+        return
+    list_page(message.sender, resp, status, page)
+
+def list_page(sender, resp, status=None, page=1, after=None):
+    """Reply with one page of work opportunities and remember where it ended for LIST next."""
+    offset = 0 if after else (page - 1) * LIST_PAGE_SIZE
+    works, cursor = store.page_works(status, after, offset, LIST_PAGE_SIZE)
+    list_cursors[sender] = {'status': status, 'page': page, 'after': cursor}
+    kind = f"{status.capitalize()} " if status else ""
+    if not works:
+        if page > 1:
+            resp.message(f"No {kind.lower()}work opportunities on page {page}.")
+        else:
+            resp.message(f"No {kind.lower()}work opportunities available.")
+        return
+
+    now = datetime.now().strftime(TIME_FORMAT)
+    parts = [f"📋 {kind}Work Opportunities (page {page}):"]
+    for work_id, work in works:
+        parts.append(f"ID: {work_id}\nEvent: {work['title']}\nTime: {work['time']}\nWorkers: {len(work['selected_workers'])}/{work['required_workers']} ({work_status(work, now)})")
+    if cursor is not None:
+        parts.append("Send LIST next for more.")
+    for chunk in split_message(parts):
+        resp.message(chunk)
+
+# SELECT command - Set the work STATUS and REMIND refer to
+@router.command('admin', 'SELECT', args=True)
+def admin_select(message, resp):
+    work_id = message.args
+    work = store.get_work(work_id)
+    if work is not None:
+        store.set_current_work_id(work_id)
+        resp.message(f"Selected work ID: {work_id}\nEvent: {work['title']}\nSTATUS and REMIND now refer to this event.")
+    else:
+        resp.message(f"Work ID {work_id} not found. Use LIST to see available work opportunities.")
+
+# STATUS command - Check status of the current work
+@router.command('admin', 'STATUS', 'COUNT')
+def admin_status(message, resp):
+    return response_cache.get_or_render(('status',) + current_work_key(), status_text)
+
+def status_text():
+    _, work = current_work()
+    if work is None:
+        return "No active work selected. Use SELECT command to choose a work ID."
+    if not work["selected_workers"]:
+        return f"No workers selected yet for {work['title']}. Need {work['required_workers']} workers."
+    worker_numbers = "\n".join([num.replace("whatsapp:", "") for num in work["selected_workers"]])
+    return f"Current status for {work['title']}: {len(work['selected_workers'])}/{work['required_workers']} workers selected.\n\nSelected workers:\n{worker_numbers}"
+
+# DELETE command - Remove a work opportunity
+@router.command('admin', 'DELETE', args=True)
+def admin_delete(message, resp):
+    work_id = message.args
+    if store.delete_work(work_id):
+        record_stats('record_deleted', work_id)
+        resp.message(f"Work opportunity {work_id} deleted.")
+    else:
+        resp.message(f"Work ID {work_id} not found.")
+
+# WORKER command - Show every work a worker is selected for
+@router.command('admin', 'WORKER', args=True)
+def admin_worker(message, resp):
+    worker = worker_number(message.args)
+    if worker is None:
+        resp.message(INVALID_NUMBER)
+        return
+    works = store.worker_works(worker)
+    number = worker.replace("whatsapp:", "")
+    if not works:
+        resp.message(f"{number} is not selected for any work opportunity.")
+        return
+    now = datetime.now().strftime(TIME_FORMAT)
+    parts = [f"👤 {number} is selected for {len(works)} work opportunities:"]
+    for work_id, work in works:
+        position = work['selected_workers'].index(worker) + 1
+        parts.append(f"ID: {work_id}\nEvent: {work['title']}\nTime: {work['time']}\nWorker #{position} of {work['required_workers']} ({work_status(work, now)})")
+    for chunk in split_message(parts):
+        resp.message(chunk)
+
+# E.164: a + and 8 to 15 digits, country code first
+PHONE_NUMBER = re.compile(r'\+\d{8,15}')
+INVALID_NUMBER = "Please send the number with its country code, for example +919876543210."
+
+def worker_number(text):
+    """Turn a phone number as typed by the admin into the sender format, e.g. whatsapp:+919353692621.
+
+    Returns None if it is not a phone number.
+    """
+    number = "".join(text.lower().replace("whatsapp:", "").replace("-", " ").split())
+    if not number.startswith("+"):
+        number = "+" + number
+    if not PHONE_NUMBER.fullmatch(number):
+        return None
+    return "whatsapp:" + number
+
+# CANCEL command - Cancel current operation (also works in the middle of one)
+@router.command('admin', 'CANCEL', interrupts_flow=True)
+def admin_cancel(message, resp):
+    if admin_state.pop(message.sender) is not None:
+        resp.message("Operation cancelled.")
+    else:
+        resp.message("No active operation to cancel.")
+
+# REMIND command - Start interactive reminder creation
+@router.command('admin', 'REMIND')
+def admin_remind(message, resp):
+    current_work_id, work = current_work()
+    if work is None:
+        resp.message("No active work selected. Use SELECT command to choose a work ID first.")
+    else:
+        admin_state[message.sender] = {
+            'action': 'creating_reminder',
+            'step': 'message',
+            'data': {
+                'work_id': current_work_id
+            }
+        }
+        resp.message(f"Setting a reminder for '{work['title']}'.\n\nWhat message should be sent to the workers?")
+
+# REMIND with arguments: REMIND work_id, message, hours
+@router.command('admin', 'REMIND', args=True)
+def admin_remind_one_step(message, resp):
+    try:
+        reminder_details = message.args.split(",")
+        if len(reminder_details) < 3:
+            resp.message("Invalid format. Use: REMIND work_id, message, hours")
+            return
         
-        # DELETE command - Remove a work opportunity
-        elif incoming_msg.lower().startswith("delete "):
-            work_id = incoming_msg[7:].strip()
-            if work_id in work_opportunities:
-                del work_opportunities[work_id]
-                if current_work_id == work_id:
-                    current_work_id = None
-                resp.message(f"Work opportunity {work_id} deleted.")
-            else:
-                resp.message(f"Work ID {work_id} not found.")
+        work_id = reminder_details[0].strip()
+        reminder_message = reminder_details[1].strip()
         
-        # CANCEL command - Cancel current operation
-        elif incoming_msg.lower() == "cancel":
-            if sender in admin_state:
-                del admin_state[sender]
-                resp.message("Operation cancelled.")
-            else:
-                resp.message("No active operation to cancel.")
+        try:
+            hours = int(reminder_details[2].strip())
+            if hours <= 0:
+                resp.message("Hours must be a positive number.")
+                return
+        except ValueError:
+            resp.message("Hours must be a number.")
+            return
         
-        # REMIND command - Start interactive reminder creation
-        elif incoming_msg.lower() == "remind":
-            if not scheduler_available:
-                resp.message("Reminder functionality is not available on this server.")
-                return str(resp)
-                
-            if not current_work_id or current_work_id not in work_opportunities:
-                resp.message("No active work selected. Use SELECT command to choose a work ID first.")
-            else:
-                work = work_opportunities[current_work_id]
-                admin_state[sender] = {
-                    'action': 'creating_reminder',
-                    'step': 'message',
-                    'data': {
-                        'work_id': current_work_id
-                    }
-                }
-                resp.message(f"Setting a reminder for '{work['title']}'.\n\nWhat message should be sent to the workers?")
+        work = store.get_work(work_id)
+        if work is None:
+            resp.message(f"Work ID {work_id} not found. Use LIST to see available work opportunities.")
+            return
         
-        # REMIND with arguments: REMIND work_id, message, hours
-        elif incoming_msg.lower().startswith("remind "):
-            if not scheduler_available:
-                resp.message("Reminder functionality is not available on this server.")
-                return str(resp)
-                
-            try:
-                # Remove the "REMIND " prefix
-                reminder_details = incoming_msg[7:].split(",")
-                if len(reminder_details) < 3:
-                    resp.message("Invalid format. Use: REMIND work_id, message, hours")
-                    return str(resp)
-                
-                work_id = reminder_details[0].strip()
-                message = reminder_details[1].strip()
-                
-                try:
-                    hours = int(reminder_details[2].strip())
-                    if hours <= 0:
-                        resp.message("Hours must be a positive number.")
-                        return str(resp)
-                except ValueError:
-                    resp.message("Hours must be a number.")
-                    return str(resp)
-                
-                if work_id not in work_opportunities:
-                    resp.message(f"Work ID {work_id} not found. Use LIST to see available work opportunities.")
-                    return str(resp)
-                
-                work = work_opportunities[work_id]
-                
-                # Schedule the reminder (same logic as in the interactive method)
-                reminder_time = datetime.now() + timedelta(hours=hours)
-                
-                # Schedule the reminder
-                scheduler.add_job(
-                    send_reminder,
-                    'date',
-                    run_date=reminder_time,
-                    args=[work_id, message]
-                )
-                
-                # Record the scheduled reminder
-                if "scheduled_reminders" not in work:
-                    work["scheduled_reminders"] = []
-                
-                work["scheduled_reminders"].append({
-                    "message": message,
-                    "hours_before": hours,
-                    "scheduled_for": reminder_time.strftime("%Y-%m-%d %H:%M:%S")
-                })
-                
-                resp.message(f"✅ Reminder set for {work['title']}!\n\nMessage: {message}\nWill be sent {hours} hours before the event\nScheduled for: {reminder_time.strftime('%Y-%m-%d %H:%M')}")
-                
-            except Exception as e:
-                logger.error(f"Error setting reminder: {str(e)}")
-                resp.message("Error setting reminder. Please check format and try again.")
+        # Schedule the reminder (same logic as in the interactive method)
+        reminder_time, event_at = schedule_reminder(work_id, work, reminder_message, hours)
+        if reminder_time is None:
+            resp.message(f"The event starts at {event_at.strftime('%Y-%m-%d %H:%M')}, less than {hours} hours from now.")
+            return
         
-        # HELP command - Show available commands
-        elif incoming_msg.lower() == "help":
-            help_text = "📱 Admin Commands:\n\n"
-            help_text += "CREATE - Start interactive work creation\n\n"
-            help_text += "CREATE Event Name, Location, Time, Workers Needed, Payment - Create new work in one step\n\n"
-            help_text += "LIST - Show all work opportunities\n\n"
-            help_text += "SELECT work_id - Set active work for responses\n\n"
-            help_text += "STATUS - Check current workers for active work\n\n"
-            help_text += "DELETE work_id - Remove a work opportunity\n\n"
-            help_text += "CANCEL - Cancel current operation\n\n"
-            
-            # Only show reminder commands if scheduler is available
-            if scheduler_available:
-                help_text += "REMIND - Start setting a reminder for workers\n\n"
-                help_text += "REMIND work_id, message, hours - Set a reminder in one step\n\n"
-            
-            help_text += "HELP - Show this help message"
-            resp.message(help_text)
+        resp.message(reminder_set_message(work, reminder_message, hours, reminder_time, event_at))
         
-        # Unknown admin command
+    except Exception as e:
+        logger.error(f"Error setting reminder: {str(e)}")
+        resp.message("Error setting reminder. Please check format and try again.")
+
+# BROADCAST work_id [tag ...] - Announce a work to the workers with all the tags
+@router.command('admin', 'BROADCAST', args=True)
+def admin_broadcast(message, resp):
+    work_id, *tags = message.args.replace(",", " ").split()
+    work = store.get_work(work_id)
+    if work is None:
+        resp.message(f"Work ID {work_id} not found. Use LIST to see available work opportunities.")
+        return
+    status = work_status(work, datetime.now().strftime(TIME_FORMAT))
+    if status != OPEN:
+        resp.message(f"{work['title']} is {status}, so there is nothing to announce.")
+        return
+    broadcast = roster.create_broadcast(work_id, tags)
+    broadcaster.notify()
+    segment = f" tagged {', '.join(broadcast['tags'].split())}" if tags else ""
+    resp.message(f"📣 Announcing {work['title']} to {broadcast['total']} workers{segment}, {BROADCAST_BATCH_SIZE} at a time. It stops once the work is full.\n\nSend BROADCASTS to see progress.")
+
+# BROADCASTS - Progress of the latest broadcasts
+@router.command('admin', 'BROADCASTS')
+def admin_broadcasts(message, resp):
+    broadcasts = roster.recent_broadcasts()
+    if not broadcasts:
+        resp.message("No broadcasts yet. Use BROADCAST work_id to announce a work.")
+        return
+    parts = ["📣 Latest broadcasts:"]
+    for broadcast in broadcasts:
+        work = store.get_work(broadcast['work_id'])
+        title = work['title'] if work is not None else broadcast['work_id']
+        segment = f" ({', '.join(broadcast['tags'].split())})" if broadcast['tags'] else ""
+        state = broadcast['status'] + (f": {broadcast['reason']}" if broadcast['reason'] else "")
+        parts.append(f"{title}{segment}\nSent {broadcast['sent']} of {broadcast['total']} - {state}")
+    for chunk in split_message(parts):
+        resp.message(chunk)
+
+# TAG / UNTAG number tag ... - Skills, area or reliability tags for a worker
+@router.command('admin', 'TAG', args=True)
+def admin_tag(message, resp):
+    number, *tags = message.args.replace(",", " ").split()
+    worker = worker_number(number)
+    if not tags:
+        resp.message("Use: TAG number tag1 tag2 ... (for example TAG +919876543210 waiter north)")
+        return
+    if worker is None:
+        resp.message(INVALID_NUMBER)
+        return
+    roster.tag(worker, tags)
+    resp.message(f"{worker.replace('whatsapp:', '')} is tagged: {', '.join(roster.tags(worker))}")
+
+@router.command('admin', 'UNTAG', args=True)
+def admin_untag(message, resp):
+    number, *tags = message.args.replace(",", " ").split()
+    worker = worker_number(number)
+    if worker is None:
+        resp.message(INVALID_NUMBER)
+        return
+    roster.untag(worker, tags)
+    remaining = roster.tags(worker)
+    resp.message(f"{worker.replace('whatsapp:', '')} is tagged: {', '.join(remaining)}" if remaining
+                 else f"{worker.replace('whatsapp:', '')} has no tags.")
+
+# ROSTER [tag ...] - Size of the roster, or of a segment of it
+@router.command('admin', 'ROSTER')
+def admin_roster(message, resp):
+    counts = roster.tag_counts()
+    tags = "\n".join(f"{tag}: {count}" for tag, count in counts.items())
+    resp.message(f"👥 {roster.count()} workers in the roster." + (f"\n\nTags:\n{tags}" if tags else ""))
+
+@router.command('admin', 'ROSTER', args=True)
+def admin_roster_segment(message, resp):
+    tags = message.args.replace(",", " ").split()
+    resp.message(f"👥 {roster.count(tags)} workers tagged {', '.join(tag.lower() for tag in tags)}.")
+
+# HISTORY YYYY-MM lists at most this many works
+HISTORY_MONTH_LIMIT = 50
+
+# HISTORY [YYYY-MM] - Archived past works, from the archive index only
+@router.command('admin', 'HISTORY')
+def admin_history(message, resp):
+    months = archive.months()
+    if not months:
+        resp.message(f"The archive is empty. Works move there {ARCHIVE_AFTER_DAYS:g} days after their event.")
+        return
+    parts = ["🗄️ Latest archived work:"]
+    parts.extend(archived_summary(row) for row in archive.history(limit=LIST_PAGE_SIZE))
+    parts.append("Archived per month:\n" + "\n".join(f"{month}: {count}" for month, count in months.items()))
+    parts.append("Send HISTORY YYYY-MM for one month, or ARCHIVE work_id for the details of a work.")
+    for chunk in split_message(parts):
+        resp.message(chunk)
+
+@router.command('admin', 'HISTORY', args=True)
+def admin_history_month(message, resp):
+    month = message.args.strip()
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        resp.message("Use: HISTORY or HISTORY YYYY-MM (for example HISTORY 2025-06)")
+        return
+    rows = archive.history(month, limit=HISTORY_MONTH_LIMIT)
+    if not rows:
+        resp.message(f"No archived work for {month}.")
+        return
+    total = archive.count(month)
+    parts = [f"🗄️ Archived work for {month} ({total}):"]
+    parts.extend(archived_summary(row) for row in rows)
+    if total > len(rows):
+        parts.append(f"...and {total - len(rows)} more.")
+    for chunk in split_message(parts):
+        resp.message(chunk)
+
+def archived_summary(row):
+    return f"ID: {row['work_id']}\nEvent: {row['title']}\nTime: {row['time']}\nWorkers: {row['selected']}/{row['required_workers']}"
+
+# ARCHIVE work_id - Read one archived work back from its segment
+@router.command('admin', 'ARCHIVE', args=True)
+def admin_archive(message, resp):
+    work_id = message.args.strip()
+    try:
+        work = archive.get_work(work_id)
+    except ArchiveError as e:
+        logger.error(f"Error reading archived work {work_id}: {str(e)}")
+        resp.message(f"Could not read work {work_id} from the archive.")
+        return
+    if work is None:
+        resp.message(f"Work ID {work_id} is not in the archive. Send HISTORY to see archived work.")
+        return
+    workers = "\n".join(worker.replace("whatsapp:", "") for worker in work['selected_workers']) or "None"
+    parts = [f"🗄️ Archived work {work_id}:\n\nEvent: {work['title']}\nLocation: {work['location']}\nTime: {work['time']}\nPayment: {work['payment']}\nWorkers: {len(work['selected_workers'])}/{work['required_workers']}",
+             f"Selected workers:\n{workers}"]
+    if work.get('reminders'):
+        parts.append(f"Reminders sent: {len(work['reminders'])}")
+    for chunk in split_message(parts):
+        resp.message(chunk)
+
+# STATS [work_id] - How fast work fills and who takes it, from running counters
+@router.command('admin', 'STATS')
+def admin_stats(message, resp):
+    summary = staffing_stats.summary()
+    if summary is None:
+        resp.message("No work opportunities counted yet.")
+        return
+    parts = ["📊 Staffing stats (all time):\n" + period_text(summary)]
+    for week in staffing_stats.weeks(limit=4):
+        parts.append(f"Week {week['period']}:\n" + period_text(week))
+    top = staffing_stats.top_workers(limit=5)
+    if top:
+        parts.append("Most claims:\n" + "\n".join(f"{worker.replace('whatsapp:', '')}: {claims}" for worker, claims in top))
+    parts.append("Send STATS work_id for one work.")
+    for chunk in split_message(parts):
+        resp.message(chunk)
+
+@router.command('admin', 'STATS', args=True)
+def admin_stats_work(message, resp):
+    work_id = message.args.strip()
+    work_stats = staffing_stats.work(work_id)
+    if work_stats is None:
+        resp.message(f"No stats for work ID {work_id}.")
+        return
+    resp.message(f"📊 Work {work_id} (posted in week {work_stats['week']}):\n"
+                 f"Claims: {work_stats['claims']}/{work_stats['required_workers']} ({percent(work_stats['fill_rate'])})\n"
+                 f"First claim after: {duration_text(work_stats['time_to_first_claim'])}\n"
+                 f"Full after: {duration_text(work_stats['time_to_full'])}")
+
+def period_text(period):
+    return (f"Works: {period['works']}, {period['filled']} filled ({percent(period['filled_rate'])})\n"
+            f"Positions filled: {period['claims']}/{period['required_workers']} ({percent(period['fill_rate'])})\n"
+            f"Average time to first claim: {duration_text(period['avg_time_to_first_claim'])}\n"
+            f"Average time to full: {duration_text(period['avg_time_to_full'])}")
+
+def percent(rate):
+    return "-" if rate is None else f"{rate:.0%}"
+
+def duration_text(seconds):
+    """Format seconds as e.g. 45s, 12m, 3h 20m or 2d 5h; '-' when unknown."""
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes = seconds // 60
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes}m"
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h"
+
+# HELP command - Show available commands
+@router.command('admin', 'HELP')
+def admin_help(message, resp):
+    return response_cache.get_or_render(('help',), help_text)
+
+def help_text():
+    help_text = "📱 Admin Commands:\n\n"
+    help_text += "CREATE - Start interactive work creation\n\n"
+    help_text += "CREATE Event Name, Location, Time, Workers Needed, Payment - Create new work in one step\n\n"
+    help_text += "LIST - Show work opportunities, a page at a time\n\n"
+    help_text += "LIST open|full|past - Show only open, full or past work\n\n"
+    help_text += "LIST next / LIST page 3 - Show the next page or a given page\n\n"
+    help_text += "SELECT work_id - Set the work STATUS and REMIND refer to\n\n"
+    help_text += "STATUS - Check current workers for active work\n\n"
+    help_text += "DELETE work_id - Remove a work opportunity\n\n"
+    help_text += "WORKER number - Show the work a worker is selected for\n\n"
+    help_text += "CANCEL - Cancel current operation\n\n"
+    help_text += "REMIND - Start setting a reminder for workers\n\n"
+    help_text += "REMIND work_id, message, hours - Set a reminder in one step\n\n"
+    help_text += "BROADCAST work_id [tags] - Announce a work to the roster, or to workers with all the tags\n\n"
+    help_text += "BROADCASTS - Show broadcast progress\n\n"
+    help_text += "TAG / UNTAG number tags - Tag workers by skill, area or reliability\n\n"
+    help_text += "ROSTER [tags] - Count the workers in the roster\n\n"
+    help_text += "HISTORY [YYYY-MM] - Show archived past work\n\n"
+    help_text += "ARCHIVE work_id - Show an archived work\n\n"
+    help_text += "STATS [work_id] - Show how fast work fills and who takes it\n\n"
+    help_text += "HELP - Show this help message"
+    return help_text
+
+# Unknown admin command
+@router.fallback('admin')
+def admin_unknown(message, resp):
+    return response_cache.get_or_render(
+        ('admin_unknown',), lambda: "Unknown admin command. Send HELP to see available commands."
+    )
+
+# Worker confirming availability with "Yes" - claims the only open work,
+# or lists the open works when there are several
+@router.command('worker', 'YES')
+def worker_yes(message, resp):
+    versions = store.open_work_versions()
+    if not versions:
+        resp.message("Sorry, there's no open work opportunity to respond to.")
+    elif len(versions) == 1:
+        work_id = versions[0][0]
+        work = store.get_work(work_id)
+        if work is None:
+            resp.message("Sorry, this work opportunity is no longer available.")
         else:
-            resp.message("Unknown admin command. Send HELP to see available commands.")
+            claim_work(message.sender, work_id, work, resp)
+    else:
+        return open_works_reply(message.sender, versions)
+
+# "Yes 2" for the second work INFO listed, or "Yes <work ID>"
+@router.command('worker', 'YES', args=True)
+def worker_yes_choice(message, resp):
+    work_id = chosen_work_id(message.sender, message.args.lstrip('#'))
+    work = store.get_work(work_id) if work_id else None
+    if work is None:
+        resp.message(f"There is no work opportunity {message.args}. Reply 'Info' to see the open ones.")
+        return
+    claim_work(message.sender, work_id, work, resp)
+
+def chosen_work_id(sender, choice):
+    """Turn what a worker wrote after YES into a work ID, or None.
+
+    choice is a work ID, in any case, or a number from the list INFO last
+    showed the worker (or from the current open works, if they have not
+    been shown one lately).
+    """
+    if store.work_version(choice) is not None:
+        return choice
+    # Work IDs are generated in lower case
+    if choice != choice.lower() and store.work_version(choice.lower()) is not None:
+        return choice.lower()
+    if choice.isdigit():
+        choices = info_choices.get(sender)
+        if choices is None:
+            choices = [work_id for work_id, _ in store.open_work_versions()]
+        if 1 <= int(choice) <= len(choices):
+            return choices[int(choice) - 1]
+    return None
+
+def claim_work(sender, work_id, work, resp):
+    """Give sender a slot on a work and reply with the outcome."""
+    if work_status(work, datetime.now().strftime(TIME_FORMAT)) == PAST:
+        resp.message(f"Sorry, {work['title']} has already taken place.")
+        return
+    
+    # Claim a slot - the capacity check and the claim are one atomic step
+    outcome, position = store.claim_slot(work_id, sender)
     
-    # Worker responses
+    # Check if the sender is already selected
+    if outcome == ALREADY_SELECTED:
+        resp.message(f"You are already selected for {work['title']}.")
+    # Check if we've reached the limit
+    elif outcome == FULL:
+        resp.message(f"Sorry, {work['title']} is full. Reply 'Info' to see the open work.")
+    elif outcome == NOT_FOUND:
+        resp.message("Sorry, this work opportunity is no longer available.")
     else:
-        # Check if the message is "Yes" (case-insensitive)
-        if incoming_msg.lower() == "yes":
-            # Check if there's an active work opportunity
-            if not current_work_id or current_work_id not in work_opportunities:
-                resp.message("Sorry, there's no active work opportunity to respond to.")
-                return str(resp)
-            
-            work = work_opportunities[current_work_id]
-            
-            # Check if the sender is already selected
-            if sender in work["selected_workers"]:
-                resp.message(f"You are already selected for {work['title']}.")
-            # Check if we've reached the limit
-            elif len(work["selected_workers"]) >= work["required_workers"]:
-                resp.message(f"Sorry, {work['title']} is full.")
-            else:
-                work["selected_workers"].append(sender)
-                resp.message(f"You have been selected for {work['title']}!\n\nLocation: {work['location']}\nTime: {work['time']}\nPayment: {work['payment']}\n\nYou are worker #{len(work['selected_workers'])} of {work['required_workers']}.")
-                
-                # Notify admin of new selection
-                # Note: In a production app, you'd use the Twilio client to send this
-                logger.info(f"New worker {sender} selected for {work['title']}. {len(work['selected_workers'])}/{work['required_workers']} filled.")
+        record_stats('record_claim', work_id, sender)
+        resp.message(f"You have been selected for {work['title']}!\n\nLocation: {work['location']}\nTime: {work['time']}\nPayment: {work['payment']}\n\nYou are worker #{position} of {work['required_workers']}.")
         
-        # Worker requesting info
-        elif incoming_msg.lower() == "info":
-            if current_work_id and current_work_id in work_opportunities:
-                work = work_opportunities[current_work_id]
-                resp.message(f"📋 Current opportunity:\n\nEvent: {work['title']}\nLocation: {work['location']}\nTime: {work['time']}\nPayment: {work['payment']}\nPositions: {len(work['selected_workers'])}/{work['required_workers']} filled\n\nReply 'Yes' to confirm your availability.")
-            else:
-                resp.message("No active work opportunity at the moment.")
-        else:
-            resp.message("Please respond with 'Yes' to confirm your availability or 'Info' for work details.")
+        # Notify admin of new selection, in the next digest (or now if the work is full)
+        logger.info(f"New worker {sender} selected for {work['title']}. {position}/{work['required_workers']} filled.")
+        try:
+            admin_digest.claimed(work_id, work['title'], sender, position, work['required_workers'])
+        except Exception as e:
+            logger.error(f"Error queueing admin notification: {str(e)}")
+
+# Worker requesting info - the open works, numbered for "Yes 2"
+@router.command('worker', 'INFO')
+def worker_info(message, resp):
+    return open_works_reply(message.sender, store.open_work_versions())
+
+def open_works_reply(sender, versions):
+    """Reply listing the open works, and remember their numbers for sender.
+
+    versions are the open works' (work_id, version) pairs, which are all the
+    cache key needs; the works themselves are only read to render a miss.
+    """
+    info_choices[sender] = [work_id for work_id, _ in versions]
+    key = ('info',) + tuple(versions)
+    return response_cache.get_or_render(key, lambda: info_text(listed_works(versions)))
+
+def listed_works(versions):
+    """The works versions lists, in its order, skipping any deleted since."""
+    works = dict(store.open_works())
+    listed = [(work_id, works.get(work_id) or store.get_work(work_id)) for work_id, _ in versions]
+    return [(work_id, work) for work_id, work in listed if work is not None]
+
+def info_text(works):
+    if not works:
+        return "No open work opportunities at the moment."
+    if len(works) == 1:
+        work = works[0][1]
+        return f"📋 Current opportunity:\n\nEvent: {work['title']}\nLocation: {work['location']}\nTime: {work['time']}\nPayment: {work['payment']}\nPositions: {len(work['selected_workers'])}/{work['required_workers']} filled\n\nReply 'Yes' to confirm your availability."
+    parts = [f"📋 {len(works)} open opportunities:"]
+    for number, (work_id, work) in enumerate(works, 1):
+        parts.append(f"{number}. {work['title']}\nLocation: {work['location']}\nTime: {work['time']}\nPayment: {work['payment']}\nPositions: {len(work['selected_workers'])}/{work['required_workers']} filled")
+    parts.append("Reply 'Yes 1' to confirm for the first one, 'Yes 2' for the second, and so on.")
+    return split_message(parts)
+
+# Worker asking for their upcoming confirmed gigs
+@router.command('worker', 'MY')
+def worker_my(message, resp):
+    now = datetime.now().strftime(TIME_FORMAT)
+    works = [(work_id, work) for work_id, work in store.worker_works(message.sender)
+             if work_status(work, now) != PAST]
+    if not works:
+        resp.message("You have no upcoming confirmed work. Reply 'Info' to see the open opportunities.")
+        return
+    parts = ["✅ Your upcoming work:"]
+    for _, work in works:
+        position = work['selected_workers'].index(message.sender) + 1
+        parts.append(f"Event: {work['title']}\nLocation: {work['location']}\nTime: {work['time']}\nPayment: {work['payment']}\nYou are worker #{position} of {work['required_workers']}.")
+    for chunk in split_message(parts):
+        resp.message(chunk)
+
+@router.fallback('worker')
+def worker_unknown(message, resp):
+    return response_cache.get_or_render(
+        ('worker_unknown',),
+        lambda: "Please respond with 'Info' to see the open work, 'Yes' or 'Yes 2' to confirm your availability, or 'My' for your confirmed work."
+    )
+
+@bp.route('/whatsapp', methods=['POST'])
+def whatsapp():
+    # Get the message and sender's phone number, tokenized once
+    message = Message(request.values.get('Body', ''), request.values.get('From', ''))
+    role = 'admin' if workspace().is_admin(message.sender) else 'worker'
+    sid = request.values.get('MessageSid')
+    # A retry of a message already answered gets the same answer, and does
+    # not count against the sender's limit
+    reply = reply_log.lookup(sid) if sid else None
+    if reply is not None:
+        retried_requests.inc()
+        logger.info(f"Retry of {sid} from {message.sender}, replaying the original reply")
+        return reply
+    allowed, first_shed = rate_limiters[role].check(message.sender)
+    if not allowed:
+        # No logging, storage or further dedup work for a flood
+        if first_shed:
+            return response_cache.get_or_render(('rate_limited',), lambda: "You're sending messages too quickly. Please wait a minute and try again.")
+        return response_cache.get_or_render(('empty',), lambda: [])
+    start = time.perf_counter()
+    try:
+        if slow_profiler is None:
+            return handle_once(role, message, sid)
+        with slow_profiler.track(f"{role}:{message.keyword}"):
+            return handle_once(role, message, sid)
+    finally:
+        request_seconds.observe(time.perf_counter() - start, role)
+
+def handle_once(role, message, sid):
+    """Handle a message, or replay the reply already sent for its MessageSid."""
+    if not sid:
+        return handle_message(role, message)
+    first, reply = reply_log.begin(sid)
+    if not first:
+        retried_requests.inc()
+        logger.info(f"Retry of {sid} from {message.sender}, replaying the original reply")
+        # Still being handled by the first request: reply with nothing rather than handle it twice
+        return reply if reply is not None else str(MessagingResponse())
+    try:
+        reply = handle_message(role, message)
+    except Exception:
+        reply_log.abandon(sid)
+        raise
+    reply_log.finish(sid, reply)
+    return reply
+
+def handle_message(role, message):
+    logger.info(f"Received message: '{message.text}' from {message.sender}")
+    
+    # Everyone who messages the bot can be reached by BROADCAST
+    if role == 'worker' and message.sender:
+        roster.add(message.sender)
+    
+    # Initialize response
+    resp = MessagingResponse()
+    
+    # Admin commands and conversations, or worker responses. Only admins
+    # have sessions, so workers' messages never read the session store
+    session = admin_state.get(message.sender) if role == 'admin' else None
+    reply = router.dispatch(role, message, session, resp)
+    if reply is not None:
+        # A cached read-only reply: nothing changed, so there is nothing to log
+        return reply
     
     # Log the current state after each request
-    if current_work_id and current_work_id in work_opportunities:
-        work = work_opportunities[current_work_id]
+    _, work = current_work()
+    if work is not None:
         logger.info(f"Current workers for {work['title']}: {len(work['selected_workers'])}/{work['required_workers']}")
     
-    # Save data after every request
-    save_data()
-    
     return str(resp)
 
+@bp.route('/timings', methods=['GET'])
+def timings():
+    """Per-command handling time counters."""
+    return jsonify(router.stats())
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Metrics of every worker process in the Prometheus text format."""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@bp.route('/stats', methods=['GET'])
+def stats_endpoint():
+    """Staffing analytics: all time, latest weeks and top workers, plus one work or worker if asked for."""
+    result = {
+        "all_time": staffing_stats.summary(),
+        "weeks": staffing_stats.weeks(limit=request.args.get('weeks', 8, type=int)),
+        "top_workers": [{"worker": worker, "claims": claims}
+                        for worker, claims in staffing_stats.top_workers(limit=request.args.get('top', 10, type=int))]
+    }
+    work_id = request.args.get('work_id')
+    if work_id:
+        result["work"] = staffing_stats.work(work_id)
+        if result["work"] is not None:
+            result["work"]["claim_times"] = [{"worker": worker, "claimed_at": claimed_at}
+                                             for worker, claimed_at in staffing_stats.claims(work_id)]
+    worker = request.args.get('worker')
+    if worker:
+        number = worker_number(worker)
+        if number is None:
+            return jsonify({"error": "Invalid worker number"}), 400
+        result["worker"] = {"worker": number, "claims": staffing_stats.worker_claims(number)}
+    return jsonify(result)
+
+@bp.route('/slow_requests', methods=['GET'])
+def slow_requests():
+    """Sampled stacks of the latest slow /whatsapp requests (PROFILE_SLOW_REQUESTS_MS)."""
+    if slow_profiler is None:
+        return jsonify({"error": "Set PROFILE_SLOW_REQUESTS_MS to profile slow requests"}), 404
+    return jsonify(list(slow_profiler.reports))
+
 # Add a /backup endpoint to manually trigger a backup
-@app.route('/backup', methods=['GET'])
+@bp.route('/backup', methods=['GET'])
 def backup():
+    # The backup thread takes it, so the request does not wait for it
+    backup_manager.request()
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f'catering_data_backup_{timestamp}.json'
-        
-        data = {
-            'work_opportunities': work_opportunities,
-            'current_work_id': current_work_id,
-            'timestamp': timestamp
-        }
-        
-        with open(backup_filename, 'w') as f:
-            json.dump(data, f)
-        
-        return jsonify({
-            "status": "success",
-            "message": f"Backup created: {backup_filename}"
-        })
+        backups = backup_manager.manifest()
     except Exception as e:
         return jsonify({
             "status": "error",
-            "message": f"Backup failed: {str(e)}"
+            "message": f"Could not read the backup list: {str(e)}"
         }), 500
+    return jsonify({
+        "status": "scheduled",
+        "message": f"A backup will be written to {workspace().path(BACKUP_DIR)}",
+        "backups": backups
+    }), 202
+
+@bp.route('/restore', methods=['POST'])
+def restore():
+    """Replace all data with a backup (the latest one unless "name" is given)."""
+    if not BACKUP_TOKEN:
+        return jsonify({"status": "error", "message": "Restore is disabled. Set BACKUP_TOKEN to enable it."}), 403
+    supplied = request.headers.get('Authorization', '').replace('Bearer ', '', 1)
+    if not hmac.compare_digest(supplied.encode('utf-8'), BACKUP_TOKEN.encode('utf-8')):
+        return jsonify({"status": "error", "message": "Invalid token."}), 401
+
+    name = request.values.get('name')
+    if not name:
+        backups = backup_manager.manifest()
+        if not backups:
+            return jsonify({"status": "error", "message": "No backups available."}), 404
+        name = backups[-1]['name']
+    try:
+        data = backup_manager.restore(name)
+    except BackupError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error restoring backup {name}: {str(e)}")
+        return jsonify({"status": "error", "message": f"Restore failed: {str(e)}"}), 500
+    # The analytics count the restored works in place of the replaced ones
+    record_stats('rebuild', data['work_opportunities'].items(), archive.archived)
+    list_cursors.clear()
+    info_choices.clear()
+    response_cache.clear()
+    api_cache.clear()
+    return jsonify({
+        "status": "success",
+        "message": f"Restored {name}",
+        "work_opportunities": len(data['work_opportunities'])
+    })
+
+# Read-only JSON API. Every response carries an ETag made of the storage
+# state version (or the work's version) and is served from a serialization
+# cached under that ETag, so it is only rebuilt after a change. A client that
+# sends the ETag back in If-None-Match gets 304 Not Modified; with ?wait=N it
+# is held for up to N seconds (at most API_MAX_WAIT) until something changes
+# - long polling. At most API_MAX_WAITERS requests per process wait at once;
+# others get their answer right away
+API_MAX_WAIT = float(os.environ.get('API_MAX_WAIT', '25'))
+API_POLL_INTERVAL = float(os.environ.get('API_POLL_INTERVAL', '0.5'))
+API_MAX_WAITERS = int(os.environ.get('API_MAX_WAITERS', '4'))
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+api_cache = per_tenant('api_cache', lambda: ResponseCache(RESPONSE_CACHE_SIZE, render=json.dumps))
+api_waiters = threading.BoundedSemaphore(API_MAX_WAITERS)
+
+def state_etag():
+    return f"{store.state_epoch}.{store.state_version()}"
+
+def work_etag(work_id):
+    version = store.work_version(work_id)
+    return f"{store.state_epoch}.{work_id}.{version}" if version is not None else None
+
+def api_reply(key, current_etag, build):
+    """Reply with build()'s JSON under the ETag current_etag() returns, or 304 if the client has it.
+
+    current_etag() returning None means the resource does not exist (404).
+    """
+    etag = current_etag()
+    wait = min(request.args.get('wait', 0, type=float), API_MAX_WAIT)
+    if etag is not None and wait > 0 and request.if_none_match.contains(etag) and api_waiters.acquire(blocking=False):
+        try:
+            deadline = time.monotonic() + wait
+            while etag is not None and request.if_none_match.contains(etag) and time.monotonic() < deadline:
+                time.sleep(max(0, min(API_POLL_INTERVAL, deadline - time.monotonic())))
+                etag = current_etag()
+        finally:
+            api_waiters.release()
+    if etag is None:
+        return jsonify({"error": "Not found"}), 404
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(api_cache.get_or_render(key + (etag,), build), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def work_json(work_id, work):
+    # Counts only: the API is not authenticated, so workers' numbers stay out
+    return {
+        "work_id": work_id,
+        "title": work["title"],
+        "location": work.get("location"),
+        "time": work.get("time"),
+        "event_at": work.get("event_at"),
+        "payment": work.get("payment"),
+        "created_at": work.get("created_at"),
+        "selected_workers": len(work["selected_workers"]),
+        "required_workers": work["required_workers"],
+        "is_full": len(work["selected_workers"]) >= work["required_workers"]
+    }
+
+def parse_cursor(after):
+    """Return the (created_at, work_id) cursor a page's "next" stands for, or raise ValueError."""
+    created_at, separator, work_id = after.rpartition('|')
+    if not separator or not work_id:
+        raise ValueError(f"Invalid cursor: {after}")
+    # Works without a creation time sort first, under an empty one
+    if created_at:
+        datetime.strptime(created_at, TIME_FORMAT)
+    return created_at, work_id
+
+@bp.route('/api/works', methods=['GET'])
+def api_works():
+    """Works in creation order, a page at a time: ?after=<next from the previous page>&limit=50."""
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    after = request.args.get('after') or None
+    try:
+        cursor = parse_cursor(after) if after else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    def build():
+        works, next_cursor = store.page_works(after=cursor, limit=limit)
+        return {
+            "works": [work_json(work_id, work) for work_id, work in works],
+            "next": "|".join(next_cursor) if next_cursor else None
+        }
+    return api_reply(('api_works', cursor, limit), state_etag, build)
 
-@app.route('/status', methods=['GET'])
+@bp.route('/api/works/<work_id>', methods=['GET'])
+def api_work(work_id):
+    def build():
+        work = store.get_work(work_id)
+        return work_json(work_id, work) if work is not None else {"error": "Not found"}
+    return api_reply(('api_work', work_id), lambda: work_etag(work_id), build)
+
+@bp.route('/status', methods=['GET'])
 def status():
-    if current_work_id and current_work_id in work_opportunities:
-        work = work_opportunities[current_work_id]
-        return jsonify({
+    return api_reply(('status',), state_etag, status_json)
+
+def status_json():
+    current_work_id, work = current_work()
+    if work is not None:
+        return {
             "work_id": current_work_id,
             "title": work["title"],
             "selected_workers": len(work["selected_workers"]),
             "required_workers": work["required_workers"],
             "is_full": len(work["selected_workers"]) >= work["required_workers"]
-        })
-    return jsonify({
+        }
+    return {
         "error": "No active work selected"
-    })
+    }
 
-@app.route('/', methods=['GET'])
+@bp.route('/', methods=['GET'])
 def index():
     return "WhatsApp Catering Bot is running!"
 
+# Endpoints about the process rather than a tenant
+SHARED_ENDPOINTS = {'bot.index', 'bot.timings', 'bot.metrics_endpoint', 'bot.slow_requests'}
+
+def enter_workspace():
+    """Serve the request from its tenant's workspace, starting it on first use.
+
+    A WhatsApp message belongs to the tenant it was sent To, or the one its
+    sender is an admin of; other requests name the tenant with ?tenant=,
+    else get the default tenant.
+    """
+    start_services()
+    if request.endpoint == 'bot.whatsapp':
+        tenant = tenants.resolve(request.values.get('To'), request.values.get('From'))
+        name = tenant.name if tenant is not None else None
+    else:
+        name = request.args.get('tenant') or tenants.default
+    tenant_workspace = tenants.workspace(name) if name is not None else None
+    if tenant_workspace is None:
+        if request.endpoint in SHARED_ENDPOINTS and not request.args.get('tenant'):
+            return None
+        logger.warning(f"No tenant for {request.path} (To {request.values.get('To')}, tenant {request.args.get('tenant')})")
+        return jsonify({"error": "Unknown tenant"}), 404
+    g.workspace_token = tenant_workspace.enter()
+    start_workspace(tenant_workspace)
+    return None
+
+def leave_workspace(error=None):
+    token = g.pop('workspace_token', None)
+    if token is not None:
+        leave(token)
+
+def create_app(start=True):
+    """Build the Flask app.
+
+    With start, storage is loaded and the background threads start right
+    away for the preloaded tenants (gunicorn runs 'app:create_app()' in each
+    worker). Otherwise they start on the first request. Other tenants start
+    on their first request either way, apart from their reminder schedulers,
+    which start with the preloaded tenants.
+    """
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(bp)
+    flask_app.before_request(enter_workspace)
+    flask_app.teardown_request(leave_workspace)
+    if start:
+        start_services()
+    return flask_app
+
+app = create_app(start=False)
+
 if __name__ == '__main__':
     # Add more detailed startup logging
     logger.info("Starting WhatsApp Catering Bot...")
-    logger.info(f"Admin number set to: {admin_number}")
-    logger.info(f"Scheduler available: {scheduler_available}")
-    logger.info(f"Twilio client available: {twilio_available}")
+    logger.info(f"Tenants: {', '.join(tenants.tenants)}")
+    start_services()
+    for tenant_workspace in tenants.loaded():
+        with tenant_workspace.active():
+            logger.info(f"Pending reminders for {tenant_workspace.name}: {reminder_scheduler.pending}")
+    logger.info(f"Twilio client available: {twilio_available()}")
     
     # Only one app.run call is needed
     app.run(debug=True)
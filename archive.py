@@ -0,0 +1,301 @@
+"""Cold storage for past work opportunities.
+
+An Archive thread moves works whose event is more than after_days in the
+past out of the storage engine every interval, so the data file, LIST and
+startup only deal with active and upcoming works. A work whose event time
+could not be parsed (no event_at) is moved instead once it was created more
+than undated_after_days ago. Archived works are written to gzip segments
+partitioned by the month of the event (or of the creation, for those), for
+example archive/2025-06-0001.json.gz. A segment is written once and never changed;
+each archiving run adds new segments.
+
+A small SQLite index (archive/index.db) holds one row per archived work -
+its segment plus the fields HISTORY shows - and the SHA-256 of each segment.
+Listing archived works reads only the index, and reading one work back
+decompresses only its own segment, after checking its checksum.
+
+A work is only deleted from storage once its segment and index rows are on
+disk, so a crash in between leaves it in both places; the next run finds it
+in the index and just deletes it.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from journal import write_atomic
+from reminders import TIME_FORMAT
+from storage import PAST
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT PRIMARY KEY,
+    month TEXT NOT NULL,
+    works INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS archived (
+    work_id TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    month TEXT NOT NULL,
+    title TEXT,
+    time TEXT,
+    event_at TEXT,
+    selected INTEGER NOT NULL,
+    required_workers INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archived_month ON archived (month, event_at);
+CREATE INDEX IF NOT EXISTS archived_event_at ON archived (event_at);
+"""
+
+
+class ArchiveError(Exception):
+    """An archive segment is missing or corrupt."""
+
+
+class Archive:
+    """Moves past works from a Storage engine into monthly segments and reads them back."""
+
+    def __init__(self, store, directory, interval=3600, after_days=7, undated_after_days=30,
+                 batch_size=500, cached_segments=4):
+        self.store = store
+        self.directory = directory
+        self.interval = interval
+        self.after_days = after_days
+        self.undated_after_days = undated_after_days
+        self.batch_size = batch_size
+        self.cached_segments = cached_segments
+        self.lock_path = os.path.join(directory, 'archive.lock')
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        # Decoded segments, newest use last; segments never change once written
+        self._segments = OrderedDict()
+        self._segments_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, 'index.db'), timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='archive', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(self):
+        """Ask the archive thread to run now instead of at the next interval."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                self.archive_past()
+            except Exception as e:
+                logger.error(f"Archiving failed: {str(e)}")
+
+    def archive_past(self, now=None):
+        """Move every work whose event was more than after_days before now into the archive.
+
+        Works without an event_at are moved once created more than
+        undated_after_days before now. Returns the number of works moved.
+        Processes sharing the archive directory take turns, so a work is
+        never archived twice.
+        """
+        now = now or datetime.now()
+        cutoff = (now - timedelta(days=self.after_days)).strftime(TIME_FORMAT)
+        undated_cutoff = (now - timedelta(days=self.undated_after_days)).strftime(TIME_FORMAT)
+        moved = 0
+        with open(self.lock_path, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            moved += self._move_pages(
+                lambda cursor: self.store.page_works(PAST, cursor, 0, self.batch_size, now=cutoff))
+            moved += self._move_pages(lambda cursor: self._undated_page(cursor, undated_cutoff))
+        if moved:
+            # Rewrite the data file without the archived works
+            self.store.save()
+            logger.info(f"Archived {moved} past work opportunities.")
+        return moved
+
+    def _move_pages(self, page):
+        """Archive and delete the works of every page(cursor) returns, following its cursor."""
+        moved = 0
+        cursor = None
+        while True:
+            works, cursor = page(cursor)
+            if works:
+                self._archive_batch(works)
+                for work_id, _ in works:
+                    self.store.delete_work(work_id)
+                moved += len(works)
+            if cursor is None:
+                return moved
+
+    def _undated_page(self, cursor, cutoff):
+        """One page of the works without an event_at created before cutoff.
+
+        Reads works in creation order and stops at the first one created
+        after cutoff, so only the oldest part of storage is read.
+        """
+        works, cursor = self.store.page_works(None, cursor, 0, self.batch_size)
+        undated = []
+        for work_id, work in works:
+            if (work.get('created_at') or '') >= cutoff:
+                return undated, None
+            if not work.get('event_at') and work.get('created_at'):
+                undated.append((work_id, work))
+        return undated, cursor
+
+    def _archive_batch(self, works):
+        """Write one segment per month for the works not archived yet, and index them."""
+        conn = self._conn()
+        work_ids = [work_id for work_id, _ in works]
+        indexed = {
+            row[0] for row in conn.execute(
+                f"SELECT work_id FROM archived WHERE work_id IN ({', '.join('?' * len(work_ids))})", work_ids
+            )
+        }
+        by_month = {}
+        for work_id, work in works:
+            if work_id not in indexed:
+                by_month.setdefault((work.get('event_at') or work['created_at'])[:7], {})[work_id] = work
+        for month, month_works in sorted(by_month.items()):
+            seq = conn.execute("SELECT COUNT(*) FROM segments WHERE month = ?", (month,)).fetchone()[0] + 1
+            name = f"{month}-{seq:04d}.json.gz"
+            checksum, size = self._write(name, {'month': month, 'works': month_works})
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO segments (name, month, works, sha256, size, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (name, month, len(month_works), checksum, size, time.time())
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO archived "
+                    "(work_id, segment, month, title, time, event_at, selected, required_workers) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(work_id, name, month, work['title'], work.get('time'), work.get('event_at'),
+                      len(work['selected_workers']), work['required_workers'])
+                     for work_id, work in month_works.items()]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info(f"Archive segment {name} written ({len(month_works)} works, {size} bytes).")
+
+    def _write(self, name, payload):
+        """Write a gzipped JSON segment. Returns (sha256, size)."""
+        data = gzip.compress(json.dumps(payload).encode('utf-8'))
+        write_atomic(os.path.join(self.directory, name), data)
+        return hashlib.sha256(data).hexdigest(), len(data)
+
+    def get_work(self, work_id):
+        """Return an archived work, or None if it is not in the archive."""
+        row = self._conn().execute(
+            "SELECT archived.segment, segments.sha256 FROM archived "
+            "JOIN segments ON segments.name = archived.segment WHERE archived.work_id = ?",
+            (work_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._segment(row['segment'], row['sha256'])['works'].get(work_id)
+
+    def _segment(self, name, sha256):
+        with self._segments_lock:
+            segment = self._segments.get(name)
+            if segment is not None:
+                self._segments.move_to_end(name)
+                return segment
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise ArchiveError(f"Archive segment {name} is missing")
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise ArchiveError(f"Archive segment {name} is corrupt: checksum mismatch")
+        segment = json.loads(gzip.decompress(data))
+        with self._segments_lock:
+            self._segments[name] = segment
+            while len(self._segments) > self.cached_segments:
+                self._segments.popitem(last=False)
+        return segment
+
+    def archived(self, work_ids):
+        """Return the set of work_ids that are in the archive."""
+        work_ids = list(work_ids)
+        found = set()
+        # In chunks, within SQLite's limit on query parameters
+        for start in range(0, len(work_ids), 500):
+            chunk = work_ids[start:start + 500]
+            found.update(row[0] for row in self._conn().execute(
+                f"SELECT work_id FROM archived WHERE work_id IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+        return found
+
+    def history(self, month=None, limit=10):
+        """Return index rows of archived works, latest event first, or in event order for one month ("YYYY-MM")."""
+        if month is None:
+            return self._conn().execute(
+                "SELECT * FROM archived ORDER BY event_at DESC, work_id LIMIT ?", (limit,)
+            ).fetchall()
+        return self._conn().execute(
+            "SELECT * FROM archived WHERE month = ? ORDER BY event_at, work_id LIMIT ?", (month, limit)
+        ).fetchall()
+
+    def months(self):
+        """Return {month: archived works}, latest month first."""
+        return {row[0]: row[1] for row in self._conn().execute(
+            "SELECT month, COUNT(*) FROM archived GROUP BY month ORDER BY month DESC"
+        )}
+
+    def count(self, month=None):
+        if month is None:
+            return self._conn().execute("SELECT COUNT(*) FROM archived").fetchone()[0]
+        return self._conn().execute("SELECT COUNT(*) FROM archived WHERE month = ?", (month,)).fetchone()[0]
@@ -0,0 +1,257 @@
+"""Compressed, checksummed backups taken off the request path.
+
+A BackupManager thread takes a backup every interval. Backups are gzip files
+streamed straight from the exported state:
+
+- a full backup holds the whole dataset;
+- a delta backup holds only the works added, changed or deleted since the
+  last full backup, and names that backup as its base.
+
+Every backup is listed in manifest.json in the backup directory together with
+the SHA-256 of its file, which is checked before a backup is restored. After
+each backup, old ones are pruned: the newest backup of each of the last
+keep_hourly hours and of each of the last keep_daily days are kept, along with
+the full backups those depend on.
+
+Restoring a backup swaps the whole state in storage in one step, without a
+restart.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from journal import write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FULL_BACKUP = 'full'
+DELTA_BACKUP = 'delta'
+
+
+class BackupError(Exception):
+    """A backup is missing, corrupt or cannot be restored."""
+
+
+class BackupManager:
+    """Takes, prunes, verifies and restores backups of a Storage engine."""
+
+    def __init__(self, store, directory, interval=3600, full_interval=86400, incremental=True,
+                 keep_hourly=24, keep_daily=7, prefix='catering_data'):
+        self.store = store
+        self.directory = directory
+        self.interval = interval
+        self.full_interval = full_interval
+        self.incremental = incremental
+        self.keep_hourly = keep_hourly
+        self.keep_daily = keep_daily
+        self.prefix = prefix
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.lock_path = os.path.join(directory, 'backup.lock')
+        # Name of a full backup and the digest of each work in it, so deltas
+        # are found without reading the base backup back every time
+        self._base = (None, {})
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='backups', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def request(self):
+        """Ask the backup thread for a backup now instead of at the next interval."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            requested = self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                self.backup(force=requested)
+            except Exception as e:
+                logger.error(f"Backup failed: {str(e)}")
+
+    def backup(self, force=False, now=None):
+        """Take a full or delta backup and prune old ones. Returns the new manifest entry.
+
+        Several processes may share the backup directory; unless force is set,
+        a process skips the backup when another one took it recently.
+        """
+        now = now or datetime.now()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            manifest = self.manifest()
+            if manifest and not force:
+                last = datetime.fromisoformat(manifest[-1]['created_at'])
+                if (now - last).total_seconds() < self.interval / 2:
+                    return None
+
+            data = self.store.export()
+            digests = {work_id: _digest(work) for work_id, work in data['work_opportunities'].items()}
+            base = self._last_full(manifest)
+            if (self.incremental and base is not None
+                    and (now - datetime.fromisoformat(base['created_at'])).total_seconds() < self.full_interval):
+                base_digests = self._base_digests(base)
+                payload = {
+                    'base': base['name'],
+                    'works': {work_id: data['work_opportunities'][work_id] for work_id, digest in digests.items()
+                              if base_digests.get(work_id) != digest},
+                    'deleted': [work_id for work_id in base_digests if work_id not in digests],
+                    'current_work_id': data['current_work_id']
+                }
+                kind = DELTA_BACKUP
+            else:
+                payload = data
+                kind = FULL_BACKUP
+
+            name = f"{self.prefix}_{now.strftime('%Y%m%d_%H%M%S_%f')}_{kind}.json.gz"
+            checksum, size = self._write(name, payload)
+            entry = {'name': name, 'kind': kind, 'created_at': now.isoformat(),
+                     'sha256': checksum, 'size': size, 'works': len(digests)}
+            if kind == DELTA_BACKUP:
+                entry['base'] = base['name']
+            else:
+                self._base = (name, digests)
+            manifest.append(entry)
+            manifest = self._prune(manifest, now)
+            write_atomic(self.manifest_path, json.dumps(manifest, indent=2))
+        logger.info(f"Backup {name} written ({size} bytes).")
+        return entry
+
+    def manifest(self):
+        """Return the list of backups, oldest first."""
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def verify(self, name):
+        """Raise BackupError unless a backup (and the full backup it depends on) matches its checksum."""
+        entry = self._entry(name)
+        path = os.path.join(self.directory, name)
+        try:
+            checksum = _file_sha256(path)
+        except FileNotFoundError:
+            raise BackupError(f"Backup file {name} is missing")
+        if checksum != entry['sha256']:
+            raise BackupError(f"Backup {name} is corrupt: checksum mismatch")
+        if entry['kind'] == DELTA_BACKUP:
+            self.verify(entry['base'])
+        return entry
+
+    def load(self, name):
+        """Return the state stored in a backup, in the JSON data file format."""
+        entry = self.verify(name)
+        payload = self._read(name)
+        if entry['kind'] == FULL_BACKUP:
+            return payload
+        data = self._read(entry['base'])
+        works = data['work_opportunities']
+        for work_id in payload['deleted']:
+            works.pop(work_id, None)
+        works.update(payload['works'])
+        data['current_work_id'] = payload['current_work_id']
+        return data
+
+    def restore(self, name):
+        """Verify a backup and atomically replace the stored state with it."""
+        data = self.load(name)
+        self.store.restore(data)
+        logger.info(f"Restored backup {name} ({len(data['work_opportunities'])} works).")
+        return data
+
+    def _write(self, name, payload):
+        """Stream payload as gzipped JSON to the backup directory. Returns (sha256, size)."""
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                for chunk in json.JSONEncoder().iterencode(payload):
+                    f.write(chunk.encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        return _file_sha256(path), os.path.getsize(path)
+
+    def _read(self, name):
+        with gzip.open(os.path.join(self.directory, name), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _entry(self, name):
+        for entry in self.manifest():
+            if entry['name'] == name:
+                return entry
+        raise BackupError(f"Backup {name} not found")
+
+    def _last_full(self, manifest):
+        for entry in reversed(manifest):
+            if entry['kind'] == FULL_BACKUP:
+                return entry
+        return None
+
+    def _base_digests(self, base):
+        if self._base[0] != base['name']:
+            works = self._read(base['name'])['work_opportunities']
+            self._base = (base['name'], {work_id: _digest(work) for work_id, work in works.items()})
+        return self._base[1]
+
+    def _prune(self, manifest, now):
+        """Delete backups outside the retention policy and return the manifest entries kept."""
+        keep = set()
+        for bucket_format, count in (('%Y%m%d%H', self.keep_hourly), ('%Y%m%d', self.keep_daily)):
+            buckets = {}
+            for entry in manifest:
+                # Entries are oldest first, so the newest backup of each bucket wins
+                buckets[datetime.fromisoformat(entry['created_at']).strftime(bucket_format)] = entry['name']
+            keep.update(buckets[bucket] for bucket in sorted(buckets)[-count:] if count > 0)
+        keep.add(manifest[-1]['name'])
+        # A delta is useless without its base
+        keep.update(entry['base'] for entry in manifest if entry['name'] in keep and entry['kind'] == DELTA_BACKUP)
+
+        kept = []
+        for entry in manifest:
+            if entry['name'] in keep:
+                kept.append(entry)
+                continue
+            try:
+                os.remove(os.path.join(self.directory, entry['name']))
+            except FileNotFoundError:
+                pass
+            logger.info(f"Pruned backup {entry['name']}.")
+        return kept
+
+
+def _digest(work):
+    return hashlib.sha1(json.dumps(work, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            sha.update(block)
+    return sha.hexdigest()
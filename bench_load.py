@@ -0,0 +1,431 @@
+"""Load test and benchmark for the /whatsapp webhook.
+
+Replays generated traffic against the real whatsapp() handler, in process
+through the Flask test client or over HTTP against a locally started
+gunicorn, with a fresh data directory each run:
+
+- race:    a burst of --workers workers replying YES at once to a work with
+           --slots slots, repeated --rounds times
+- mix:     --requests admin and worker commands in a seeded random mix
+           (CREATE, SELECT, LIST, STATUS, WORKER, YES, INFO, MY, ...)
+- history: read-heavy traffic (LIST pages, WORKER, MY) against --history
+           work opportunities generated before the app starts
+
+Each scenario reports throughput and p50/p95/p99 latency. Afterwards every
+work the run created is checked through STATUS: no work has more workers
+than slots, each position was handed out once, and every worker told they
+were selected is on the list, and nobody else. Any violation is printed and
+makes the exit status 1.
+
+    python bench_load.py --workers 200 --slots 20
+    python bench_load.py --server gunicorn --processes 4 --backend sqlite
+    python bench_load.py --json --record bench_output.txt
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from storage import JSONStorage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = ('race', 'mix', 'history')
+
+SELECTED = re.compile(r"You have been selected for (.+?)!.*You are worker #(\d+) of (\d+)\.", re.S)
+CREATED = re.compile(r"ID: (\w+)\nEvent: (.+)")
+STATUS = re.compile(r"Current status for (.+?): (\d+)/(\d+) workers selected\.\n\nSelected workers:\n(.*)", re.S)
+EMPTY_STATUS = re.compile(r"No workers selected yet for (.+?)\. Need (\d+) workers\.")
+
+# Mix of commands replayed by the mix scenario, with their weights
+ADMIN_COMMANDS = (
+    ('CREATE', 1), ('SELECT', 2), ('LIST', 3), ('LIST next', 1), ('LIST open', 1),
+    ('STATUS', 3), ('WORKER', 1), ('HELP', 1)
+)
+WORKER_COMMANDS = (('YES', 2), ('YES 1', 2), ('YES 2', 2), ('INFO', 3), ('MY', 2), ('hello', 1))
+
+
+# Fictional (555-01xx) number the benchmarks use as the admin
+BENCH_ADMIN = 'whatsapp:+15555550100'
+
+
+def bench_env(workdir, backend):
+    """Environment that points every file the app writes into workdir."""
+    return {
+        'STORAGE_BACKEND': backend,
+        'CATERING_DATA_FILE': os.path.join(workdir, 'catering_data.json'),
+        'CATERING_DB_FILE': os.path.join(workdir, 'catering_data.db'),
+        'OUTBOX_FILE': os.path.join(workdir, 'outbox.db'),
+        'OUTBOUND_RATE_FILE': os.path.join(workdir, 'send_rate.db'),
+        'DEDUP_FILE': os.path.join(workdir, 'dedup.db'),
+        'ROSTER_FILE': os.path.join(workdir, 'roster.db'),
+        'SESSION_FILE': os.path.join(workdir, 'sessions.db'),
+        'REMINDER_LOCK_FILE': os.path.join(workdir, 'scheduler.lock'),
+        'BACKUP_DIR': os.path.join(workdir, 'backups'),
+        'ARCHIVE_DIR': os.path.join(workdir, 'archive'),
+        'STATS_FILE': os.path.join(workdir, 'stats.db'),
+        'BACKUP_INTERVAL': '86400',
+        # The load test measures the bot, not the per-sender rate limit
+        'ADMIN_RATE_LIMIT': '0',
+        'WORKER_RATE_LIMIT': '0',
+        # Never message anyone: admin notifications go to a fictional number
+        # through a transport that only records them
+        'OUTBOUND_TRANSPORT': 'fake',
+        'ADMIN_NUMBER': BENCH_ADMIN,
+    }
+
+
+def history_worker(n, k):
+    return f"whatsapp:+91{n:08d}{k:02d}"
+
+
+def make_history(data_file, works):
+    """Write a data file holding works work opportunities, five workers each."""
+    store = JSONStorage(data_file, fsync='never', compact_every=10 ** 9)
+    store.load()
+    for n in range(works):
+        store.create_work(f"h{n:07x}", {
+            "title": f"History {n}",
+            "location": "Hall",
+            "time": "June 1 at 6pm",
+            "event_at": "2025-06-01 18:00:00",
+            "required_workers": 5,
+            "payment": "500",
+            "selected_workers": [history_worker(n, k) for k in range(5)],
+            "created_at": f"2025-06-01 10:{n // 60 % 60:02d}:{n % 60:02d}"
+        })
+    store.save()
+    store.close()
+
+
+def reply_text(twiml):
+    """The text of every message in a TwiML reply, one message per line."""
+    return "\n".join("".join(message.itertext()) for message in ET.fromstring(twiml).iter('Message'))
+
+
+class InProcessClient:
+    """Posts to the app through a Flask test client per thread."""
+
+    def __init__(self, flask_app):
+        self._app = flask_app
+        self._local = threading.local()
+
+    def post(self, sender, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.post('/whatsapp', data={'From': sender, 'Body': body})
+        if response.status_code != 200:
+            raise RuntimeError(f"{body!r} from {sender} returned HTTP {response.status_code}")
+        return reply_text(response.get_data(as_text=True))
+
+
+class HTTPClient:
+    """Posts to a running server over HTTP."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def post(self, sender, body):
+        data = urllib.parse.urlencode({'From': sender, 'Body': body}).encode('utf-8')
+        with urllib.request.urlopen(f"{self.base_url}/whatsapp", data=data, timeout=60) as response:
+            return reply_text(response.read().decode('utf-8'))
+
+
+def start_in_process(env):
+    """Import the app with env applied and return a client for it."""
+    os.environ.update(env)
+    if 'app' in sys.modules:
+        raise RuntimeError("The app was imported before its environment was set")
+    logging.disable(logging.INFO)
+    import app as bot
+    return InProcessClient(bot.create_app()), None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(env, workdir, processes, threads):
+    """Start gunicorn on a free local port and return (client, process) once it answers."""
+    port = free_port()
+    log_file = os.path.join(workdir, 'gunicorn.log')
+    with open(log_file, 'w') as log:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--pythonpath', HERE, '--workers', str(processes),
+             '--threads', str(threads), '--bind', f'127.0.0.1:{port}', 'app:create_app()'],
+            cwd=workdir, env=dict(os.environ, **env), stdout=log, stderr=subprocess.STDOUT
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            with urllib.request.urlopen(f"{base_url}/", timeout=1):
+                return HTTPClient(base_url), process
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                with open(log_file) as log:
+                    raise RuntimeError(f"gunicorn did not start:\n{log.read()}")
+            time.sleep(0.1)
+
+
+class Run:
+    """Sends traffic and records latencies and the claims workers were told about."""
+
+    def __init__(self, client, admin, concurrency):
+        self.client = client
+        self.admin = admin
+        self.concurrency = concurrency
+        self.latencies = defaultdict(list)
+        # Title -> [(worker, position, slots)] from "You have been selected" replies
+        self.claims = defaultdict(list)
+        # Work ID -> title of every work this run created
+        self.created = {}
+        self._lock = threading.Lock()
+
+    def send(self, scenario, sender, body):
+        start = time.perf_counter()
+        text = self.client.post(sender, body)
+        elapsed = time.perf_counter() - start
+        command = body.split()[0].upper() if body.strip() else ''
+        with self._lock:
+            self.latencies[(scenario, command)].append(elapsed)
+            match = SELECTED.search(text)
+            if match:
+                self.claims[match.group(1)].append((sender, int(match.group(2)), int(match.group(3))))
+            match = CREATED.search(text) if command == 'CREATE' else None
+            if match:
+                self.created[match.group(1)] = match.group(2).strip()
+        return text
+
+    def replay(self, scenario, traffic):
+        """Send [(sender, body)] from concurrency threads and return the wall time taken."""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            for future in [pool.submit(self.send, scenario, sender, body) for sender, body in traffic]:
+                future.result()
+        return time.perf_counter() - start
+
+    def create_work(self, scenario, title, slots):
+        text = self.send(scenario, self.admin, f"CREATE {title}, Hall, June 1 at 6pm, {slots}, 500")
+        match = CREATED.search(text)
+        if not match:
+            raise RuntimeError(f"Could not create a work: {text}")
+        return match.group(1)
+
+
+def race(run, rng, options):
+    seconds = 0.0
+    for round_number in range(options.rounds):
+        work_id = run.create_work('race', f"Race {round_number}", options.slots)
+        workers = [f"whatsapp:+1555{round_number:03d}{n:05d}" for n in range(options.workers)]
+        # Some workers reply twice, as people do
+        burst = [(worker, f"{rng.choice(('Yes', 'YES', 'yes'))} {work_id}") for worker in workers]
+        burst += [(worker, f"Yes {work_id}") for worker in rng.sample(workers, len(workers) // 10)]
+        rng.shuffle(burst)
+        seconds += run.replay('race', burst)
+    return seconds
+
+
+def mix(run, rng, options):
+    run.create_work('mix', "Mix 0", options.slots)
+    workers = [f"whatsapp:+1666{n:07d}" for n in range(max(options.workers, 1))]
+    admin_commands, admin_weights = zip(*ADMIN_COMMANDS)
+    worker_commands, worker_weights = zip(*WORKER_COMMANDS)
+    traffic = []
+    created = 1
+    for _ in range(options.requests):
+        if rng.random() < options.admin_share:
+            command = rng.choices(admin_commands, admin_weights)[0]
+            if command == 'CREATE':
+                command = f"CREATE Mix {created}, Hall, June 1 at 6pm, {rng.randint(1, options.slots)}, 500"
+                created += 1
+            elif command == 'SELECT':
+                # A work created before the mix started, or one that does not exist
+                command = f"SELECT {rng.choice(list(run.created) or ['missing'])}"
+            elif command == 'WORKER':
+                command = f"WORKER {rng.choice(workers).replace('whatsapp:', '')}"
+            traffic.append((run.admin, command))
+        else:
+            traffic.append((rng.choice(workers), rng.choices(worker_commands, worker_weights)[0]))
+    return run.replay('mix', traffic)
+
+
+def history(run, rng, options):
+    if not options.history:
+        return 0.0
+    pages = max(options.history // 10, 1)
+    traffic = []
+    for _ in range(options.requests):
+        n = rng.randrange(options.history)
+        traffic.append(rng.choice((
+            (run.admin, 'LIST'),
+            (run.admin, 'LIST next'),
+            (run.admin, f"LIST page {rng.randint(1, pages)}"),
+            (run.admin, 'LIST past'),
+            (run.admin, f"WORKER {history_worker(n, rng.randrange(5)).replace('whatsapp:', '')}"),
+            (history_worker(n, rng.randrange(5)), 'MY'),
+            (history_worker(n, rng.randrange(5)), 'INFO'),
+        )))
+    return run.replay('history', traffic)
+
+
+RUNNERS = {'race': race, 'mix': mix, 'history': history}
+
+
+def check_claims(run):
+    """Return the invariant violations found across every work the run created."""
+    failures = []
+    for work_id, title in sorted(run.created.items()):
+        run.client.post(run.admin, f"SELECT {work_id}")
+        text = run.client.post(run.admin, 'STATUS')
+        match = STATUS.search(text)
+        if match:
+            filled, slots = int(match.group(2)), int(match.group(3))
+            listed = {f"whatsapp:{number}" for number in match.group(4).split()}
+        else:
+            match = EMPTY_STATUS.search(text)
+            if not match:
+                failures.append(f"{title}: unexpected STATUS reply {text!r}")
+                continue
+            filled, slots, listed = 0, int(match.group(2)), set()
+        claims = run.claims.get(title, [])
+        told = {worker for worker, _, _ in claims}
+        positions = sorted(position for _, position, _ in claims)
+        if filled > slots:
+            failures.append(f"{title}: overfilled, {filled} workers for {slots} slots")
+        if len(listed) != filled:
+            failures.append(f"{title}: STATUS counts {filled} workers but lists {len(listed)}")
+        if positions != sorted(set(positions)) or any(position > slots for position in positions):
+            failures.append(f"{title}: positions handed out more than once or past the slots: {positions}")
+        if len(told) != len(claims):
+            failures.append(f"{title}: a worker was selected more than once")
+        if told - listed:
+            failures.append(f"{title}: lost claims, {sorted(told - listed)} were told they are selected")
+        if listed - told:
+            failures.append(f"{title}: {sorted(listed - told)} are selected but were never told")
+    return failures
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values."""
+    return values[max(int(round(fraction * len(values))) - 1, 0)]
+
+
+def summarize(latencies, seconds=None):
+    """Request count and latency percentiles, plus throughput when the wall time is known."""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {'requests': 0}
+    summary = {'requests': len(ordered)}
+    if seconds is not None:
+        summary['seconds'] = seconds
+        summary['requests_per_second'] = len(ordered) / seconds if seconds else 0.0
+    summary.update({
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+    })
+    return summary
+
+
+def run_benchmark(options):
+    """Run the scenarios in a fresh data directory and return the results.
+
+    The results hold a summary per scenario, latency percentiles per
+    scenario and command, and the invariant violations found ("failures").
+    """
+    rng = random.Random(options.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        env = bench_env(workdir, options.backend)
+        if options.history and 'history' in options.scenarios:
+            make_history(env['CATERING_DATA_FILE'], options.history)
+        if options.server == 'gunicorn':
+            client, process = start_gunicorn(env, workdir, options.processes, options.threads)
+        else:
+            client, process = start_in_process(env)
+        try:
+            run = Run(client, env['ADMIN_NUMBER'], options.concurrency)
+            scenarios = {}
+            for name in options.scenarios:
+                seconds = RUNNERS[name](run, rng, options)
+                scenarios[name] = summarize(
+                    [elapsed for (scenario, _), values in run.latencies.items() if scenario == name
+                     for elapsed in values],
+                    seconds
+                )
+            failures = check_claims(run)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+    commands = {f"{scenario}:{command}": summarize(values)
+                for (scenario, command), values in sorted(run.latencies.items())}
+    return {'scenarios': scenarios, 'commands': commands, 'failures': failures}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the /whatsapp webhook and check claim invariants")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--workers', type=int, default=200, help="workers racing for each work")
+    parser.add_argument('--slots', type=int, default=20, help="slots in each raced work")
+    parser.add_argument('--rounds', type=int, default=3, help="race rounds, one new work each")
+    parser.add_argument('--requests', type=int, default=1000, help="requests in the mix and history scenarios")
+    parser.add_argument('--admin-share', type=float, default=0.2, help="share of mix requests sent by the admin")
+    parser.add_argument('--history', type=int, default=5000, help="work opportunities generated for the history scenario")
+    parser.add_argument('--concurrency', type=int, default=16, help="client threads sending requests")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--server', choices=('inprocess', 'gunicorn'), default='inprocess')
+    parser.add_argument('--processes', type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=4, help="threads per gunicorn worker process")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--record', metavar='FILE', help="append the results to FILE as a JSON line")
+    options = parser.parse_args(argv)
+    if options.server == 'gunicorn' and options.processes > 1 and options.backend == 'json':
+        parser.error("several gunicorn processes need --backend sqlite")
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    results = run_benchmark(options)
+    if options.record:
+        with open(options.record, 'a') as f:
+            f.write(json.dumps(dict(results, options=vars(options),
+                                    finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))) + "\n")
+    if options.json:
+        print(json.dumps(results))
+    else:
+        print(f"{options.server}, {options.backend} storage, {options.concurrency} client threads")
+        print(f"{'scenario':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, summary in results['scenarios'].items():
+            if not summary['requests']:
+                continue
+            print(f"{name:<10}{summary['requests']:>10}{summary['requests_per_second']:>10.0f}"
+                  f"{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['max_ms']:>10.2f}")
+        for failure in results['failures']:
+            print(f"FAILED: {failure}")
+    return 1 if results['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Startup benchmark: import time and time to first request.
+
+Each scenario runs in a fresh interpreter against a generated data file
+holding --works work opportunities:
+
+- eager:  storage loaded and threads started while importing, as the app
+          did before it was split into lazy services
+- lazy:   importing only defines the app; the first request starts it
+- pickle: lazy, loading the compact binary snapshot instead of JSON
+
+    python bench_startup.py --works 20000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from storage import JSONStorage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHILD = """
+import time
+start = time.perf_counter()
+import logging, os, sys
+sys.path.insert(0, {here!r})
+import app as bot
+if {eager!r}:
+    bot.start_services()
+imported = time.perf_counter()
+logging.disable(logging.INFO)
+bot.app.test_client().post('/whatsapp', data={{'From': 'whatsapp:+10000000001', 'Body': 'INFO'}})
+answered = time.perf_counter()
+print(imported - start, answered - start)
+os._exit(0)
+"""
+
+SCENARIOS = (
+    ('eager', True, 'json'),
+    ('lazy', False, 'json'),
+    ('pickle', False, 'pickle'),
+)
+
+
+def make_history(data_file, works):
+    """Write a data file, and its binary snapshot, holding works work opportunities."""
+    for snapshot_format in ('json', 'pickle'):
+        store = JSONStorage(data_file, fsync='never', compact_every=10 ** 9, snapshot_format=snapshot_format)
+        store.load()
+        if not store.count_works():
+            for n in range(works):
+                store.create_work(f"{n:08x}", {
+                    "title": f"Event {n}",
+                    "location": "Hall",
+                    "time": "June 1 at 6pm",
+                    "event_at": "2025-06-01 18:00:00",
+                    "required_workers": 5,
+                    "payment": "500",
+                    "selected_workers": [f"whatsapp:+91{n:010d}{k}" for k in range(5)],
+                    "created_at": "2025-06-01 10:00:00"
+                })
+        store.save()
+        store.close()
+
+
+def run_scenario(tmp, eager, snapshot_format):
+    env = dict(os.environ, OUTBOUND_TRANSPORT='fake', SNAPSHOT_FORMAT=snapshot_format, CATERING_DATA_FILE=os.path.join(tmp, 'catering_data.json'))
+    if snapshot_format == 'json':
+        # Make the JSON data file the newest snapshot again
+        os.utime(env['CATERING_DATA_FILE'])
+    else:
+        os.utime(os.path.join(tmp, 'catering_data.snapshot'))
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD.format(here=HERE, eager=eager)],
+        cwd=tmp, env=env, capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(output[0]), float(output[1])
+
+
+def run_benchmark(works, runs):
+    """Return {scenario: (median import seconds, median first request seconds)}."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        make_history(os.path.join(tmp, 'catering_data.json'), works)
+        for name, eager, snapshot_format in SCENARIOS:
+            timings = [run_scenario(tmp, eager, snapshot_format) for _ in range(runs)]
+            results[name] = (statistics.median(t[0] for t in timings), statistics.median(t[1] for t in timings))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure import time and time to first request")
+    parser.add_argument('--works', type=int, default=20000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+    results = run_benchmark(args.works, args.runs)
+    if args.json:
+        print(json.dumps({name: {'import_ms': t[0] * 1000, 'first_request_ms': t[1] * 1000}
+                          for name, t in results.items()}))
+    else:
+        print(f"{args.works} work opportunities, median of {args.runs} runs")
+        print(f"{'scenario':<10}{'import ms':>12}{'first request ms':>20}")
+        for name, (imported, answered) in results.items():
+            print(f"{name:<10}{imported * 1000:>12.1f}{answered * 1000:>20.1f}")
@@ -0,0 +1,143 @@
+"""LRU cache of rendered TwiML replies.
+
+Read-only replies (HELP, the fallback prompts, INFO and STATUS) are rendered
+once and then served as ready-made XML strings. Replies derived from a work
+are keyed on the work's version counter, which storage increments on every
+change to that work, so an entry is never invalidated explicitly: the next
+request after a change simply asks for a new key. Old entries fall off the
+end of the LRU.
+
+The same cache holds the serialized JSON of the read API, keyed on the
+state version, with render=json.dumps.
+
+Compare request throughput with the cache off and on with:
+
+    python cache.py bench
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from twilio.twiml.messaging_response import MessagingResponse
+
+
+def render(text):
+    """Render a TwiML reply with one message, or one per text if given a list."""
+    resp = MessagingResponse()
+    for part in ([text] if isinstance(text, str) else text):
+        resp.message(part)
+    return str(resp)
+
+
+class ResponseCache:
+    """Thread-safe LRU mapping keys to rendered replies. maxsize 0 disables caching.
+
+    render turns what build() returns into the cached string (TwiML by default).
+    """
+
+    def __init__(self, maxsize=512, render=render):
+        self.maxsize = maxsize
+        self.render = render
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, build):
+        """Return the cached reply for key, or render build()'s result and cache it.
+
+        With the default render, build() returns a text or a list of texts.
+        """
+        with self._lock:
+            reply = self._entries.get(key)
+            if reply is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return reply
+            self.misses += 1
+        reply = self.render(build())
+        if self.maxsize:
+            with self._lock:
+                self._entries[key] = reply
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return reply
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def run_benchmark(requests, workers=3):
+    """Post read-only messages through the Flask test client, with the cache off and then on.
+
+    Returns requests per second for each command, keyed by (command, cached).
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ.setdefault('TWILIO_ACCOUNT_SID', 'ACbenchmark')
+        os.environ['OUTBOUND_TRANSPORT'] = 'fake'
+        os.environ['ADMIN_NUMBER'] = 'whatsapp:+15555550100'
+        import app as bot
+
+        bot.delivery_engine.stop()
+        # Every request comes from the same two senders
+        for limiter in bot.rate_limiters.values():
+            limiter.rate = 0
+        bot.create_work("Benchmark dinner", "Hall", "June 1 at 6pm", workers, "500")
+        client = bot.app.test_client()
+        admin = {'From': bot.admin_number}
+        worker = {'From': 'whatsapp:+10000000001'}
+        commands = [
+            ('INFO', worker),
+            ('hello', worker),
+            ('STATUS', admin),
+            ('HELP', admin),
+        ]
+
+        # The tenant's own cache, switched off and on, so the app keeps the
+        # per-tenant cache it was built with
+        cache = bot.response_cache.get()
+        maxsize = cache.maxsize
+        results = {}
+        try:
+            for cached in (False, True):
+                cache.clear()
+                cache.maxsize = 512 if cached else 0
+                for body, sender in commands:
+                    data = dict(sender, Body=body)
+                    client.post('/whatsapp', data=data)
+                    start = time.perf_counter()
+                    for _ in range(requests):
+                        client.post('/whatsapp', data=data)
+                    results[(body, cached)] = requests / (time.perf_counter() - start)
+        finally:
+            cache.maxsize = maxsize
+
+        bot.reminder_scheduler.stop()
+        bot.store.close()
+        os.chdir(cwd)
+        return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark cached read-only replies with the Flask test client")
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--requests', type=int, default=2000, help="requests per command")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    logging.disable(logging.INFO)
+    results = run_benchmark(args.requests)
+    print(f"{'command':<10}{'uncached/s':>12}{'cached/s':>12}{'speedup':>10}")
+    for body in ('INFO', 'hello', 'STATUS', 'HELP'):
+        before, after = results[(body, False)], results[(body, True)]
+        print(f"{body:<10}{before:>12.0f}{after:>12.0f}{after / before:>9.2f}x")
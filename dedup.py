@@ -0,0 +1,131 @@
+"""Replies to recent webhook requests, keyed by Twilio's MessageSid.
+
+Twilio retries a webhook that times out, with the same MessageSid. The first
+request for a MessageSid takes a lease on it and stores its reply when done;
+a retry gets that stored reply back instead of being handled again, so it
+cannot advance a conversation twice or claim a slot twice. A retry that
+arrives while the first request is still running waits for its reply.
+
+Entries live in SQLite so every gunicorn worker process sees them. They
+expire after ttl seconds, and only the newest max_entries are kept.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS replies (
+    sid TEXT PRIMARY KEY,
+    reply TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replies_created ON replies (created_at);
+"""
+
+
+class ReplyLog:
+    """Bounded, TTL-evicting store of the reply sent for each MessageSid, shared through SQLite.
+
+    A request whose handler dies without finish() or abandon() holds its
+    lease for lease_seconds; after that a retry handles the message again.
+    """
+
+    def __init__(self, db_file, ttl=3600, max_entries=10000, lease_seconds=60, wait=10.0, poll_interval=0.05):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease_seconds = lease_seconds
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._finished = 0
+        self._lock = threading.Lock()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(self, sid):
+        """Start handling sid.
+
+        Returns (True, None) when the caller should handle the message and
+        then call finish() or abandon(), or (False, reply) for a message
+        already handled. reply is None when the first request is still
+        running after waiting wait seconds for it.
+        """
+        deadline = time.monotonic() + self.wait
+        while True:
+            now = time.time()
+            conn = self._conn()
+            # Take the lease if sid is new, expired, or its handler is gone
+            claimed = conn.execute(
+                "INSERT INTO replies (sid, reply, lease_until, created_at) VALUES (?, NULL, ?, ?) "
+                "ON CONFLICT (sid) DO UPDATE SET reply = NULL, lease_until = excluded.lease_until, "
+                "created_at = excluded.created_at "
+                "WHERE replies.created_at < ? OR (replies.reply IS NULL AND replies.lease_until < ?) "
+                "RETURNING sid",
+                (sid, now + self.lease_seconds, now, now - self.ttl, now)
+            ).fetchone()
+            if claimed is not None:
+                return True, None
+            row = conn.execute("SELECT reply FROM replies WHERE sid = ?", (sid,)).fetchone()
+            if row is not None and row['reply'] is not None:
+                return False, row['reply']
+            if time.monotonic() >= deadline:
+                return False, None
+            time.sleep(self.poll_interval)
+
+    def lookup(self, sid):
+        """Return the stored reply to sid, or None if it has none (yet). Never waits."""
+        row = self._conn().execute(
+            "SELECT reply FROM replies WHERE sid = ? AND reply IS NOT NULL AND created_at >= ?",
+            (sid, time.time() - self.ttl)
+        ).fetchone()
+        return row['reply'] if row is not None else None
+
+    def finish(self, sid, reply):
+        """Store the reply to sid for retries."""
+        self._conn().execute(
+            "UPDATE replies SET reply = ?, lease_until = NULL WHERE sid = ?", (reply, sid)
+        )
+        with self._lock:
+            self._finished += 1
+            purge = self._finished % 100 == 0
+        if purge:
+            self.purge()
+
+    def abandon(self, sid):
+        """Forget sid after a failed attempt, so a retry handles it again."""
+        self._conn().execute("DELETE FROM replies WHERE sid = ? AND reply IS NULL", (sid,))
+
+    def purge(self):
+        """Drop expired entries and all but the newest max_entries."""
+        conn = self._conn()
+        expired = conn.execute("DELETE FROM replies WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+        trimmed = conn.execute(
+            "DELETE FROM replies WHERE created_at < ("
+            "SELECT created_at FROM replies ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+            (self.max_entries - 1,)
+        ).rowcount
+        if expired or trimmed:
+            logger.debug(f"Purged {expired} expired and {trimmed} surplus webhook replies")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM replies").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
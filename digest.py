@@ -0,0 +1,138 @@
+"""Admin notifications about sign-ups, coalesced into digests.
+
+A popular work can be claimed by dozens of workers within seconds, so
+telling the admin about each claim as it happens would mean as many
+outbound messages in the busiest moment. Instead, sign-ups are collected
+for window seconds from the first one and then sent to each admin as one
+summary. A work filling up is sent right away, together with the sign-ups
+for it that were still waiting, so they are not repeated in the next digest.
+
+Recording a sign-up only appends to an in-memory list; the messages are
+built and handed to send() by the digest's own thread, never by the request
+that made the claim. Sign-ups still waiting when the thread stops are sent
+then, but those waiting when the process dies are lost.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Worker numbers listed per work in one message; the rest are counted
+MAX_NUMBERS = 10
+
+DIGEST = 'digest'
+FULL = 'full'
+
+
+def _numbers(workers):
+    shown = ", ".join(worker.replace("whatsapp:", "") for worker in workers[:MAX_NUMBERS])
+    if len(workers) > MAX_NUMBERS:
+        shown += f" and {len(workers) - MAX_NUMBERS} more"
+    return shown
+
+
+def digest_text(pending):
+    """One message summing up the sign-ups per work, in the order the works were first claimed."""
+    total = sum(len(entry['workers']) for entry in pending.values())
+    lines = [f"👥 {total} new sign-up{'s' if total != 1 else ''}:"]
+    for work_id, entry in pending.items():
+        lines.append(f"\n{entry['title']} ({work_id}): {entry['filled']}/{entry['required']} filled\n{_numbers(entry['workers'])}")
+    return "\n".join(lines)
+
+
+def full_text(work_id, entry):
+    return (f"✅ {entry['title']} ({work_id}) is full: {entry['filled']}/{entry['required']} workers.\n"
+            f"Latest sign-ups: {_numbers(entry['workers'])}")
+
+
+class AdminDigest:
+    """Thread sending sign-up digests and fill alerts to the admins.
+
+    send(number, text) queues one message, e.g. DeliveryEngine.enqueue. A
+    window of 0 sends every sign-up on its own, still from the thread.
+    """
+
+    def __init__(self, send, recipients, window=60.0):
+        self.send = send
+        self.recipients = tuple(sorted(recipients))
+        self.window = window
+        self.sent = {DIGEST: 0, FULL: 0}
+        self.signups = 0
+        # work ID -> title, filled, required and the workers not reported yet
+        self._pending = OrderedDict()
+        self._deadline = None
+        self._alerts = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='admin-digest', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread, sending everything still waiting."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush(force=True)
+
+    def claimed(self, work_id, title, worker, filled, required, now=None):
+        """Record that worker took slot number filled of required on a work."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.signups += 1
+            entry = self._pending.get(work_id)
+            if entry is None:
+                entry = self._pending[work_id] = {'title': title, 'filled': filled, 'required': required, 'workers': []}
+            entry['workers'].append(worker)
+            entry['filled'] = max(entry['filled'], filled)
+            if filled >= required:
+                # Full: goes out now, with this work's waiting sign-ups
+                self._alerts.append((work_id, self._pending.pop(work_id)))
+                if not self._pending:
+                    self._deadline = None
+            elif self._deadline is None:
+                self._deadline = now + self.window
+        self._wakeup.set()
+
+    def flush(self, now=None, force=False):
+        """Send the fill alerts, and the digest if its window is over (or force). Returns the messages built."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            alerts, self._alerts = self._alerts, []
+            pending = None
+            if self._pending and (force or now >= self._deadline):
+                pending, self._pending, self._deadline = self._pending, OrderedDict(), None
+        texts = [(FULL, full_text(work_id, entry)) for work_id, entry in alerts]
+        if pending:
+            texts.append((DIGEST, digest_text(pending)))
+        for kind, text in texts:
+            for number in self.recipients:
+                try:
+                    self.send(number, text)
+                except Exception as e:
+                    logger.error(f"Error notifying admin {number}: {str(e)}")
+            self.sent[kind] += 1
+        return [text for _, text in texts]
+
+    def _run(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                deadline = self._deadline
+            self._wakeup.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error sending admin digest: {str(e)}")
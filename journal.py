@@ -0,0 +1,279 @@
+"""Append-only change journal with group commit for the catering data file.
+
+Instead of rewriting the whole data file on every request, each change is
+appended to the journal as one small record. A background flusher writes
+pending records in batches (one write and at most one fsync per batch), and
+once enough records pile up the journal is compacted: a full snapshot is
+written atomically to the data file and the records it covers are dropped.
+
+Startup replays the snapshot plus the journal records written after it. Every
+journal line carries a CRC, so a torn write at the tail after a crash is
+detected and discarded instead of corrupting the state.
+
+The journal assumes a single writing process.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# always - fsync every batch and make append() wait until its record is durable
+# batch  - fsync every batch, append() returns immediately (group commit)
+# never  - write batches without fsync and let the OS decide
+FSYNC_POLICIES = ('always', 'batch', 'never')
+
+
+def write_atomic(path, text):
+    """Write text (str or bytes) to path so readers only ever see the old or the new contents."""
+    tmp_path = f"{path}.tmp"
+    if isinstance(text, bytes):
+        f = open(tmp_path, 'wb')
+    else:
+        f = open(tmp_path, 'w', encoding='utf-8')
+    with f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+
+
+def _fsync_dir(path):
+    """Persist a rename by syncing the directory that holds path."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _encode(record):
+    payload = json.dumps(record, separators=(',', ':'))
+    return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n"
+
+
+def _decode(line):
+    """Return the record stored on a journal line, or None if it is torn or corrupt."""
+    if not line.endswith(b'\n'):
+        return None
+    crc, _, payload = line[:-1].partition(b' ')
+    try:
+        if int(crc, 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+class Journal:
+    """Append-only journal of changes, compacted into a snapshot file."""
+
+    def __init__(self, path, snapshot_path, snapshot=None, fsync='batch',
+                 flush_interval=0.05, batch_size=256, compact_every=500, on_write=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = path
+        self.snapshot_path = snapshot_path
+        # Callable returning (snapshot_text, seq), where the text may also be
+        # bytes. The caller must build both under the same lock it holds
+        # while mutating data and calling append().
+        self.snapshot = snapshot
+        self.fsync = fsync
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.compact_every = compact_every
+        # Called with ('journal', seconds) after each batch written and
+        # ('snapshot', seconds) after each compaction, e.g. for metrics
+        self.on_write = on_write
+
+        self._lock = threading.Lock()
+        self._pending = threading.Condition(self._lock)  # wakes the flusher
+        self._flushed = threading.Condition(self._lock)  # wakes waiting appenders
+        self._io_lock = threading.Lock()  # serializes file writes and compaction
+        # One compaction at a time, from its snapshot to its trim, so an older
+        # snapshot can never overwrite a newer one whose records are trimmed.
+        # Taken before the caller's lock (in snapshot()), never inside _io_lock
+        self._compact_lock = threading.Lock()
+        self._buffer = []
+        self._seq = 0
+        self._written_seq = 0
+        self._snapshot_seq = 0
+        self._file = None
+        self._flusher = None
+        self._compacting = False
+        self._closed = False
+        # Journal records and snapshots written so far (JSON is ASCII, so
+        # characters are bytes)
+        self.bytes_written = 0
+
+    @property
+    def last_seq(self):
+        """Sequence number of the most recently appended record."""
+        return self._seq
+
+    def replay(self, after_seq=0):
+        """Return the valid records written after after_seq, dropping a torn tail."""
+        records = []
+        self._snapshot_seq = after_seq
+        self._seq = self._written_seq = after_seq
+        if not os.path.exists(self.path):
+            return records
+
+        good_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                record = _decode(line)
+                if record is None:
+                    break
+                good_size += len(line)
+                self._seq = max(self._seq, record['seq'])
+                if record['seq'] > after_seq:
+                    records.append(record)
+
+        if good_size < os.path.getsize(self.path):
+            logger.warning(f"Discarding torn records at the end of {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_size)
+        self._written_seq = self._seq
+        return records
+
+    def append(self, op, **fields):
+        """Queue one change record and return its sequence number."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Journal is closed")
+            self._seq += 1
+            seq = self._seq
+            self._buffer.append(_encode({'seq': seq, 'op': op, **fields}))
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='journal-flusher', daemon=True)
+                self._flusher.start()
+            if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size or self.fsync == 'always':
+                self._pending.notify()
+            if self.fsync == 'always':
+                while self._written_seq < seq and not self._closed:
+                    self._flushed.wait()
+        return seq
+
+    def flush(self):
+        """Write every record appended so far before returning."""
+        with self._io_lock:
+            self._write_pending()
+
+    def compact(self):
+        """Write a full snapshot to the data file and drop the records it covers."""
+        if self.snapshot is None:
+            return
+        with self._compact_lock:
+            start = time.perf_counter()
+            text, seq = self.snapshot()
+            if seq < self._snapshot_seq:
+                return
+            with self._io_lock:
+                write_atomic(self.snapshot_path, text)
+                self.bytes_written += len(text)
+                self._write_pending()
+                self._trim(seq)
+            self._snapshot_seq = seq
+            self._observe('snapshot', start)
+        logger.info(f"Journal compacted into {self.snapshot_path} at record {seq}.")
+
+    def close(self):
+        """Flush pending records and stop the flusher thread."""
+        with self._lock:
+            self._closed = True
+            self._pending.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._buffer and not self._closed:
+                    self._pending.wait()
+                if not self._buffer:
+                    return
+                # Give concurrent requests a moment to join this batch
+                if self.fsync != 'always' and len(self._buffer) < self.batch_size and not self._closed:
+                    self._pending.wait(self.flush_interval)
+            try:
+                with self._io_lock:
+                    self._write_pending()
+            except Exception as e:
+                logger.error(f"Error writing journal: {str(e)}")
+            if self._seq - self._snapshot_seq >= self.compact_every:
+                self._start_compaction()
+
+    def _write_pending(self):
+        """Write the buffered records as one batch. Caller holds _io_lock."""
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            seq = self._seq
+        if lines:
+            start = time.perf_counter()
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            data = ''.join(lines)
+            self._file.write(data)
+            self._file.flush()
+            self.bytes_written += len(data)
+            if self.fsync != 'never':
+                os.fsync(self._file.fileno())
+            self._observe('journal', start)
+        with self._lock:
+            self._written_seq = max(self._written_seq, seq)
+            self._flushed.notify_all()
+
+    def _observe(self, kind, start):
+        if self.on_write is not None:
+            try:
+                self.on_write(kind, time.perf_counter() - start)
+            except Exception as e:
+                logger.error(f"Error in journal write callback: {str(e)}")
+
+    def _trim(self, seq):
+        """Rewrite the journal keeping only records after seq. Caller holds _io_lock."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not os.path.exists(self.path):
+            return
+        kept = []
+        with open(self.path, 'rb') as f:
+            for line in f:
+                record = _decode(line)
+                if record is None:
+                    break
+                if record['seq'] > seq:
+                    kept.append(line.decode('utf-8'))
+        write_atomic(self.path, ''.join(kept))
+
+    def _start_compaction(self):
+        with self._lock:
+            if self._compacting or self._closed:
+                return
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error compacting journal: {str(e)}")
+            finally:
+                with self._lock:
+                    self._compacting = False
+
+        threading.Thread(target=run, name='journal-compactor', daemon=True).start()
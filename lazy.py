@@ -0,0 +1,45 @@
+"""Services that are built on first use instead of at import time.
+
+Importing the app should not connect to Twilio, load the data file or start
+threads: tools and tests that only need a function from it would pay for all
+of that, and so would every gunicorn worker before it is ready. A Lazy stands
+in for such a service and builds it the first time one of its attributes is
+used, or when get() is called by a startup hook.
+"""
+import threading
+
+
+class Lazy:
+    """Proxy that builds its object with build() on first use, once, even across threads.
+
+    get and built belong to the proxy, so an object's own attributes with
+    those names are reached through get().
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._value = None
+        self._built = False
+        self._lock = threading.Lock()
+
+    @property
+    def built(self):
+        return self._built
+
+    def get(self):
+        """Return the object, building it if needed."""
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value = self._build()
+                    self._built = True
+        return self._value
+
+    def __getattr__(self, name):
+        # Only called for attributes the proxy itself does not have
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __bool__(self):
+        return self.get() is not None
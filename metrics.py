@@ -0,0 +1,373 @@
+"""In-process metrics rendered in the Prometheus text format, and a slow request profiler.
+
+Counters and histograms are plain Python numbers behind one lock per metric,
+so recording a value costs a dict lookup and an addition. Gauges are read
+from a callback when metrics are collected, so they cost nothing in between.
+
+Each gunicorn worker has its own metrics. When a directory is given, every
+process writes its values there as metrics_<pid>.json (every few seconds
+and whenever it serves /metrics), and /metrics adds up the files of all
+processes. Counters and histograms of processes that have exited are still
+counted; their gauges are not.
+"""
+import bisect
+import collections
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Seconds; suits request handling and provider round trips
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """Return {label values: value} with JSON-friendly values."""
+        with self._lock:
+            return {labels: self._copy(value) for labels, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, *labels):
+        """Context manager observing how long its block takes."""
+        return _Timer(self, labels)
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class Gauge(Metric):
+    """Value read from read() at collection time.
+
+    read() returns a number, or {label values: number} for labelled gauges.
+    mode says how values from several processes combine: "sum" or "max".
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, read, labelnames=(), mode='sum'):
+        super().__init__(name, help_text, labelnames)
+        self.read = read
+        self.mode = mode
+
+    def snapshot(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {str(e)}")
+            return {}
+        if value is None:
+            return {}
+        if isinstance(value, dict):
+            return {tuple(labels) if isinstance(labels, tuple) else (labels,): v for labels, v in value.items()}
+        return {(): value}
+
+
+class CallbackCounter(Gauge):
+    """Counter kept elsewhere (e.g. bytes a journal wrote) and read at collection time."""
+
+    kind = 'counter'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    """The metrics of one process, optionally shared with others through a directory."""
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, read, labelnames=(), mode='sum'):
+        return self._add(Gauge(name, help_text, read, labelnames, mode))
+
+    def counter_callback(self, name, help_text, read, labelnames=()):
+        return self._add(CallbackCounter(name, help_text, read, labelnames))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def start(self):
+        """Write this process's values to the directory every flush_interval seconds."""
+        if self.directory is None or self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.write()
+            except Exception as e:
+                logger.error(f"Error writing metrics: {str(e)}")
+
+    def snapshot(self):
+        """Return this process's metrics as a JSON-friendly dict."""
+        metrics = {}
+        for metric in self._metrics:
+            entry = {'kind': metric.kind, 'help': metric.help, 'labelnames': list(metric.labelnames),
+                     'samples': [[list(labels), value] for labels, value in metric.snapshot().items()]}
+            if metric.kind == 'histogram':
+                entry['buckets'] = list(metric.buckets)
+            if metric.kind == 'gauge':
+                entry['mode'] = metric.mode
+            metrics[metric.name] = entry
+        return metrics
+
+    def write(self):
+        """Write this process's values to the shared directory."""
+        if self.directory is None:
+            return
+        path = os.path.join(self.directory, f"metrics_{os.getpid()}.json")
+        # Renamed into place so readers never see half a file; no fsync, as
+        # losing the last few seconds of metrics in a crash does not matter
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self):
+        """Return the metrics of every process, combined, in the snapshot format."""
+        if self.directory is None:
+            return self.snapshot()
+        self.write()
+        combined = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+                with open(path, 'r') as f:
+                    metrics = json.load(f)
+            except (ValueError, OSError) as e:
+                logger.warning(f"Skipping metrics file {path}: {str(e)}")
+                continue
+            alive = _alive(pid)
+            for name, entry in metrics.items():
+                if entry['kind'] == 'gauge' and not alive:
+                    continue
+                _merge(combined, name, entry)
+        return combined
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, entry in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['kind']}")
+            labelnames = entry['labelnames']
+            for labels, value in sorted(entry['samples'], key=lambda sample: sample[0]):
+                if entry['kind'] != 'histogram':
+                    lines.append(f"{name}{_labels(labelnames, labels)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(entry['buckets'] + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(labelnames + ['le'], labels + [bound])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labelnames, labels)} {total}")
+                lines.append(f"{name}_count{_labels(labelnames, labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(combined, name, entry):
+    target = combined.get(name)
+    if target is None:
+        combined[name] = dict(entry, labelnames=list(entry['labelnames']),
+                              samples=[[list(labels), value] for labels, value in entry['samples']])
+        return
+    by_labels = {tuple(sample[0]): sample for sample in target['samples']}
+    for labels, value in entry['samples']:
+        sample = by_labels.get(tuple(labels))
+        if sample is None:
+            target['samples'].append([list(labels), value])
+        elif entry['kind'] == 'histogram':
+            sample[1] = [[a + b for a, b in zip(sample[1][0], value[0])], sample[1][1] + value[1], sample[1][2] + value[2]]
+        elif entry['kind'] == 'gauge' and entry.get('mode') == 'max':
+            sample[1] = max(sample[1], value)
+        else:
+            sample[1] = sample[1] + value
+
+
+def _alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class SlowRequestProfiler:
+    """Sampling profiler that reports where slow requests spend their time.
+
+    While a tracked block runs, a sampler thread records the stack of the
+    thread running it every interval seconds. If the block takes longer than
+    threshold seconds, its most frequent stacks are logged and kept in
+    reports. Nothing is sampled while no tracked block is running.
+    """
+
+    def __init__(self, threshold, interval=0.005, keep=20, depth=12):
+        self.threshold = threshold
+        self.interval = interval
+        self.depth = depth
+        self.reports = collections.deque(maxlen=keep)
+        self._active = {}  # thread ID -> Counter of sampled stacks
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def track(self, name):
+        """Context manager profiling its block under name, e.g. a request's command."""
+        return _Tracked(self, name)
+
+    def _begin(self):
+        thread_id = threading.get_ident()
+        with self._cond:
+            self._active[thread_id] = collections.Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='slow-request-profiler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return thread_id
+
+    def _end(self, thread_id, name, elapsed):
+        with self._cond:
+            samples = self._active.pop(thread_id, None)
+        if samples is None or elapsed < self.threshold:
+            return
+        report = {
+            'name': name,
+            'seconds': round(elapsed, 4),
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'samples': sum(samples.values()),
+            'stacks': [{'count': count, 'stack': list(stack)} for stack, count in samples.most_common(5)]
+        }
+        self.reports.append(report)
+        top = report['stacks'][0]['stack'][-1] if report['stacks'] else 'no samples'
+        logger.warning(f"Slow request {name}: {elapsed * 1000:.0f}ms, "
+                       f"{report['samples']} samples, hottest frame {top}")
+
+    def _sample(self):
+        while True:
+            with self._cond:
+                while not self._active:
+                    self._cond.wait()
+                active = list(self._active)
+            frames = sys._current_frames()
+            stacks = {}
+            for thread_id in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[thread_id] = tuple(
+                        f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                        for entry in traceback.extract_stack(frame, limit=self.depth)
+                    )
+            del frames
+            with self._cond:
+                for thread_id, stack in stacks.items():
+                    samples = self._active.get(thread_id)
+                    if samples is not None:
+                        samples[stack] += 1
+            time.sleep(self.interval)
+
+
+class _Tracked:
+    __slots__ = ('profiler', 'name', 'thread_id', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.thread_id = self.profiler._begin()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._end(self.thread_id, self.name, time.perf_counter() - self.start)
@@ -0,0 +1,506 @@
+"""Durable outbox and rate-limited delivery engine for outgoing WhatsApp messages.
+
+Messages are written to an SQLite outbox before anything is sent, so nothing
+queued is lost if the process dies. A small pool of sender threads takes due
+messages from the outbox, waits for a token from a shared token bucket (so
+sends stay within the provider's messages-per-second limit), and hands them
+to a pluggable transport. Failed sends are retried with exponential backoff
+until max_attempts is reached. Every status change is reported through a
+callback so the caller can record it. Sent and failed messages are deleted
+once they are older than the retention period.
+
+The token bucket is kept per engine by default. A SharedTokenBucket keeps it
+in an SQLite file instead, so engines in several processes, or for several
+outboxes, sending from one number share one rate limit.
+
+Each message is leased while it is being sent. If a process dies mid-send,
+the lease expires and the message is sent again by whichever process picks
+it up next, so several processes can share one outbox.
+
+The fake transport lets you benchmark the engine without network access:
+
+    python outbox.py bench --messages 500 --rate 100 --workers 8
+"""
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Message states
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_number TEXT NOT NULL,
+    body TEXT NOT NULL,
+    work_id TEXT,
+    reminder_id TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    provider_id TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+# The number of messages in each state, kept by triggers so counting them
+# never scans the outbox
+COUNTS_SCHEMA = (
+    "CREATE TABLE outbox_counts (status TEXT PRIMARY KEY, n INTEGER NOT NULL)",
+    "CREATE TRIGGER outbox_count_insert AFTER INSERT ON outbox BEGIN "
+    "INSERT INTO outbox_counts (status, n) VALUES (NEW.status, 1) ON CONFLICT(status) DO UPDATE SET n = n + 1; "
+    "END",
+    "CREATE TRIGGER outbox_count_update AFTER UPDATE OF status ON outbox WHEN OLD.status != NEW.status BEGIN "
+    "UPDATE outbox_counts SET n = n - 1 WHERE status = OLD.status; "
+    "INSERT INTO outbox_counts (status, n) VALUES (NEW.status, 1) ON CONFLICT(status) DO UPDATE SET n = n + 1; "
+    "END",
+    "CREATE TRIGGER outbox_count_delete AFTER DELETE ON outbox BEGIN "
+    "UPDATE outbox_counts SET n = n - 1 WHERE status = OLD.status; "
+    "END",
+)
+
+BUCKET_SCHEMA = """
+CREATE TABLE IF NOT EXISTS send_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class PermanentError(Exception):
+    """A send failure that retrying cannot fix, such as an invalid number."""
+
+
+class TwilioTransport:
+    """Send messages through a Twilio REST client."""
+
+    def __init__(self, client, from_number):
+        self.client = client
+        self.from_number = from_number
+
+    def send(self, to, body):
+        try:
+            from twilio.base.exceptions import TwilioRestException
+        except ImportError:
+            TwilioRestException = None
+        try:
+            message = self.client.messages.create(body=body, from_=self.from_number, to=to)
+        except Exception as e:
+            # 4xx responses other than rate limiting will fail the same way again
+            if TwilioRestException and isinstance(e, TwilioRestException) and 400 <= e.status < 500 and e.status != 429:
+                raise PermanentError(str(e))
+            raise
+        return message.sid
+
+
+class FakeTransport:
+    """Local stand-in for Twilio with configurable latency and failure rate."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, to, body):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ConnectionError("Simulated provider failure")
+        with self._lock:
+            self.sent.append((to, body))
+            return f"FAKE{len(self.sent):08d}"
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing rate sends per second with bursts up to capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket:
+    """Token bucket kept in an SQLite file, shared by every process and thread using the same key.
+
+    Works like TokenBucket, but against the wall clock, so buckets opened
+    by different processes on one file and key hand out rate tokens a
+    second between them.
+    """
+
+    def __init__(self, db_file, key, rate, capacity=None):
+        self.db_file = db_file
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._local = threading.local()
+        self._conn().executescript(BUCKET_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            wait = self._take()
+            if wait is None:
+                return
+            time.sleep(wait)
+
+    def _take(self):
+        """Take a token and return None, or return how long until there is one."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM send_buckets WHERE key = ?", (self.key,)).fetchone()
+            if row is None:
+                tokens = self.capacity
+            else:
+                tokens = min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+            wait = None
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute(
+                "INSERT INTO send_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (self.key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class Outbox:
+    """Persistent queue of outgoing messages stored in SQLite."""
+
+    def __init__(self, db_file, lease_seconds=60):
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        self._create_counts(conn)
+
+    def _create_counts(self, conn):
+        """Add the state counts to an outbox that does not have them yet, counting what it holds."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'outbox_counts'").fetchone() is None:
+                for statement in COUNTS_SCHEMA:
+                    conn.execute(statement)
+                conn.execute("INSERT INTO outbox_counts (status, n) SELECT status, COUNT(*) FROM outbox GROUP BY status")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, to, body, work_id=None, reminder_id=None):
+        """Durably queue one message and return its ID."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO outbox (to_number, body, work_id, reminder_id, status, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (to, body, work_id, reminder_id, PENDING, now, now)
+        )
+        return cursor.lastrowid
+
+    def claim(self):
+        """Lease the next due message for sending, or return None."""
+        now = time.time()
+        return self._conn().execute(
+            "UPDATE outbox SET status = ?, lease_until = ?, attempts = attempts + 1 "
+            "WHERE id = (SELECT id FROM outbox WHERE "
+            "(status = ? AND next_attempt_at <= ?) OR (status = ? AND lease_until < ?) "
+            "ORDER BY next_attempt_at LIMIT 1) "
+            "RETURNING *",
+            (SENDING, now + self.lease_seconds, PENDING, now, SENDING, now)
+        ).fetchone()
+
+    def next_due_in(self):
+        """Seconds until the next pending message is due, or None if there is none."""
+        row = self._conn().execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?", (PENDING,)
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def mark_sent(self, message_id, provider_id):
+        self._conn().execute(
+            "UPDATE outbox SET status = ?, provider_id = ?, sent_at = ?, lease_until = NULL WHERE id = ?",
+            (SENT, provider_id, time.time(), message_id)
+        )
+
+    def mark_retry(self, message_id, delay, error):
+        self._conn().execute(
+            "UPDATE outbox SET status = ?, next_attempt_at = ?, last_error = ?, lease_until = NULL WHERE id = ?",
+            (PENDING, time.time() + delay, error, message_id)
+        )
+
+    def mark_failed(self, message_id, error):
+        self._conn().execute(
+            "UPDATE outbox SET status = ?, last_error = ?, lease_until = NULL WHERE id = ?",
+            (FAILED, error, message_id)
+        )
+
+    def counts(self):
+        """Return the number of messages in each state."""
+        return {
+            row['status']: row['n']
+            for row in self._conn().execute("SELECT status, n FROM outbox_counts WHERE n > 0")
+        }
+
+    def prune(self, before):
+        """Delete sent and failed messages finished before the given time, and return how many."""
+        # A message is never sent before it is due, so next_attempt_at bounds
+        # sent_at, and the range can be read from the outbox_due index
+        cursor = self._conn().execute(
+            "DELETE FROM outbox WHERE status IN (?, ?) AND next_attempt_at < ? AND COALESCE(sent_at, next_attempt_at) < ?",
+            (SENT, FAILED, before, before)
+        )
+        return cursor.rowcount
+
+    def get(self, message_id):
+        return self._conn().execute("SELECT * FROM outbox WHERE id = ?", (message_id,)).fetchone()
+
+
+class DeliveryEngine:
+    """Pool of sender threads draining an Outbox through a transport.
+
+    on_status(message, status, error) is called after every attempt with
+    status "sent", "retrying" or "failed", and on_send(seconds, error) with
+    how long the transport took to send (error is None on success).
+
+    bucket replaces the engine's own TokenBucket(rate, burst), e.g. with a
+    SharedTokenBucket. Sent and failed messages are deleted retention
+    seconds after they finished (None keeps them), checked every
+    prune_interval seconds.
+    """
+
+    def __init__(self, outbox, transport, workers=4, rate=10, burst=None,
+                 max_attempts=5, base_delay=2.0, max_delay=300.0, on_status=None, poll_interval=1.0,
+                 on_send=None, bucket=None, retention=7 * 86400, prune_interval=3600):
+        self.outbox = outbox
+        self.transport = transport
+        self.workers = workers
+        self.bucket = bucket if bucket is not None else TokenBucket(rate, burst)
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._pruned_at = 0.0
+        self._prune_lock = threading.Lock()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_status = on_status
+        self.on_send = on_send
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'outbox-sender-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def enqueue(self, to, body, work_id=None, reminder_id=None):
+        """Queue a message and wake a sender thread."""
+        message_id = self.outbox.enqueue(to, body, work_id=work_id, reminder_id=reminder_id)
+        with self._wakeup:
+            self._wakeup.notify()
+        return message_id
+
+    def backoff(self, attempts):
+        """Delay before retry number attempts, with jitter."""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                message = self.outbox.claim()
+            except Exception as e:
+                logger.error(f"Error reading outbox: {str(e)}")
+                message = None
+            if message is None:
+                self._prune()
+                self._idle()
+                continue
+            self.bucket.acquire()
+            self._deliver(message)
+
+    def _prune(self):
+        """Delete old finished messages, at most once every prune_interval, from one thread."""
+        if self.retention is None or time.time() - self._pruned_at < self.prune_interval:
+            return
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._pruned_at = time.time()
+            pruned = self.outbox.prune(self._pruned_at - self.retention)
+            if pruned:
+                logger.info(f"Pruned {pruned} finished messages from the outbox")
+        except Exception as e:
+            logger.error(f"Error pruning outbox: {str(e)}")
+        finally:
+            self._prune_lock.release()
+
+    def _idle(self):
+        due_in = self.outbox.next_due_in()
+        timeout = self.poll_interval if due_in is None else min(due_in, self.poll_interval)
+        with self._wakeup:
+            if not self._stopping:
+                self._wakeup.wait(timeout)
+
+    def _deliver(self, message):
+        start = time.perf_counter()
+        try:
+            provider_id = self.transport.send(message['to_number'], message['body'])
+        except Exception as e:
+            self._timed(start, e)
+            error = str(e)
+            if isinstance(e, PermanentError) or message['attempts'] >= self.max_attempts:
+                self.outbox.mark_failed(message['id'], error)
+                logger.error(f"Giving up on message to {message['to_number']} after {message['attempts']} attempts: {error}")
+                self._report(message, FAILED, error)
+            else:
+                delay = self.backoff(message['attempts'])
+                self.outbox.mark_retry(message['id'], delay, error)
+                logger.warning(f"Send to {message['to_number']} failed, retrying in {delay:.1f}s: {error}")
+                self._report(message, 'retrying', error)
+            return
+        self._timed(start, None)
+        self.outbox.mark_sent(message['id'], provider_id)
+        logger.info(f"Sent message to {message['to_number']}")
+        self._report(message, SENT, None)
+
+    def _timed(self, start, error):
+        if self.on_send is not None:
+            self.on_send(time.perf_counter() - start, error)
+
+    def _report(self, message, status, error):
+        if self.on_status is None:
+            return
+        try:
+            self.on_status(message, status, error)
+        except Exception as e:
+            logger.error(f"Error recording delivery status: {str(e)}")
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_benchmark(messages, rate, workers, latency, failure_rate):
+    """Send messages through a FakeTransport and return throughput and latency figures."""
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = Outbox(os.path.join(tmp, 'outbox.db'))
+        transport = FakeTransport(latency=latency, failure_rate=failure_rate)
+        done = threading.Semaphore(0)
+        engine = DeliveryEngine(outbox, transport, workers=workers, rate=rate, base_delay=0.01,
+                                on_status=lambda m, status, e: status != 'retrying' and done.release())
+        start = time.time()
+        ids = [outbox.enqueue(f"whatsapp:+{n}", f"Benchmark message {n}") for n in range(messages)]
+        engine.start()
+        for _ in ids:
+            done.acquire()
+        elapsed = time.time() - start
+        engine.stop()
+
+        latencies = [
+            (row['sent_at'] - row['created_at']) * 1000
+            for row in (outbox.get(i) for i in ids) if row['status'] == SENT
+        ]
+        return {
+            'messages': messages,
+            'sent': len(latencies),
+            'failed': outbox.counts().get(FAILED, 0),
+            'seconds': elapsed,
+            'per_second': messages / elapsed,
+            'p50_ms': _percentile(latencies, 50) if latencies else None,
+            'p95_ms': _percentile(latencies, 95) if latencies else None,
+            'p99_ms': _percentile(latencies, 99) if latencies else None,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the delivery engine against a fake transport")
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=100, help="token bucket rate (messages per second)")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help="fake provider latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    result = run_benchmark(args.messages, args.rate, args.workers, args.latency, args.failure_rate)
+    print(f"Sent {result['sent']}/{result['messages']} messages ({result['failed']} failed) in {result['seconds']:.2f}s")
+    print(f"Throughput: {result['per_second']:.1f} messages/s")
+    if result['sent']:
+        print(f"Latency: p50 {result['p50_ms']:.0f}ms, p95 {result['p95_ms']:.0f}ms, p99 {result['p99_ms']:.0f}ms")
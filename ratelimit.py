@@ -0,0 +1,72 @@
+"""Per-sender rate limiting for inbound messages.
+
+Each sender gets a token bucket: up to burst messages at once, refilled at
+rate messages per second. A message that finds the bucket empty is shed
+before any real work is done for it. Buckets live in memory, one set per
+process, ordered by last use: a bucket that has been idle long enough to
+fill up again is the same as no bucket, so those are dropped as new messages
+come in, and the least recently used ones go first if there are ever more
+than max_senders. A rate or a burst of 0 turns the limit off.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class SenderLimiter:
+    """Thread-safe token buckets keyed by sender, with bounded memory."""
+
+    def __init__(self, rate, burst, max_senders=10000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_senders = max_senders
+        # Seconds after which an untouched bucket is full again
+        self.refill_seconds = self.burst / self.rate if self.rate > 0 else float('inf')
+        self.allowed = 0
+        self.shed = 0
+        # Sender -> [tokens, last update, warned], least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, sender, now=None):
+        """Take a token for sender's message.
+
+        Returns (allowed, first_shed): first_shed is True for the first
+        message shed since the sender was last allowed through, so only that
+        one needs an answer.
+        """
+        if self.rate <= 0 or self.burst <= 0:
+            return True, False
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._evict(now)
+            bucket = self._buckets.get(sender)
+            if bucket is None:
+                if len(self._buckets) >= self.max_senders:
+                    self._buckets.popitem(last=False)
+                bucket = self._buckets[sender] = [self.burst, now, False]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(sender)
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                bucket[2] = False
+                self.allowed += 1
+                return True, False
+            first_shed = not bucket[2]
+            bucket[2] = True
+            self.shed += 1
+            return False, first_shed
+
+    def _evict(self, now):
+        """Drop the buckets that have filled up again since their last use."""
+        buckets = self._buckets
+        while buckets:
+            sender, bucket = next(iter(buckets.items()))
+            if now - bucket[1] < self.refill_seconds:
+                return
+            del buckets[sender]
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,280 @@
+"""Restart-safe reminder scheduling and event time parsing.
+
+Scheduled reminders are stored on their work (in "scheduled_reminders") with
+a status, so they are the source of truth: at startup the scheduler rebuilds
+its queue from storage, and it re-reads storage periodically to pick up
+reminders scheduled by other processes.
+
+Pending reminders sit in a heap ordered by due time, and a single thread
+sleeps until the earliest one is due, so thousands of pending reminders cost
+nothing while idle. Only the process holding the scheduler lock file fires
+reminders; the other processes keep trying to take the lock, so another one
+takes over if the leader dies.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Scheduled reminder states
+SCHEDULED = 'scheduled'
+SENT = 'sent'
+MISSED = 'missed'
+
+MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+STRICT_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M",
+    "%d/%m/%Y %H:%M",
+    "%d-%m-%Y %H:%M",
+)
+
+CLOCK_12H = re.compile(r'\b(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)\b')
+CLOCK_24H = re.compile(r'\b(\d{1,2}):(\d{2})\b')
+DAY_MONTH = re.compile(r'\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?([a-z]{3,9})\b')
+MONTH_DAY = re.compile(r'\b([a-z]{3,9})\s+(\d{1,2})(?:st|nd|rd|th)?\b')
+NUMERIC_DATE = re.compile(r'\b(\d{1,2})[/-](\d{1,2})(?:[/-](\d{2,4}))?\b')
+YEAR = re.compile(r'\b(20\d{2})\b')
+
+
+def parse_event_time(text, reference=None):
+    """Parse a free-form event time such as "June 15 at 6PM" into a datetime.
+
+    Dates without a year are taken as the next occurrence after reference
+    (default now), numeric dates are read day first (15/06/2025), and
+    "today", "tomorrow" and weekday names are understood. Returns None
+    unless both a date and a clock time are found.
+    """
+    if not text:
+        return None
+    reference = reference or datetime.now()
+    text = text.strip().lower()
+
+    for fmt in STRICT_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+
+    # Clock time first, removing it so its digits are not read as a date
+    match = CLOCK_12H.search(text)
+    if match:
+        hour, minute = int(match.group(1)), int(match.group(2) or 0)
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if match.group(3) == 'pm' else 0)
+    else:
+        match = CLOCK_24H.search(text)
+        if not match:
+            return None
+        hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    text = text[:match.start()] + ' ' + text[match.end():]
+
+    year_match = YEAR.search(text)
+    year = int(year_match.group(1)) if year_match else None
+    day = month = None
+
+    if 'today' in text or 'tonight' in text:
+        day, month, year = reference.day, reference.month, reference.year
+    elif 'tomorrow' in text:
+        tomorrow = reference + timedelta(days=1)
+        day, month, year = tomorrow.day, tomorrow.month, tomorrow.year
+    else:
+        for pattern, day_group, month_group in ((DAY_MONTH, 1, 2), (MONTH_DAY, 2, 1)):
+            for m in pattern.finditer(text):
+                name = m.group(month_group)[:3]
+                if name in MONTHS:
+                    day, month = int(m.group(day_group)), MONTHS.index(name) + 1
+                    break
+            if month:
+                break
+        if not month:
+            m = NUMERIC_DATE.search(text)
+            if m:
+                day, month = int(m.group(1)), int(m.group(2))
+                if m.group(3):
+                    year = int(m.group(3))
+                    year += 2000 if year < 100 else 0
+        if not month:
+            for index, name in enumerate(WEEKDAYS):
+                if re.search(rf'\b{name}', text):
+                    ahead = (index - reference.weekday()) % 7
+                    date = reference + timedelta(days=ahead)
+                    if ahead == 0 and (hour, minute) < (reference.hour, reference.minute):
+                        date += timedelta(days=7)
+                    day, month, year = date.day, date.month, date.year
+                    break
+        if not month:
+            return None
+
+    try:
+        if year is not None:
+            return datetime(year, month, day, hour, minute)
+        result = datetime(reference.year, month, day, hour, minute)
+        # No year given: a date that has already gone by means next year
+        if result < reference - timedelta(days=1):
+            result = datetime(reference.year + 1, month, day, hour, minute)
+        return result
+    except ValueError:
+        return None
+
+
+def event_time(work):
+    """Return the event datetime of a work, or None if its time is not understood."""
+    if work.get("event_at"):
+        return datetime.strptime(work["event_at"], TIME_FORMAT)
+    created_at = work.get("created_at")
+    reference = datetime.strptime(created_at, TIME_FORMAT) if created_at else None
+    return parse_event_time(work.get("time"), reference)
+
+
+class ReminderScheduler:
+    """Fires persisted reminders at their due time from a heap, in one elected process.
+
+    A job is a dict with "id", "work_id", "message" and "run_at" (a Unix
+    timestamp). fire(job) is called when a job is due; load_pending() must
+    return every job that is still scheduled in storage.
+    """
+
+    def __init__(self, fire, load_pending, lock_file, resync_interval=30, misfire_grace=3600, on_missed=None):
+        self.fire = fire
+        self.load_pending = load_pending
+        self.lock_file = lock_file
+        self.resync_interval = resync_interval
+        self.misfire_grace = misfire_grace
+        self.on_missed = on_missed
+        self._heap = []
+        self._known = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._lock_handle = None
+
+    @property
+    def is_leader(self):
+        return self._lock_handle is not None
+
+    @property
+    def pending(self):
+        """Number of reminders waiting in this process's queue."""
+        return len(self._heap)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+
+    def schedule(self, job):
+        """Queue a job that has already been persisted.
+
+        Only the leader keeps a queue; other processes rely on the leader
+        picking the job up from storage on its next resync.
+        """
+        if self.is_leader:
+            with self._cond:
+                self._push(job)
+                self._cond.notify()
+
+    def _push(self, job):
+        if job['id'] in self._known:
+            return
+        self._known.add(job['id'])
+        heapq.heappush(self._heap, (job['run_at'], job['id'], job))
+
+    def _try_lead(self):
+        handle = open(self.lock_file, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+        self._lock_handle = handle
+        logger.info("This process now fires scheduled reminders.")
+        return True
+
+    def _resync(self):
+        try:
+            jobs = self.load_pending()
+        except Exception as e:
+            logger.error(f"Error loading scheduled reminders: {str(e)}")
+            return
+        with self._cond:
+            for job in jobs:
+                self._push(job)
+
+    def _run(self):
+        next_resync = 0
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+            if not self.is_leader and not self._try_lead():
+                with self._cond:
+                    self._cond.wait(self.resync_interval)
+                continue
+
+            now = time.time()
+            if now >= next_resync:
+                self._resync()
+                next_resync = now + self.resync_interval
+
+            due = []
+            with self._cond:
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[2])
+            for job in due:
+                self._fire(job, now)
+
+            with self._cond:
+                if self._stopping:
+                    return
+                wake_at = next_resync
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                self._cond.wait(max(0.0, wake_at - time.time()))
+
+    def _fire(self, job, now):
+        try:
+            if now - job['run_at'] > self.misfire_grace:
+                logger.warning(f"Skipping reminder {job['id']} for {job['work_id']}: it was due "
+                               f"{int(now - job['run_at'])}s ago")
+                if self.on_missed:
+                    self.on_missed(job)
+            else:
+                self.fire(job)
+        except Exception as e:
+            logger.error(f"Error firing reminder {job['id']}: {str(e)}")
+        finally:
+            with self._cond:
+                self._known.discard(job['id'])
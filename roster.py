@@ -0,0 +1,277 @@
+"""Worker roster and batched broadcasts of new work opportunities.
+
+Every worker who messages the bot is added to the roster. The admin tags
+workers (skills, area, reliability - any words, such as "waiter", "north" or
+"reliable"), and a segment is the workers carrying all of a set of tags.
+
+A broadcast sends one work to a segment, batch_size workers at a time, in
+order of phone number. Its progress (the last number reached) is stored with
+it, so a broadcast interrupted by a crash resumes where it stopped, in
+whichever process takes it over. Before each batch the work is looked at
+again, and the broadcast stops as soon as the work is full or past.
+
+Everything is kept in SQLite, shared by all worker processes. Workers are
+read through indexes in number order, so a segment of tens of thousands of
+workers is walked one batch at a time without loading it.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Broadcast states
+RUNNING = 'running'
+DONE = 'done'
+STOPPED = 'stopped'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    number TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS worker_tags (
+    tag TEXT NOT NULL,
+    number TEXT NOT NULL,
+    PRIMARY KEY (tag, number)
+);
+CREATE INDEX IF NOT EXISTS worker_tags_number ON worker_tags (number);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    work_id TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    cursor TEXT NOT NULL DEFAULT '',
+    reason TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS broadcasts_status ON broadcasts (status, lease_until);
+"""
+
+
+def normalize_tags(tags):
+    """Lowercase, deduplicated tags in a stable order."""
+    return sorted({tag.strip().lower() for tag in tags if tag.strip()})
+
+
+class Roster:
+    """Workers, their tags and broadcasts, stored in SQLite."""
+
+    def __init__(self, db_file, lease_seconds=60):
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        # Numbers this process has already added, so seeing a worker again costs no write
+        self._known = set()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def add(self, number):
+        """Add a worker to the roster, if not there yet."""
+        if number in self._known:
+            return
+        self._conn().execute(
+            "INSERT OR IGNORE INTO workers (number, first_seen) VALUES (?, ?)", (number, time.time())
+        )
+        self._known.add(number)
+
+    def tag(self, number, tags):
+        """Add tags to a worker, adding the worker to the roster if needed."""
+        self.add(number)
+        self._conn().executemany(
+            "INSERT OR IGNORE INTO worker_tags (tag, number) VALUES (?, ?)",
+            [(tag, number) for tag in normalize_tags(tags)]
+        )
+
+    def untag(self, number, tags):
+        self._conn().executemany(
+            "DELETE FROM worker_tags WHERE tag = ? AND number = ?",
+            [(tag, number) for tag in normalize_tags(tags)]
+        )
+
+    def tags(self, number):
+        return [row[0] for row in self._conn().execute(
+            "SELECT tag FROM worker_tags WHERE number = ? ORDER BY tag", (number,)
+        )]
+
+    def tag_counts(self):
+        """Return {tag: number of workers} for every tag in use."""
+        return {row[0]: row[1] for row in self._conn().execute(
+            "SELECT tag, COUNT(*) FROM worker_tags GROUP BY tag ORDER BY tag"
+        )}
+
+    def segment(self, tags=(), after='', limit=100):
+        """Return up to limit numbers carrying every tag, in number order after the number after."""
+        tags = normalize_tags(tags)
+        if not tags:
+            rows = self._conn().execute(
+                "SELECT number FROM workers WHERE number > ? ORDER BY number LIMIT ?", (after, limit)
+            )
+        else:
+            # Walk the first tag's (tag, number) index range and look up the
+            # other tags by primary key
+            joins = "".join(
+                f" JOIN worker_tags t{n} ON t{n}.number = t0.number AND t{n}.tag = ?" for n in range(1, len(tags))
+            )
+            rows = self._conn().execute(
+                f"SELECT t0.number FROM worker_tags t0{joins} "
+                "WHERE t0.tag = ? AND t0.number > ? ORDER BY t0.number LIMIT ?",
+                tuple(tags[1:]) + (tags[0], after, limit)
+            )
+        return [row[0] for row in rows]
+
+    def count(self, tags=()):
+        """Number of workers carrying every tag."""
+        tags = normalize_tags(tags)
+        if not tags:
+            return self._conn().execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM (SELECT number FROM worker_tags WHERE tag IN "
+            f"({', '.join('?' * len(tags))}) GROUP BY number HAVING COUNT(*) = ?)",
+            tuple(tags) + (len(tags),)
+        ).fetchone()[0]
+
+    def create_broadcast(self, work_id, tags=()):
+        """Start a broadcast of a work to a segment and return it."""
+        tags = normalize_tags(tags)
+        cursor = self._conn().execute(
+            "INSERT INTO broadcasts (work_id, tags, status, total, created_at) VALUES (?, ?, ?, ?, ?)",
+            (work_id, ' '.join(tags), RUNNING, self.count(tags), time.time())
+        )
+        return self.get_broadcast(cursor.lastrowid)
+
+    def get_broadcast(self, broadcast_id):
+        return self._conn().execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+
+    def recent_broadcasts(self, limit=5):
+        return self._conn().execute(
+            "SELECT * FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+
+    def claim_broadcast(self):
+        """Lease the oldest running broadcast no other process is working on, or return None."""
+        now = time.time()
+        return self._conn().execute(
+            "UPDATE broadcasts SET lease_until = ? WHERE id = ("
+            "SELECT id FROM broadcasts WHERE status = ? AND (lease_until IS NULL OR lease_until < ?) "
+            "ORDER BY id LIMIT 1) RETURNING *",
+            (now + self.lease_seconds, RUNNING, now)
+        ).fetchone()
+
+    def advance(self, broadcast_id, cursor, sent):
+        """Record a finished batch and renew the lease."""
+        self._conn().execute(
+            "UPDATE broadcasts SET cursor = ?, sent = sent + ?, lease_until = ? WHERE id = ?",
+            (cursor, sent, time.time() + self.lease_seconds, broadcast_id)
+        )
+
+    def release(self, broadcast_id):
+        """Give up the lease, so another process can carry on right away."""
+        self._conn().execute("UPDATE broadcasts SET lease_until = NULL WHERE id = ?", (broadcast_id,))
+
+    def finish(self, broadcast_id, status, reason=None):
+        self._conn().execute(
+            "UPDATE broadcasts SET status = ?, reason = ?, lease_until = NULL, finished_at = ? WHERE id = ?",
+            (status, reason, time.time(), broadcast_id)
+        )
+
+
+class Broadcaster:
+    """Thread sending running broadcasts in batches.
+
+    prepare(work_id) returns (text, skip) for a work that should still be
+    announced - the message and the numbers not to send it to (those already
+    selected) - or a reason string when the broadcast should stop, such as
+    "full". send(number, text, work_id) queues one message.
+    """
+
+    def __init__(self, roster, prepare, send, batch_size=100, interval=2.0, poll_interval=5.0):
+        self.roster = roster
+        self.prepare = prepare
+        self.send = send
+        self.batch_size = batch_size
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='broadcaster', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def notify(self):
+        """Look for running broadcasts now, e.g. after one was created."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                broadcast = self.roster.claim_broadcast()
+                if broadcast is not None:
+                    self.run_broadcast(broadcast)
+                    continue
+            except Exception as e:
+                logger.error(f"Error running broadcast: {str(e)}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def run_broadcast(self, broadcast):
+        """Send a claimed broadcast batch by batch until it is done, stopped or this thread stops."""
+        tags = broadcast['tags'].split()
+        cursor, sent = broadcast['cursor'], broadcast['sent']
+        while not self._stopping.is_set():
+            prepared = self.prepare(broadcast['work_id'])
+            if isinstance(prepared, str):
+                self.roster.finish(broadcast['id'], STOPPED, prepared)
+                logger.info(f"Broadcast {broadcast['id']} stopped after {sent} messages: {prepared}")
+                return
+            text, skip = prepared
+            numbers = self.roster.segment(tags, cursor, self.batch_size)
+            if not numbers:
+                self.roster.finish(broadcast['id'], DONE)
+                logger.info(f"Broadcast {broadcast['id']} done, {sent} messages")
+                return
+            batch = 0
+            for number in numbers:
+                if number not in skip:
+                    self.send(number, text, broadcast['work_id'])
+                    batch += 1
+            cursor = numbers[-1]
+            sent += batch
+            self.roster.advance(broadcast['id'], cursor, batch)
+            # Give the workers just messaged a moment to fill the work
+            self._stopping.wait(self.interval)
+        self.roster.release(broadcast['id'])
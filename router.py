@@ -0,0 +1,170 @@
+"""Table-driven command routing for the /whatsapp webhook.
+
+Each inbound message is normalized and tokenized once into a Message. Its
+handler is then found with a single dict lookup on (role, keyword, has
+arguments), instead of walking an if/elif chain. Multi-step conversations
+(such as interactive CREATE) are explicit state machines: a handler is
+registered for each (action, step) pair, is given the session the caller
+loaded to route the message, and moves it to the next step itself.
+
+The router times every handler it runs, so the per-command counters show
+which command is slow.
+"""
+import threading
+import time
+
+
+class Message:
+    """An inbound message, normalized and tokenized once."""
+
+    __slots__ = ('text', 'sender', 'keyword', 'args')
+
+    def __init__(self, text, sender):
+        self.text = text.strip()
+        self.sender = sender
+        parts = self.text.split(None, 1)
+        # First word in upper case, e.g. "SELECT" for "select abc123"
+        self.keyword = parts[0].upper() if parts else ''
+        # Everything after the first word, e.g. "abc123"
+        self.args = parts[1].strip() if len(parts) > 1 else ''
+
+
+class CommandStats:
+    """Handling-time counters for one command."""
+
+    __slots__ = ('count', 'errors', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_ms': round(self.total * 1000, 3),
+            'avg_ms': round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 3)
+        }
+
+
+class CommandRouter:
+    """Registry of command, conversation step and fallback handlers."""
+
+    def __init__(self, observe=None):
+        # Called with (name, seconds, failed) after every handler, e.g. to
+        # feed a metrics histogram
+        self.observe = observe
+        self._commands = {}  # (role, keyword, has_args) -> (name, handler, interrupts_flow)
+        self._steps = {}  # (action, step) -> handler
+        self._fallbacks = {}  # role -> handler
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def command(self, role, *keywords, args=False, interrupts_flow=False):
+        """Register a handler for messages starting with one of keywords.
+
+        args says whether the command takes arguments ("SELECT abc123") or
+        must be sent on its own ("LIST"). Commands with interrupts_flow are
+        handled even while the sender is in the middle of a conversation.
+        """
+        def register(handler):
+            name = f"{role}:{keywords[0]}{' ...' if args else ''}"
+            for keyword in keywords:
+                self._commands[(role, keyword.upper(), args)] = (name, handler, interrupts_flow)
+            return handler
+        return register
+
+    def step(self, action, step):
+        """Register the handler for one step of a multi-step conversation.
+
+        It is called as handler(message, session, ...), with the session
+        passed to dispatch(), so it need not load the session again.
+        """
+        def register(handler):
+            self._steps[(action, step)] = handler
+            return handler
+        return register
+
+    def fallback(self, role):
+        """Register the handler for messages no command matches."""
+        def register(handler):
+            self._fallbacks[role] = handler
+            return handler
+        return register
+
+    def route(self, role, message, session=None):
+        """Return (name, handler, is_step) for a message.
+
+        session is the sender's in-progress conversation ({'action', 'step',
+        ...}) or None. is_step says the handler is a conversation step.
+        """
+        entry = self._commands.get((role, message.keyword, bool(message.args)))
+        if session is not None and (entry is None or not entry[2]):
+            action, step = session['action'], session['step']
+            return f"{action}:{step}", self._steps[(action, step)], True
+        if entry is not None:
+            return entry[0], entry[1], False
+        return f"{role}:fallback", self._fallbacks[role], False
+
+    def dispatch(self, role, message, session, *args):
+        """Run the handler for a message and record how long it took."""
+        name, handler, is_step = self.route(role, message, session)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = handler(message, session, *args) if is_step else handler(message, *args)
+            failed = False
+            return result
+        finally:
+            self._record(name, time.perf_counter() - start, failed)
+
+    def _record(self, name, elapsed, failed):
+        if self.observe is not None:
+            self.observe(name, elapsed, failed)
+        with self._stats_lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = CommandStats()
+            stats.count += 1
+            stats.errors += failed
+            stats.total += elapsed
+            if elapsed > stats.max:
+                stats.max = elapsed
+
+    def stats(self):
+        """Return handling-time counters for every command that has run."""
+        with self._stats_lock:
+            return {name: stats.as_dict() for name, stats in sorted(self._stats.items())}
+
+
+# Twilio rejects WhatsApp message bodies longer than this
+MESSAGE_LIMIT = 1600
+
+
+def split_message(parts, limit=MESSAGE_LIMIT, separator="\n\n"):
+    """Join text parts into as few messages as possible, each at most limit characters.
+
+    Parts are only split when a single part is longer than limit on its own.
+    """
+    chunks = []
+    current = ''
+    for part in parts:
+        while len(part) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(part[:limit])
+            part = part[limit:]
+        if not current:
+            current = part
+        elif len(current) + len(separator) + len(part) <= limit:
+            current += separator + part
+        else:
+            chunks.append(current)
+            current = part
+    if current:
+        chunks.append(current)
+    return chunks
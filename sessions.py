@@ -0,0 +1,191 @@
+"""Conversation sessions shared by every worker process, with a time to live.
+
+Multi-step flows (the interactive CREATE and REMIND) keep their progress in
+a session between messages. Sessions live in SQLite, so the next message of
+a flow can be handled by any gunicorn worker process. Each session expires
+ttl seconds after it was last written: an expired session is dropped when it
+is next read, and a sweeper thread deletes the ones nobody reads again.
+
+Sessions are grouped in namespaces (admin flows, LIST cursors, and later
+worker conversations); namespace(name) returns a dict-like view of one.
+Values are stored as JSON.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+"""
+
+
+class SessionStore:
+    """SQLite-backed sessions with a per-session time to live."""
+
+    def __init__(self, db_file, ttl=1800, sweep_interval=60):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        # Sessions this process found expired and deleted
+        self.evictions = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def namespace(self, name, ttl=None):
+        return SessionNamespace(self, name, ttl)
+
+    def load(self, namespace, key):
+        """Return a session's value, or None if there is none or it expired."""
+        row = self._conn().execute(
+            "SELECT data, expires_at FROM sessions WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            # Only delete it if nobody wrote it again in the meantime
+            deleted = self._conn().execute(
+                "DELETE FROM sessions WHERE namespace = ? AND key = ? AND expires_at = ?", (namespace, key, row[1])
+            ).rowcount
+            self._evicted(deleted)
+            return None
+        return json.loads(row[0])
+
+    def save(self, namespace, key, value, ttl=None):
+        """Store a session's value, expiring ttl seconds from now (default the store's ttl)."""
+        self._conn().execute(
+            "INSERT INTO sessions (namespace, key, data, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (namespace, key, json.dumps(value), time.time() + (self.ttl if ttl is None else ttl))
+        )
+
+    def delete(self, namespace, key):
+        """Remove a session. Returns False if there was none."""
+        return self._conn().execute(
+            "DELETE FROM sessions WHERE namespace = ? AND key = ?", (namespace, key)
+        ).rowcount > 0
+
+    def clear(self, namespace):
+        self._conn().execute("DELETE FROM sessions WHERE namespace = ?", (namespace,))
+
+    def counts(self):
+        """Return {namespace: live sessions}."""
+        return {
+            row[0]: row[1] for row in self._conn().execute(
+                "SELECT namespace, COUNT(*) FROM sessions WHERE expires_at >= ? GROUP BY namespace", (time.time(),)
+            )
+        }
+
+    def count(self, namespace):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM sessions WHERE namespace = ? AND expires_at >= ?", (namespace, time.time())
+        ).fetchone()[0]
+
+    def evict_expired(self):
+        """Delete every expired session and return how many there were."""
+        deleted = self._conn().execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),)).rowcount
+        self._evicted(deleted)
+        return deleted
+
+    def _evicted(self, count):
+        if count:
+            with self._lock:
+                self.evictions += count
+
+    def start(self):
+        """Start the sweeper thread."""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='session-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _run(self):
+        while not self._stopping.wait(self.sweep_interval):
+            try:
+                deleted = self.evict_expired()
+                if deleted:
+                    logger.info(f"Expired {deleted} abandoned sessions")
+            except Exception as e:
+                logger.error(f"Error expiring sessions: {str(e)}")
+
+
+class SessionNamespace:
+    """Dict-like view of one namespace of a SessionStore.
+
+    Values are copies: change a session by assigning it back, e.g.
+    session = sessions[key]; session['step'] = 'time'; sessions[key] = session.
+    """
+
+    def __init__(self, store, name, ttl=None):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        value = self.store.load(self.name, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.store.load(self.name, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.save(self.name, key, value, self.ttl)
+
+    def __delitem__(self, key):
+        if not self.store.delete(self.name, key):
+            raise KeyError(key)
+
+    def pop(self, key, default=None):
+        value = self.get(key)
+        if value is None:
+            return default
+        self.store.delete(self.name, key)
+        return value
+
+    def __contains__(self, key):
+        return self.store.load(self.name, key) is not None
+
+    def __len__(self):
+        return self.store.count(self.name)
+
+    def clear(self):
+        self.store.clear(self.name)
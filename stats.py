@@ -0,0 +1,318 @@
+"""Staffing analytics kept up to date on every change.
+
+Every claim is recorded with its time, and the counters behind the numbers
+the admin asks about are updated in the same transaction: claims and
+required workers (the fill rate), works filled, and the sums behind the
+average time to the first claim and the average time until a work is full.
+They are kept per work, per week the work was posted, for all time, and per
+worker, so reading any of them is a primary key lookup rather than a scan of
+the history.
+
+Everything is kept in SQLite, shared by all worker processes. A work's
+numbers are taken out of the totals again when it is deleted, but not when it
+is archived: archived works still count. After a restore, rebuild() recounts
+the restored works.
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Period holding the all-time totals; the others are ISO weeks such as 2025-W23
+ALL_TIME = 'all'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS works (
+    work_id TEXT PRIMARY KEY,
+    week TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    required_workers INTEGER NOT NULL,
+    claims INTEGER NOT NULL DEFAULT 0,
+    first_claim_at REAL,
+    full_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS claims (
+    work_id TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    claimed_at REAL,
+    PRIMARY KEY (work_id, worker)
+);
+
+CREATE TABLE IF NOT EXISTS periods (
+    period TEXT PRIMARY KEY,
+    works INTEGER NOT NULL DEFAULT 0,
+    required_workers INTEGER NOT NULL DEFAULT 0,
+    claims INTEGER NOT NULL DEFAULT 0,
+    filled INTEGER NOT NULL DEFAULT 0,
+    first_claim_seconds REAL NOT NULL DEFAULT 0,
+    first_claims_timed INTEGER NOT NULL DEFAULT 0,
+    full_seconds REAL NOT NULL DEFAULT 0,
+    fills_timed INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    claims INTEGER NOT NULL,
+    last_claim_at REAL
+);
+CREATE INDEX IF NOT EXISTS workers_claims ON workers (claims DESC, worker);
+"""
+
+# Adds to the counters of a work's week and of all time
+ADD_TO_PERIODS_SQL = (
+    "UPDATE periods SET works = works + ?, required_workers = required_workers + ?, claims = claims + ?, "
+    "filled = filled + ?, first_claim_seconds = first_claim_seconds + ?, first_claims_timed = first_claims_timed + ?, "
+    "full_seconds = full_seconds + ?, fills_timed = fills_timed + ? WHERE period IN (?, ?)"
+)
+
+
+def week_of(timestamp):
+    year, week, _ = datetime.fromtimestamp(timestamp).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _ratio(part, whole):
+    return round(part / whole, 3) if whole else None
+
+
+class StaffingStats:
+    """Claim times and fill counters per work, per week, in total and per worker."""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _transaction(self, body):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = body(conn)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def record_created(self, work_id, required_workers, now=None):
+        """Start counting a new work."""
+        now = now or time.time()
+
+        def add(conn):
+            if conn.execute("SELECT 1 FROM works WHERE work_id = ?", (work_id,)).fetchone() is None:
+                self._add_work(conn, work_id, required_workers, now)
+        self._transaction(add)
+
+    def _add_work(self, conn, work_id, required_workers, created_at, workers=(), claimed_at=None):
+        """Insert a work with its claims (claimed_at None when their times are unknown) and count it."""
+        week = week_of(created_at)
+        claims = len(workers)
+        full = claims >= required_workers
+        conn.execute(
+            "INSERT INTO works (work_id, week, created_at, required_workers, claims, first_claim_at, full_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (work_id, week, created_at, required_workers, claims,
+             claimed_at if claims else None, claimed_at if full else None)
+        )
+        conn.executemany("INSERT OR IGNORE INTO periods (period) VALUES (?)", [(ALL_TIME,), (week,)])
+        conn.execute(ADD_TO_PERIODS_SQL, (1, required_workers, claims, int(full), 0, 0, 0, 0, ALL_TIME, week))
+        for worker in workers:
+            conn.execute("INSERT INTO claims (work_id, worker, claimed_at) VALUES (?, ?, ?)", (work_id, worker, claimed_at))
+            self._count_worker(conn, worker, claimed_at)
+
+    def record_claim(self, work_id, worker, now=None):
+        """Count a worker's claim on a work. Counting the same claim twice has no effect."""
+        now = now or time.time()
+        self._transaction(lambda conn: self._record_claim(conn, work_id, worker, now))
+
+    def _record_claim(self, conn, work_id, worker, now):
+        work = conn.execute("SELECT * FROM works WHERE work_id = ?", (work_id,)).fetchone()
+        if work is None:
+            return
+        if conn.execute(
+            "INSERT OR IGNORE INTO claims (work_id, worker, claimed_at) VALUES (?, ?, ?)", (work_id, worker, now)
+        ).rowcount == 0:
+            return
+        first = work['claims'] == 0
+        became_full = work['claims'] + 1 >= work['required_workers'] and work['full_at'] is None
+        conn.execute(
+            "UPDATE works SET claims = claims + 1, first_claim_at = CASE WHEN ? THEN ? ELSE first_claim_at END, "
+            "full_at = CASE WHEN ? THEN ? ELSE full_at END WHERE work_id = ?",
+            (first, now, became_full, now, work_id)
+        )
+        since_created = now - work['created_at']
+        conn.execute(ADD_TO_PERIODS_SQL, (
+            0, 0, 1, int(became_full),
+            since_created if first else 0, int(first),
+            since_created if became_full else 0, int(became_full),
+            ALL_TIME, work['week']
+        ))
+        self._count_worker(conn, worker, now)
+
+    def _count_worker(self, conn, worker, claimed_at):
+        conn.execute(
+            "INSERT INTO workers (worker, claims, last_claim_at) VALUES (?, 1, ?) "
+            "ON CONFLICT (worker) DO UPDATE SET claims = claims + 1, "
+            "last_claim_at = COALESCE(MAX(last_claim_at, excluded.last_claim_at), last_claim_at, excluded.last_claim_at)",
+            (worker, claimed_at)
+        )
+
+    def record_deleted(self, work_id):
+        """Take a deleted work and its claims out of every counter."""
+        self._transaction(lambda conn: self._remove_work(conn, work_id))
+
+    def _remove_work(self, conn, work_id):
+        work = conn.execute("SELECT * FROM works WHERE work_id = ?", (work_id,)).fetchone()
+        if work is None:
+            return
+        first_timed = work['first_claim_at'] is not None
+        full_timed = work['full_at'] is not None
+        # Backfilled works have claims and may be full without known times
+        full = work['claims'] >= work['required_workers']
+        conn.execute(ADD_TO_PERIODS_SQL, (
+            -1, -work['required_workers'], -work['claims'], -int(full),
+            -(work['first_claim_at'] - work['created_at']) if first_timed else 0, -int(first_timed),
+            -(work['full_at'] - work['created_at']) if full_timed else 0, -int(full_timed),
+            ALL_TIME, work['week']
+        ))
+        conn.execute(
+            "UPDATE workers SET claims = claims - 1 WHERE worker IN (SELECT worker FROM claims WHERE work_id = ?)",
+            (work_id,)
+        )
+        conn.execute("DELETE FROM workers WHERE claims <= 0")
+        conn.execute("DELETE FROM claims WHERE work_id = ?", (work_id,))
+        conn.execute("DELETE FROM works WHERE work_id = ?", (work_id,))
+
+    def backfill(self, works):
+        """Count (work_id, work) pairs in the data file format that are not counted yet.
+
+        Their claims were made before claims were timed, so they count
+        towards fill rates and claims per worker but not towards the average
+        times. Returns the number of works added.
+        """
+        def add(conn):
+            added = 0
+            for work_id, work in works:
+                if conn.execute("SELECT 1 FROM works WHERE work_id = ?", (work_id,)).fetchone() is not None:
+                    continue
+                self._backfill_work(conn, work_id, work)
+                added += 1
+            return added
+        return self._transaction(add)
+
+    def _backfill_work(self, conn, work_id, work):
+        try:
+            created_at = datetime.strptime(work['created_at'], "%Y-%m-%d %H:%M:%S").timestamp()
+        except (KeyError, TypeError, ValueError):
+            created_at = time.time()
+        self._add_work(conn, work_id, work['required_workers'], created_at, list(dict.fromkeys(work['selected_workers'])))
+
+    def rebuild(self, works, archived=None):
+        """Recount after the stored works were replaced wholesale, e.g. by a restore.
+
+        Afterwards exactly the (work_id, work) pairs in works are counted,
+        plus the counted works archived(work_ids) reports as archived, since
+        archived works still count. A work whose required workers and
+        workers did not change keeps its claim times; the others are counted
+        again as backfill() counts them. Returns (added, removed).
+        """
+        works = dict(works)
+
+        def recount(conn):
+            added = removed = 0
+            counted = {row['work_id']: row['required_workers']
+                       for row in conn.execute("SELECT work_id, required_workers FROM works")}
+            gone = [work_id for work_id in counted if work_id not in works]
+            kept = archived(gone) if archived is not None and gone else set()
+            for work_id in gone:
+                if work_id not in kept:
+                    self._remove_work(conn, work_id)
+                    removed += 1
+            for work_id, work in works.items():
+                if work_id in counted:
+                    claims = {row[0] for row in conn.execute("SELECT worker FROM claims WHERE work_id = ?", (work_id,))}
+                    if claims == set(work['selected_workers']) and counted[work_id] == work['required_workers']:
+                        continue
+                    self._remove_work(conn, work_id)
+                    removed += 1
+                self._backfill_work(conn, work_id, work)
+                added += 1
+            return added, removed
+        return self._transaction(recount)
+
+    def is_empty(self):
+        return self._conn().execute("SELECT 1 FROM works LIMIT 1").fetchone() is None
+
+    def summary(self, period=ALL_TIME):
+        """Return the counters of one period (ALL_TIME or a week such as 2025-W23), or None."""
+        row = self._conn().execute("SELECT * FROM periods WHERE period = ?", (period,)).fetchone()
+        return self._period(row) if row is not None else None
+
+    def weeks(self, limit=8):
+        """Return the counters of the latest weeks, latest first."""
+        rows = self._conn().execute(
+            "SELECT * FROM periods WHERE period != ? ORDER BY period DESC LIMIT ?", (ALL_TIME, limit)
+        )
+        return [self._period(row) for row in rows]
+
+    @staticmethod
+    def _period(row):
+        return {
+            'period': row['period'],
+            'works': row['works'],
+            'required_workers': row['required_workers'],
+            'claims': row['claims'],
+            'filled': row['filled'],
+            'fill_rate': _ratio(row['claims'], row['required_workers']),
+            'filled_rate': _ratio(row['filled'], row['works']),
+            'avg_time_to_first_claim': _ratio(row['first_claim_seconds'], row['first_claims_timed']),
+            'avg_time_to_full': _ratio(row['full_seconds'], row['fills_timed'])
+        }
+
+    def work(self, work_id):
+        """Return one work's counters, or None if it is not counted."""
+        row = self._conn().execute("SELECT * FROM works WHERE work_id = ?", (work_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'work_id': row['work_id'],
+            'week': row['week'],
+            'required_workers': row['required_workers'],
+            'claims': row['claims'],
+            'fill_rate': _ratio(row['claims'], row['required_workers']),
+            'time_to_first_claim': row['first_claim_at'] - row['created_at'] if row['first_claim_at'] else None,
+            'time_to_full': row['full_at'] - row['created_at'] if row['full_at'] else None
+        }
+
+    def claims(self, work_id):
+        """Return (worker, claimed_at) for a work's claims in claim order; claimed_at is None if unknown."""
+        return [tuple(row) for row in self._conn().execute(
+            "SELECT worker, claimed_at FROM claims WHERE work_id = ? ORDER BY claimed_at, rowid", (work_id,)
+        )]
+
+    def top_workers(self, limit=10):
+        """Return (worker, claims) for the workers with the most claims."""
+        return [tuple(row) for row in self._conn().execute(
+            "SELECT worker, claims FROM workers ORDER BY claims DESC, worker LIMIT ?", (limit,)
+        )]
+
+    def worker_claims(self, worker):
+        row = self._conn().execute("SELECT claims FROM workers WHERE worker = ?", (worker,)).fetchone()
+        return row[0] if row else 0
@@ -0,0 +1,1182 @@
+"""Storage engines for work opportunities, worker selections and reminders.
+
+The bot talks to storage only through the Storage interface below, so request
+handlers read and change a few records instead of the whole dataset. Two
+engines are available:
+
+- JSONStorage keeps everything in memory and persists it to the JSON data
+  file plus its change journal (the original behavior).
+- SQLiteStorage keeps everything in an indexed SQLite database in WAL mode.
+
+Existing catering_data.json files are imported into a new SQLite database
+automatically, or explicitly with:
+
+    python storage.py migrate catering_data.json catering_data.db
+"""
+import bisect
+import gc
+import heapq
+import itertools
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import uuid
+from datetime import datetime
+
+from journal import Journal
+from reminders import TIME_FORMAT
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of Storage.claim_slot()
+CLAIMED = 'claimed'
+ALREADY_SELECTED = 'already_selected'
+FULL = 'full'
+NOT_FOUND = 'not_found'
+
+# Work statuses used to filter pages of works. A work is past once its
+# event_at has gone by, otherwise full or open depending on its selections
+OPEN = 'open'
+PAST = 'past'
+WORK_STATUSES = (OPEN, FULL, PAST)
+
+# Columns stored directly on the works table; any other work field is kept
+# in the JSON "extra" column so nothing is lost on migration
+WORK_COLUMNS = ('title', 'location', 'time', 'required_workers', 'payment', 'created_at')
+
+# Snapshot formats of the JSON engine: "json" is the readable data file,
+# "pickle" a compact binary snapshot that loads faster on large histories
+SNAPSHOT_FORMATS = ('json', 'pickle')
+
+# Pinned so a snapshot can be read by every Python version the app runs on
+# (protocol 4 is read by 3.4 and later)
+PICKLE_PROTOCOL = 4
+
+
+class Storage:
+    """Interface shared by the storage engines.
+
+    Works are returned as plain dicts with the same shape as the JSON data
+    file: the work fields plus "selected_workers" in join order and, when
+    present, "reminders" and "scheduled_reminders". Returned dicts must be
+    treated as read-only; all changes go through the methods below.
+    """
+
+    name = None
+    # Bytes the engine has written to disk, or None if it does not track them
+    bytes_written = None
+    # Changes whenever state_version() starts counting from scratch, so a
+    # version is only comparable with versions of the same epoch
+    state_epoch = None
+
+    def load(self):
+        """Load persisted state. Called once at startup."""
+        raise NotImplementedError
+
+    def save(self):
+        """Persist everything that has not been persisted yet."""
+        raise NotImplementedError
+
+    def close(self):
+        """Flush and release resources."""
+        raise NotImplementedError
+
+    def get_work(self, work_id):
+        """Return one work, or None if it does not exist."""
+        raise NotImplementedError
+
+    def list_works(self):
+        """Return (work_id, work) pairs ordered by creation time."""
+        raise NotImplementedError
+
+    def count_works(self):
+        raise NotImplementedError
+
+    def page_works(self, status=None, after=None, offset=0, limit=10, now=None):
+        """Return one page of works in creation order.
+
+        Returns (works, cursor): works is a list of up to limit (work_id,
+        work) pairs whose status (see work_status) is status, or any status
+        when it is None, skipping the first offset matches. The page starts
+        after the cursor returned with the previous page; cursor is None
+        when there are no more works. now is the event_at string past works
+        are compared with (default the current time).
+
+        Each status has its own index in creation order, so a page costs the
+        same however long the history. Works move to the past index the
+        first time a now after their event is used; they are not moved back
+        for an earlier now, which only narrows the PAST page.
+        """
+        raise NotImplementedError
+
+    def worker_works(self, worker):
+        """Return (work_id, work) for every work a worker is selected for, in creation order."""
+        raise NotImplementedError
+
+    def open_works(self, now=None):
+        """Return (work_id, work) for every OPEN work, in creation order, then by work ID.
+
+        Served from an index of open works, so the cost follows the number of
+        open works rather than the whole history. A work leaves the index for
+        good once it is full or its event_at is before now (an event_at
+        string, default the current time).
+        """
+        raise NotImplementedError
+
+    def open_work_versions(self, now=None):
+        """Return (work_id, work_version) for every OPEN work, in the order of open_works.
+
+        Like open_works but without building the works: one cheap read that
+        identifies everything derived from the open works, e.g. as a cache key.
+        """
+        raise NotImplementedError
+
+    def work_version(self, work_id):
+        """Return a counter that changes whenever a work changes, or None if it does not exist.
+
+        Used as part of cache keys, so anything derived from a work can be
+        cached until the work changes. Delivery statuses (update_delivery)
+        are not shown by anything cached, so they do not count as changes.
+        """
+        raise NotImplementedError
+
+    def state_version(self):
+        """Return a counter that increases with every change to any work or to the current work ID.
+
+        Together with state_epoch it identifies a state of the whole dataset,
+        for ETags and for clients waiting for the next change. Like
+        work_version, it ignores delivery statuses.
+        """
+        raise NotImplementedError
+
+    def create_work(self, work_id, work):
+        """Store a new work and make it the current work."""
+        raise NotImplementedError
+
+    def delete_work(self, work_id):
+        """Remove a work. Returns False if it did not exist."""
+        raise NotImplementedError
+
+    def get_current_work_id(self):
+        raise NotImplementedError
+
+    def set_current_work_id(self, work_id):
+        raise NotImplementedError
+
+    def claim_slot(self, work_id, worker):
+        """Atomically give a worker one of a work's open slots.
+
+        Returns (outcome, position): outcome is CLAIMED, ALREADY_SELECTED,
+        FULL or NOT_FOUND, and position is the worker's 1-based place among
+        the selected workers (None when they hold no slot). The capacity check
+        and the insert happen as one step, so concurrent claims can never
+        overfill a work or select the same worker twice.
+        """
+        raise NotImplementedError
+
+    def add_reminder(self, work_id, reminder):
+        """Record a reminder that was sent for a work."""
+        raise NotImplementedError
+
+    def add_scheduled_reminder(self, work_id, reminder):
+        """Record a reminder that was scheduled for a work."""
+        raise NotImplementedError
+
+    def update_delivery(self, work_id, reminder_id, worker, status):
+        """Record the delivery status of one reminder message to one worker."""
+        raise NotImplementedError
+
+    def pending_reminders(self):
+        """Return (work_id, reminder) for every scheduled reminder not yet sent."""
+        raise NotImplementedError
+
+    def set_reminder_status(self, work_id, reminder_id, status):
+        """Change the status of a scheduled reminder."""
+        raise NotImplementedError
+
+    def restore(self, data):
+        """Atomically replace all state with data in the JSON data file format.
+
+        Readers see either the old state or the restored one, never a mix,
+        and every restored work gets a new version.
+        """
+        raise NotImplementedError
+
+    def export(self):
+        """Return all state in the JSON data file format."""
+        return {
+            'work_opportunities': dict(self.list_works()),
+            'current_work_id': self.get_current_work_id()
+        }
+
+
+def work_status(work, now):
+    """Return OPEN, FULL or PAST for a work, given now as an event_at string."""
+    if work.get("event_at") and work["event_at"] < now:
+        return PAST
+    if len(work["selected_workers"]) >= work["required_workers"]:
+        return FULL
+    return OPEN
+
+
+def _now():
+    return datetime.now().strftime(TIME_FORMAT)
+
+
+def _order_key(work_id, work):
+    """Position of a work in creation order; also the page cursor."""
+    return (work.get("created_at") or '', work_id)
+
+
+def _remove_sorted(keys, key):
+    index = bisect.bisect_left(keys, key)
+    if index < len(keys) and keys[index] == key:
+        del keys[index]
+
+
+class JSONStorage(Storage):
+    """In-memory storage persisted to the JSON data file and its journal.
+
+    With snapshot_format "pickle", snapshots go to a binary .snapshot file
+    next to the data file instead. Whichever of the two files was written
+    last is loaded, so switching formats in either direction keeps the data.
+    """
+
+    name = 'json'
+
+    def __init__(self, data_file, fsync='batch', flush_interval=0.05, compact_every=500, snapshot_format='json',
+                 on_write=None):
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unknown snapshot format: {snapshot_format}")
+        self.data_file = data_file
+        self.snapshot_format = snapshot_format
+        self.snapshot_file = os.path.splitext(data_file)[0] + '.snapshot'
+        # Work ID -> work. A changed work is replaced by an updated copy,
+        # never changed in place, so snapshots and exports can copy this dict
+        # under the lock and serialize the copy outside it
+        self.works = {}
+        self.current_work_id = None
+        # Work ID -> version, bumped by every change applied to the work
+        self.versions = {}
+        self._version_seq = itertools.count(1)
+        # Versions restart with every process, so each process has its own epoch
+        self.state_epoch = uuid.uuid4().hex[:8]
+        self._state_version = 0
+        # (created_at, work_id) of every work, kept sorted for paging
+        self._order = []
+        # Work ID -> {worker: position} in join order, for O(1) membership
+        # checks; "selected_workers" stays a list so the data file format
+        # does not change
+        self._positions = {}
+        # Worker -> {work_id: None}, the works each worker is selected for
+        self._worker_works = {}
+        # Order keys of the works of each status, kept sorted for paging,
+        # and each work's status. Works only become past when _advance()
+        # reaches their event_at, via (event_at, order key) in _upcoming
+        self._by_status = {status: [] for status in WORK_STATUSES}
+        self._status = {}
+        self._upcoming = []
+        self._past_before = ''
+        # Held while changing data and journaling the change, so snapshots
+        # always match the journal position they are taken at
+        self._lock = threading.RLock()
+        # Per-work locks for claims, so a rush on one work never waits on
+        # claims for another
+        self._claim_locks = {}
+        self._process_lock = None
+        self.journal = Journal(
+            os.path.splitext(data_file)[0] + '.journal',
+            self.snapshot_file if self.snapshot_format == 'pickle' else data_file,
+            snapshot=self._snapshot,
+            fsync=fsync,
+            flush_interval=flush_interval,
+            compact_every=compact_every,
+            on_write=on_write
+        )
+
+    def load(self):
+        """Load the data file snapshot and replay the journal written after it."""
+        self._lock_data_file()
+        # Loading allocates a container per work field, which would otherwise
+        # set off many pointless garbage collection passes
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._load()
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _load(self):
+        snapshot_seq = 0
+        with self._lock:
+            path = self._latest_snapshot()
+            if path is not None:
+                try:
+                    if path == self.snapshot_file:
+                        with open(path, 'rb') as f:
+                            data = pickle.load(f)
+                    else:
+                        with open(path, 'r') as f:
+                            data = json.load(f)
+                    self.works = data.get('work_opportunities', {})
+                    self.current_work_id = data.get('current_work_id', None)
+                    snapshot_seq = data.get('journal_seq', 0)
+                    logger.info(f"Data loaded from {path}.")
+                except Exception as e:
+                    logger.error(f"Error loading data: {str(e)}")
+            else:
+                logger.info("No data file found. Starting fresh.")
+            self._reindex()
+
+            try:
+                records = self.journal.replay(snapshot_seq)
+                for record in records:
+                    self._apply(record)
+                if records:
+                    logger.info(f"Replayed {len(records)} journal records.")
+            except Exception as e:
+                logger.error(f"Error replaying journal: {str(e)}")
+
+    @property
+    def bytes_written(self):
+        return self.journal.bytes_written
+
+    def _latest_snapshot(self):
+        """Return the data file or the binary snapshot, whichever was written last, or None."""
+        paths = [path for path in (self.data_file, self.snapshot_file) if os.path.exists(path)]
+        if not paths:
+            return None
+        return max(paths, key=os.path.getmtime)
+
+    def save(self):
+        """Write a full snapshot of the data file and compact the journal."""
+        self.journal.compact()
+
+    def close(self):
+        self.journal.close()
+        if self._process_lock is not None:
+            self._process_lock.close()
+            self._process_lock = None
+
+    def _lock_data_file(self):
+        """Warn when another process already serves the same data file.
+
+        Each process keeps its own in-memory copy, so the JSON engine is only
+        safe with a single process; several gunicorn workers need the SQLite
+        engine.
+        """
+        if fcntl is None or self._process_lock is not None:
+            return
+        self._process_lock = open(f"{self.data_file}.lock", 'a')
+        try:
+            fcntl.flock(self._process_lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            logger.warning(f"Another process is using {self.data_file}. "
+                           "Use STORAGE_BACKEND=sqlite when running more than one worker process.")
+
+    def get_work(self, work_id):
+        return self.works.get(work_id)
+
+    def list_works(self):
+        with self._lock:
+            return list(self.works.items())
+
+    def count_works(self):
+        return len(self.works)
+
+    def page_works(self, status=None, after=None, offset=0, limit=10, now=None):
+        now = now or _now()
+        with self._lock:
+            self._advance(now)
+            keys = self._order if status is None else self._by_status[status]
+            if status == PAST and now < self._past_before:
+                # An earlier now than already seen: the works that were
+                # past by then (the archive's cutoff)
+                keys = [key for key in keys if self.works[key[1]]["event_at"] < now]
+            start = (bisect.bisect_right(keys, tuple(after)) if after else 0) + offset
+            page = keys[start:start + limit + 1]
+            works = [(key[1], self.works[key[1]]) for key in page[:limit]]
+        return works, (page[limit - 1] if len(page) > limit else None)
+
+    def worker_works(self, worker):
+        with self._lock:
+            work_ids = list(self._worker_works.get(worker, ()))
+            return sorted(((work_id, self.works[work_id]) for work_id in work_ids),
+                          key=lambda item: _order_key(*item))
+
+    def open_works(self, now=None):
+        with self._lock:
+            self._advance(now or _now())
+            return [(key[1], self.works[key[1]]) for key in self._by_status[OPEN]]
+
+    def open_work_versions(self, now=None):
+        with self._lock:
+            self._advance(now or _now())
+            return [(key[1], self.versions.get(key[1], 0)) for key in self._by_status[OPEN]]
+
+    def work_version(self, work_id):
+        if work_id not in self.works:
+            return None
+        return self.versions.get(work_id, 0)
+
+    def state_version(self):
+        return self._state_version
+
+    def create_work(self, work_id, work):
+        self._record('create', work_id=work_id, work=work)
+
+    def delete_work(self, work_id):
+        with self._claim_lock(work_id), self._lock:
+            if work_id not in self.works:
+                return False
+            self._record('delete', work_id=work_id)
+            self._claim_locks.pop(work_id, None)
+        return True
+
+    def get_current_work_id(self):
+        return self.current_work_id
+
+    def set_current_work_id(self, work_id):
+        self._record('select', work_id=work_id)
+
+    def claim_slot(self, work_id, worker):
+        with self._claim_lock(work_id):
+            work = self.works.get(work_id)
+            if work is None:
+                return NOT_FOUND, None
+            positions = self._positions[work_id]
+            if worker in positions:
+                return ALREADY_SELECTED, positions[worker]
+            if len(positions) >= work["required_workers"]:
+                return FULL, None
+            self._record('claim', work_id=work_id, worker=worker)
+            return CLAIMED, positions[worker]
+
+    def _claim_lock(self, work_id):
+        with self._lock:
+            lock = self._claim_locks.get(work_id)
+            if lock is None:
+                lock = self._claim_locks[work_id] = threading.Lock()
+            return lock
+
+    def add_reminder(self, work_id, reminder):
+        self._record('reminder', work_id=work_id, reminder=reminder)
+
+    def add_scheduled_reminder(self, work_id, reminder):
+        self._record('schedule_reminder', work_id=work_id, reminder=reminder)
+
+    def update_delivery(self, work_id, reminder_id, worker, status):
+        self._record('delivery', work_id=work_id, reminder_id=reminder_id, worker=worker, status=status)
+
+    def pending_reminders(self):
+        with self._lock:
+            return [
+                (work_id, reminder)
+                for work_id, work in self.works.items()
+                for reminder in work.get("scheduled_reminders", [])
+                if reminder.get("status") == 'scheduled'
+            ]
+
+    def set_reminder_status(self, work_id, reminder_id, status):
+        self._record('reminder_status', work_id=work_id, reminder_id=reminder_id, status=status)
+
+    def restore(self, data):
+        data = json.loads(json.dumps(data))
+        with self._lock:
+            self._record('restore', data=data)
+        # The restore record holds the whole dataset, so snapshot right away
+        # instead of leaving it in the journal
+        self.journal.compact()
+
+    def export(self):
+        with self._lock:
+            data = {
+                'work_opportunities': dict(self.works),
+                'current_work_id': self.current_work_id
+            }
+        return json.loads(json.dumps(data))
+
+    def _snapshot(self):
+        """Serialize the data together with the journal position it covers."""
+        # Only the copy is taken under the lock, so writers carry on while
+        # it is serialized
+        with self._lock:
+            seq = self.journal.last_seq
+            data = {
+                'work_opportunities': dict(self.works),
+                'current_work_id': self.current_work_id,
+                'journal_seq': seq
+            }
+        if self.snapshot_format == 'pickle':
+            text = pickle.dumps(data, protocol=PICKLE_PROTOCOL)
+        else:
+            text = json.dumps(data)
+        return text, seq
+
+    def _record(self, op, **fields):
+        """Apply a change to the in-memory data and append it to the journal."""
+        with self._lock:
+            self._apply({'op': op, **fields})
+            self.journal.append(op, **fields)
+
+    def _apply(self, record):
+        """Apply one journal record to the in-memory data."""
+        op = record['op']
+        work_id = record.get('work_id')
+        if op == 'create':
+            if work_id in self.works:
+                self._unindex(work_id)
+            self.works[work_id] = record['work']
+            self.current_work_id = work_id
+            self._index(work_id, record['work'])
+        elif op == 'select':
+            self.current_work_id = work_id
+        elif op == 'delete':
+            if work_id in self.works:
+                self._unindex(work_id)
+            self.works.pop(work_id, None)
+            if self.current_work_id == work_id:
+                self.current_work_id = None
+        elif op == 'claim':
+            work = self.works.get(work_id)
+            positions = self._positions.get(work_id)
+            if work is not None and record['worker'] not in positions:
+                work = self.works[work_id] = dict(work, selected_workers=work["selected_workers"] + [record['worker']])
+                positions[record['worker']] = len(work["selected_workers"])
+                self._worker_works.setdefault(record['worker'], {})[work_id] = None
+                if len(positions) >= work["required_workers"] and self._status[work_id] == OPEN:
+                    self._move(work_id, FULL)
+        elif op == 'reminder':
+            work = self.works.get(work_id)
+            if work is not None:
+                self.works[work_id] = dict(work, reminders=work.get("reminders", []) + [record['reminder']])
+        elif op == 'schedule_reminder':
+            work = self.works.get(work_id)
+            if work is not None:
+                self.works[work_id] = dict(
+                    work, scheduled_reminders=work.get("scheduled_reminders", []) + [record['reminder']]
+                )
+        elif op == 'reminder_status':
+            work = self.works.get(work_id)
+            if work is not None:
+                self.works[work_id] = dict(work, scheduled_reminders=[
+                    dict(reminder, status=record['status']) if reminder.get("id") == record['reminder_id'] else reminder
+                    for reminder in work.get("scheduled_reminders", [])
+                ])
+        elif op == 'delivery':
+            work = self.works.get(work_id)
+            if work is not None:
+                self.works[work_id] = dict(work, reminders=[
+                    dict(reminder, deliveries={**reminder.get("deliveries", {}), record['worker']: record['status']})
+                    if reminder.get("id") == record['reminder_id'] else reminder
+                    for reminder in work.get("reminders", [])
+                ])
+            # Nothing readers are shown depends on delivery statuses, so
+            # they leave the versions alone
+            return
+        elif op == 'restore':
+            self.works = record['data'].get('work_opportunities', {})
+            self.current_work_id = record['data'].get('current_work_id')
+            self._reindex()
+            self.versions = {work_id: next(self._version_seq) for work_id in self.works}
+            self._claim_locks = {}
+            self._state_version += 1
+            return
+        else:
+            logger.warning(f"Skipping unknown journal record: {op}")
+            return
+        self._state_version += 1
+        if op != 'select':
+            # Versions come from one process-wide sequence, so a work deleted
+            # and created again never reuses an old version
+            self.versions[work_id] = next(self._version_seq)
+        if op == 'delete':
+            self.versions.pop(work_id, None)
+
+    def _reindex(self):
+        """Rebuild the creation order, selection, worker and status indexes from the works."""
+        self._order = sorted(_order_key(work_id, work) for work_id, work in self.works.items())
+        self._positions = {}
+        self._worker_works = {}
+        self._by_status = {status: [] for status in WORK_STATUSES}
+        self._status = {}
+        self._upcoming = []
+        for work_id, work in self.works.items():
+            self._index_selections(work_id, work)
+            status = self._initial_status(work_id, work)
+            self._status[work_id] = status
+            self._by_status[status].append(_order_key(work_id, work))
+            if status != PAST and work.get("event_at"):
+                self._upcoming.append((work["event_at"], _order_key(work_id, work)))
+        for keys in self._by_status.values():
+            keys.sort()
+        heapq.heapify(self._upcoming)
+
+    def _index(self, work_id, work):
+        bisect.insort(self._order, _order_key(work_id, work))
+        self._index_selections(work_id, work)
+        status = self._status[work_id] = self._initial_status(work_id, work)
+        bisect.insort(self._by_status[status], _order_key(work_id, work))
+        if status != PAST and work.get("event_at"):
+            heapq.heappush(self._upcoming, (work["event_at"], _order_key(work_id, work)))
+
+    def _initial_status(self, work_id, work):
+        if work.get("event_at") and work["event_at"] < self._past_before:
+            return PAST
+        if len(self._positions[work_id]) >= work["required_workers"]:
+            return FULL
+        return OPEN
+
+    def _move(self, work_id, status):
+        """Move a work to another status index."""
+        key = _order_key(work_id, self.works[work_id])
+        _remove_sorted(self._by_status[self._status[work_id]], key)
+        bisect.insort(self._by_status[status], key)
+        self._status[work_id] = status
+
+    def _advance(self, now):
+        """Move the works whose event_at is before now to the past index."""
+        if now <= self._past_before:
+            return
+        self._past_before = now
+        upcoming = self._upcoming
+        while upcoming and upcoming[0][0] < now:
+            event_at, key = heapq.heappop(upcoming)
+            work = self.works.get(key[1])
+            # Skip entries of works deleted or replaced since
+            if (work is not None and self._status[key[1]] != PAST and work.get("event_at") == event_at
+                    and _order_key(key[1], work) == key):
+                self._move(key[1], PAST)
+
+    def _index_selections(self, work_id, work):
+        positions = self._positions[work_id] = {}
+        worker_works = self._worker_works
+        for worker in work["selected_workers"]:
+            if worker not in positions:
+                positions[worker] = len(positions) + 1
+                if worker in worker_works:
+                    worker_works[worker][work_id] = None
+                else:
+                    worker_works[worker] = {work_id: None}
+
+    def _unindex(self, work_id):
+        key = _order_key(work_id, self.works[work_id])
+        _remove_sorted(self._order, key)
+        status = self._status.pop(work_id, None)
+        if status is not None:
+            _remove_sorted(self._by_status[status], key)
+        for worker in self._positions.pop(work_id, {}):
+            works = self._worker_works.get(worker, {})
+            works.pop(work_id, None)
+            if not works:
+                self._worker_works.pop(worker, None)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS works (
+    work_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    location TEXT,
+    time TEXT,
+    required_workers INTEGER NOT NULL,
+    payment TEXT,
+    created_at TEXT,
+    extra TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'open',
+    event_at TEXT
+);
+CREATE INDEX IF NOT EXISTS works_created_at ON works (created_at);
+CREATE INDEX IF NOT EXISTS works_created_order ON works (created_at, work_id);
+
+CREATE TABLE IF NOT EXISTS selections (
+    work_id TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (work_id, worker)
+);
+CREATE INDEX IF NOT EXISTS selections_worker ON selections (worker);
+
+CREATE TABLE IF NOT EXISTS reminders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    work_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reminders_work_id ON reminders (work_id, kind);
+CREATE INDEX IF NOT EXISTS reminders_status ON reminders (kind, json_extract(data, '$.status'));
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Created after the migrations in SQLiteStorage.load(), as older databases
+# get the state and event_at columns there. works.state is the work's status
+# (open, full or past) and works.event_at a copy of the one in extra
+STATE_INDEXES = (
+    "DROP INDEX IF EXISTS works_open",
+    "CREATE INDEX IF NOT EXISTS works_state ON works (state, created_at, work_id, event_at)",
+    # The works still to become past, by when
+    "CREATE INDEX IF NOT EXISTS works_upcoming ON works (event_at) WHERE state != 'past'",
+)
+
+# state recomputed from the selections, after an import; works become past
+# again on the next read
+STATE_SQL = (
+    "UPDATE works SET state = CASE WHEN "
+    "(SELECT COUNT(*) FROM selections WHERE selections.work_id = works.work_id) >= required_workers "
+    "THEN 'full' ELSE 'open' END"
+)
+
+
+# Work versions are taken from the state version sequence, which every
+# change to a work also advances, so a work created again after a delete
+# gets a version it never had
+NEXT_VERSION_SQL = "(SELECT CAST(value AS INTEGER) + 1 FROM settings WHERE key = 'state_version')"
+
+
+def _page_sql(where):
+    # The page is picked from the index alone, OFFSET included, and only its
+    # rows are read from the table
+    return (
+        f"SELECT * FROM works WHERE work_id IN (SELECT work_id FROM works WHERE {where} "
+        "ORDER BY created_at, work_id LIMIT ? OFFSET ?) ORDER BY created_at, work_id"
+    )
+
+
+# Status pages are served by works_state, pages of every work by
+# works_created_order. The event_at bound only narrows the past works, for a
+# now earlier than the last one they were moved at
+_STATE = "state = ? AND (? IS NULL OR event_at < ?)"
+PAGE_SQL = _page_sql("1")
+PAGE_AFTER_SQL = _page_sql("(created_at, work_id) > (?, ?)")
+STATE_PAGE_SQL = _page_sql(_STATE)
+STATE_PAGE_AFTER_SQL = _page_sql(f"{_STATE} AND (created_at, work_id) > (?, ?)")
+
+
+class SQLiteStorage(Storage):
+    """Indexed SQLite storage in WAL mode, shared safely between processes.
+
+    Every statement is a fixed, parameterized SQL string, so sqlite3 keeps it
+    prepared in each connection's statement cache. Each thread gets its own
+    connection.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_file, import_from=None):
+        self.db_file = db_file
+        # JSON data file imported on first load when the database is empty
+        self.import_from = import_from
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None,
+                                   check_same_thread=False, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def load(self):
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(works)")}
+        if 'version' not in columns:
+            # Databases created before works had a version counter
+            conn.execute("ALTER TABLE works ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if 'state' not in columns:
+            # Databases created before the status index
+            conn.execute("ALTER TABLE works ADD COLUMN state TEXT NOT NULL DEFAULT 'open'")
+            conn.execute("ALTER TABLE works ADD COLUMN event_at TEXT")
+            conn.execute("UPDATE works SET event_at = json_extract(extra, '$.event_at')")
+            conn.execute(STATE_SQL)
+        for statement in STATE_INDEXES:
+            conn.execute(statement)
+        conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('state_version', '0')")
+        conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('state_epoch', ?)", (uuid.uuid4().hex[:8],))
+        self.state_epoch = conn.execute("SELECT value FROM settings WHERE key = 'state_epoch'").fetchone()[0]
+        empty = conn.execute("SELECT 1 FROM works LIMIT 1").fetchone() is None
+        if empty and self.import_from:
+            source = JSONStorage(self.import_from)
+            source.load()
+            data = source.export()
+            source.close()
+            if data['work_opportunities']:
+                self.import_data(data)
+                logger.info(f"Imported {self.import_from} into {self.db_file}.")
+        logger.info(f"SQLite storage ready at {self.db_file}.")
+
+    def save(self):
+        # Every change is committed as it happens; just checkpoint the WAL
+        self._conn().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def import_data(self, data):
+        """Insert works and the current work ID from the JSON data file format."""
+        with self._transaction() as conn:
+            self._import(conn, data)
+
+    def restore(self, data):
+        with self._transaction() as conn:
+            version = conn.execute(f"SELECT {NEXT_VERSION_SQL}").fetchone()[0]
+            conn.execute("DELETE FROM works")
+            conn.execute("DELETE FROM selections")
+            conn.execute("DELETE FROM reminders")
+            self._import(conn, data)
+            conn.execute("UPDATE works SET version = ?", (version,))
+
+    def _import(self, conn, data):
+        """Insert data in the JSON data file format inside an open transaction."""
+        for work_id, work in data.get('work_opportunities', {}).items():
+            self._insert_work(conn, work_id, work)
+            for position, worker in enumerate(work.get('selected_workers', []), 1):
+                conn.execute(
+                    "INSERT OR IGNORE INTO selections (work_id, worker, position) VALUES (?, ?, ?)",
+                    (work_id, worker, position)
+                )
+            for kind in ('reminders', 'scheduled_reminders'):
+                for reminder in work.get(kind, []):
+                    conn.execute(
+                        "INSERT INTO reminders (work_id, kind, data) VALUES (?, ?, ?)",
+                        (work_id, kind, json.dumps(reminder))
+                    )
+        conn.execute(STATE_SQL)
+        self._set_setting(conn, 'current_work_id', data.get('current_work_id'))
+        self._bump_state(conn)
+
+    def get_work(self, work_id):
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM works WHERE work_id = ?", (work_id,)).fetchone()
+        if row is None:
+            return None
+        return self._full_work(conn, row)
+
+    def _full_work(self, conn, row):
+        """Build a work dict from its works row plus its selections and reminders."""
+        work = self._row_to_work(row)
+        work["selected_workers"] = [
+            r[0] for r in conn.execute(
+                "SELECT worker FROM selections WHERE work_id = ? ORDER BY position", (row['work_id'],)
+            )
+        ]
+        for r in conn.execute("SELECT kind, data FROM reminders WHERE work_id = ? ORDER BY id", (row['work_id'],)):
+            work.setdefault(r['kind'], []).append(json.loads(r['data']))
+        return work
+
+    def list_works(self):
+        conn = self._conn()
+        works = []
+        for row in conn.execute("SELECT * FROM works ORDER BY created_at, rowid"):
+            work = self._row_to_work(row)
+            work["selected_workers"] = []
+            works.append((row['work_id'], work))
+        by_id = dict(works)
+        for r in conn.execute("SELECT work_id, worker FROM selections ORDER BY work_id, position"):
+            by_id[r['work_id']]["selected_workers"].append(r['worker'])
+        for r in conn.execute("SELECT work_id, kind, data FROM reminders ORDER BY id"):
+            by_id[r['work_id']].setdefault(r['kind'], []).append(json.loads(r['data']))
+        return works
+
+    def count_works(self):
+        return self._conn().execute("SELECT COUNT(*) FROM works").fetchone()[0]
+
+    def page_works(self, status=None, after=None, offset=0, limit=10, now=None):
+        # A page is a range scan of one index that stops after limit + 1
+        # rows. The first page and the pages after a cursor each have their
+        # own fixed statement, so the cursor can seek the index
+        now = now or _now()
+        conn = self._conn()
+        self._advance(conn, now)
+        keyset = tuple(after) if after else ()
+        if status is None:
+            sql = PAGE_AFTER_SQL if after else PAGE_SQL
+            params = keyset + (limit + 1, offset)
+        else:
+            sql = STATE_PAGE_AFTER_SQL if after else STATE_PAGE_SQL
+            before = now if status == PAST else None
+            params = (status, before, before) + keyset + (limit + 1, offset)
+        rows = conn.execute(sql, params).fetchall()
+        works = [(row['work_id'], self._full_work(conn, row)) for row in rows[:limit]]
+        cursor = _order_key(*works[-1]) if len(rows) > limit else None
+        return works, cursor
+
+    def worker_works(self, worker):
+        # Served by the selections_worker index
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT works.* FROM selections JOIN works ON works.work_id = selections.work_id "
+            "WHERE selections.worker = ? ORDER BY works.created_at, works.work_id",
+            (worker,)
+        ).fetchall()
+        return [(row['work_id'], self._full_work(conn, row)) for row in rows]
+
+    def open_works(self, now=None):
+        # Served by the works_state index: three statements however many
+        # works are open, rather than two more per work
+        conn = self._conn()
+        self._advance(conn, now or _now())
+        # One read transaction, so the three statements see the same works
+        conn.execute("BEGIN")
+        try:
+            works = []
+            for row in conn.execute("SELECT * FROM works WHERE state = 'open' ORDER BY created_at, work_id"):
+                work = self._row_to_work(row)
+                work["selected_workers"] = []
+                works.append((row['work_id'], work))
+            by_id = dict(works)
+            for r in conn.execute(
+                "SELECT selections.work_id, worker FROM works JOIN selections ON selections.work_id = works.work_id "
+                "WHERE state = 'open' ORDER BY selections.work_id, position"
+            ):
+                by_id[r['work_id']]["selected_workers"].append(r['worker'])
+            for r in conn.execute(
+                "SELECT reminders.work_id, kind, data FROM works JOIN reminders ON reminders.work_id = works.work_id "
+                "WHERE state = 'open' ORDER BY reminders.id"
+            ):
+                by_id[r['work_id']].setdefault(r['kind'], []).append(json.loads(r['data']))
+        finally:
+            conn.execute("COMMIT")
+        return works
+
+    def open_work_versions(self, now=None):
+        # Served by the works_state index
+        conn = self._conn()
+        self._advance(conn, now or _now())
+        return [tuple(row) for row in conn.execute(
+            "SELECT work_id, version FROM works WHERE state = 'open' ORDER BY created_at, work_id"
+        )]
+
+    def _advance(self, conn, now):
+        """Move the works whose event_at is before now to the past state."""
+        # Usually nothing to move: one probe of works_upcoming
+        if conn.execute(
+            "SELECT 1 FROM works WHERE state != 'past' AND event_at < ? LIMIT 1", (now,)
+        ).fetchone() is None:
+            return
+        with self._transaction() as conn:
+            conn.execute("UPDATE works SET state = 'past' WHERE state != 'past' AND event_at < ?", (now,))
+
+    def work_version(self, work_id):
+        row = self._conn().execute("SELECT version FROM works WHERE work_id = ?", (work_id,)).fetchone()
+        return row[0] if row else None
+
+    def state_version(self):
+        row = self._conn().execute("SELECT value FROM settings WHERE key = 'state_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def create_work(self, work_id, work):
+        with self._transaction() as conn:
+            self._insert_work(conn, work_id, work)
+            self._set_setting(conn, 'current_work_id', work_id)
+            self._bump_state(conn)
+
+    def delete_work(self, work_id):
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM works WHERE work_id = ?", (work_id,))
+            if cursor.rowcount == 0:
+                return False
+            conn.execute("DELETE FROM selections WHERE work_id = ?", (work_id,))
+            conn.execute("DELETE FROM reminders WHERE work_id = ?", (work_id,))
+            conn.execute(
+                "UPDATE settings SET value = NULL WHERE key = 'current_work_id' AND value = ?", (work_id,)
+            )
+            self._bump_state(conn)
+        return True
+
+    def get_current_work_id(self):
+        row = self._conn().execute("SELECT value FROM settings WHERE key = 'current_work_id'").fetchone()
+        return row[0] if row else None
+
+    def set_current_work_id(self, work_id):
+        with self._transaction() as conn:
+            self._set_setting(conn, 'current_work_id', work_id)
+            self._bump_state(conn)
+
+    def claim_slot(self, work_id, worker):
+        with self._transaction() as conn:
+            # Compare-and-set: the row is only inserted while the work still
+            # has fewer selections than required, and the primary key rejects
+            # a second row for the same worker
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO selections (work_id, worker, position) "
+                "SELECT ?, ?, filled + 1 FROM "
+                "(SELECT COUNT(*) AS filled FROM selections WHERE work_id = ?) "
+                "WHERE filled < (SELECT required_workers FROM works WHERE work_id = ?)",
+                (work_id, worker, work_id, work_id)
+            )
+            row = conn.execute(
+                "SELECT position FROM selections WHERE work_id = ? AND worker = ?", (work_id, worker)
+            ).fetchone()
+            if cursor.rowcount == 1:
+                # Positions have no gaps, so the new one is also the count
+                conn.execute(
+                    "UPDATE works SET version = version + 1, state = CASE WHEN state = 'past' THEN state "
+                    "WHEN ? >= required_workers THEN 'full' ELSE 'open' END WHERE work_id = ?",
+                    (row[0], work_id)
+                )
+                self._bump_state(conn)
+                return CLAIMED, row[0]
+            if row is not None:
+                return ALREADY_SELECTED, row[0]
+            if conn.execute("SELECT 1 FROM works WHERE work_id = ?", (work_id,)).fetchone() is None:
+                return NOT_FOUND, None
+            return FULL, None
+
+    def add_reminder(self, work_id, reminder):
+        self._add_reminder(work_id, 'reminders', reminder)
+
+    def add_scheduled_reminder(self, work_id, reminder):
+        self._add_reminder(work_id, 'scheduled_reminders', reminder)
+
+    def update_delivery(self, work_id, reminder_id, worker, status):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, data FROM reminders WHERE work_id = ? AND kind = 'reminders' "
+                "AND json_extract(data, '$.id') = ?",
+                (work_id, reminder_id)
+            ).fetchone()
+            if row is None:
+                return
+            reminder = json.loads(row['data'])
+            reminder.setdefault("deliveries", {})[worker] = status
+            conn.execute("UPDATE reminders SET data = ? WHERE id = ?", (json.dumps(reminder), row['id']))
+
+    def pending_reminders(self):
+        return [
+            (row['work_id'], json.loads(row['data']))
+            for row in self._conn().execute(
+                "SELECT work_id, data FROM reminders "
+                "WHERE kind = 'scheduled_reminders' AND json_extract(data, '$.status') = 'scheduled'"
+            )
+        ]
+
+    def set_reminder_status(self, work_id, reminder_id, status):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE reminders SET data = json_set(data, '$.status', ?) "
+                "WHERE work_id = ? AND kind = 'scheduled_reminders' AND json_extract(data, '$.id') = ?",
+                (status, work_id, reminder_id)
+            )
+            if cursor.rowcount:
+                self._bump_version(conn, work_id)
+
+    def _add_reminder(self, work_id, kind, reminder):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO reminders (work_id, kind, data) VALUES (?, ?, ?)",
+                (work_id, kind, json.dumps(reminder))
+            )
+            self._bump_version(conn, work_id)
+
+    def _bump_version(self, conn, work_id):
+        conn.execute("UPDATE works SET version = version + 1 WHERE work_id = ?", (work_id,))
+        self._bump_state(conn)
+
+    def _bump_state(self, conn):
+        conn.execute("UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'state_version'")
+
+    def _insert_work(self, conn, work_id, work):
+        extra = {k: v for k, v in work.items()
+                 if k not in WORK_COLUMNS and k not in ('selected_workers', 'reminders', 'scheduled_reminders')}
+        # A replaced work keeps counting up from its version, so it never
+        # repeats a version (and ETag) it had before
+        conn.execute(
+            "INSERT INTO works "
+            "(work_id, title, location, time, required_workers, payment, created_at, extra, state, event_at, version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, CASE WHEN "
+            f"(SELECT COUNT(*) FROM selections WHERE work_id = ?) >= ? THEN 'full' ELSE 'open' END, ?, {NEXT_VERSION_SQL}) "
+            "ON CONFLICT (work_id) DO UPDATE SET title = excluded.title, location = excluded.location, "
+            "time = excluded.time, required_workers = excluded.required_workers, payment = excluded.payment, "
+            "created_at = excluded.created_at, extra = excluded.extra, state = excluded.state, "
+            "event_at = excluded.event_at, version = MAX(works.version + 1, excluded.version)",
+            (work_id, work['title'], work.get('location'), work.get('time'), work['required_workers'],
+             work.get('payment'), work.get('created_at'), json.dumps(extra) if extra else None,
+             work_id, work['required_workers'], work.get('event_at'))
+        )
+
+    def _set_setting(self, conn, key, value):
+        conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    @staticmethod
+    def _row_to_work(row):
+        work = {column: row[column] for column in WORK_COLUMNS}
+        if row['extra']:
+            work.update(json.loads(row['extra']))
+        return work
+
+
+class _Transaction:
+    """Context manager running a block inside BEGIN IMMEDIATE ... COMMIT."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def open_storage(backend, data_file, db_file, **journal_options):
+    """Create the storage engine named by backend ('json' or 'sqlite')."""
+    if backend == 'json':
+        return JSONStorage(data_file, **journal_options)
+    if backend == 'sqlite':
+        return SQLiteStorage(db_file, import_from=data_file)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def migrate_json_to_sqlite(data_file, db_file):
+    """Copy a JSON data file (plus its journal) into a SQLite database."""
+    source = JSONStorage(data_file)
+    source.load()
+    target = SQLiteStorage(db_file)
+    target.load()
+    target.import_data(source.export())
+    works = target.count_works()
+    source.close()
+    target.close()
+    return works
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 4 or sys.argv[1] != 'migrate':
+        print("Usage: python storage.py migrate catering_data.json catering_data.db")
+        sys.exit(1)
+    count = migrate_json_to_sqlite(sys.argv[2], sys.argv[3])
+    print(f"Migrated {count} work opportunities into {sys.argv[3]}")
@@ -0,0 +1,268 @@
+"""Workspaces: several businesses served by one process.
+
+Each tenant has its own admin numbers, its own WhatsApp sender numbers and a
+workspace holding everything that belongs to it - storage, roster, reminder
+scheduler, backups, archive, caches - with its files in a directory of its
+own. Tenants do not share a data file, a journal, a lock or a thread, so a
+busy tenant never holds up or bloats another.
+
+Tenants are listed in a JSON file:
+
+    {
+      "default": "acme",
+      "tenants": [
+        {"name": "acme", "admins": ["whatsapp:+919353692621"], "numbers": ["whatsapp:+14155238886"]},
+        {"name": "bistro", "admins": ["whatsapp:+919876543210"], "numbers": ["whatsapp:+14155550100"], "preload": true}
+      ]
+    }
+
+An inbound message goes to the tenant whose sender number it was sent To,
+else to the tenant the sender is an admin of, else to the default tenant.
+Without a tenants file there is a single tenant, "default".
+
+A workspace's services are only built when its tenant is first needed,
+unless it is marked preload. Code that runs for a tenant finds it through
+current_workspace(), which WorkspaceLocal proxies use, so the same handler
+code serves every tenant.
+"""
+import contextvars
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from lazy import Lazy
+
+DEFAULT_TENANT = 'default'
+
+_current = contextvars.ContextVar('workspace', default=None)
+
+
+class Tenant:
+    """A business: its name, admin numbers, sender numbers and data directory."""
+
+    def __init__(self, name, admins, numbers=(), directory=None, preload=False):
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+            raise ValueError(f"Invalid tenant name: {name!r}")
+        self.name = name
+        self.admins = frozenset(admins)
+        self.numbers = tuple(numbers)
+        # None keeps the configured file paths as they are
+        self.directory = directory
+        self.preload = preload
+
+
+class Workspace:
+    """One tenant's services, each built on first use."""
+
+    def __init__(self, tenant, factories):
+        self.tenant = tenant
+        self.name = tenant.name
+        self._services = {name: Lazy(self._builder(factory)) for name, factory in factories.items()}
+        if tenant.directory:
+            os.makedirs(tenant.directory, exist_ok=True)
+
+    def _builder(self, factory):
+        def build():
+            with self.active():
+                return factory()
+        return build
+
+    def service(self, name):
+        return self._services[name]
+
+    def is_admin(self, number):
+        return number in self.tenant.admins
+
+    def path(self, path):
+        """Where a data file or directory configured as path lives for this tenant."""
+        if self.tenant.directory is None:
+            return path
+        return os.path.join(self.tenant.directory, os.path.basename(os.path.normpath(path)))
+
+    def enter(self):
+        """Make this the current workspace until leave() is called with the returned token."""
+        return _current.set(self)
+
+    @contextmanager
+    def active(self):
+        """Make this the current workspace for the code run inside."""
+        token = self.enter()
+        try:
+            yield self
+        finally:
+            leave(token)
+
+    def bind(self, fn):
+        """Wrap fn to run in this workspace, e.g. as a callback from a background thread."""
+        def bound(*args, **kwargs):
+            with self.active():
+                return fn(*args, **kwargs)
+        return bound
+
+    def start(self, names):
+        """Build the named services, if not built yet."""
+        for name in names:
+            self._services[name].get()
+
+    def built(self, name):
+        return self._services[name].built
+
+
+class Directory:
+    """The tenants, an index of their numbers, and the workspaces built so far."""
+
+    def __init__(self, tenants, factories, default=None):
+        self.tenants = {tenant.name: tenant for tenant in tenants}
+        self.factories = factories
+        self.default = default
+        self._by_number = {}
+        self._by_admin = {}
+        for tenant in tenants:
+            for number in tenant.numbers:
+                self._index(self._by_number, number, tenant, 'sender number')
+            for number in tenant.admins:
+                self._index(self._by_admin, number, tenant, 'admin number')
+        if default is not None and default not in self.tenants:
+            raise ValueError(f"Default tenant {default!r} is not listed")
+        self._workspaces = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index(index, number, tenant, kind):
+        if number in index:
+            raise ValueError(f"{number} is the {kind} of both {index[number].name} and {tenant.name}")
+        index[number] = tenant
+
+    @classmethod
+    def from_file(cls, path, base_directory, factories):
+        """Load the tenants file.
+
+        Each tenant's data goes in base_directory/<name>, unless its entry
+        has a "directory" of its own; null keeps the configured file paths,
+        for the tenant whose data is already there.
+        """
+        with open(path, 'r') as f:
+            config = json.load(f)
+        tenants = [
+            Tenant(entry['name'], entry.get('admins', []), entry.get('numbers', []),
+                   entry.get('directory', os.path.join(base_directory, entry['name'])),
+                   entry.get('preload', False))
+            for entry in config['tenants']
+        ]
+        return cls(tenants, factories, config.get('default'))
+
+    def resolve(self, to_number, sender):
+        """Return the tenant an inbound message belongs to, or None."""
+        tenant = self._by_number.get(to_number) or self._by_admin.get(sender)
+        if tenant is None and self.default is not None:
+            tenant = self.tenants[self.default]
+        return tenant
+
+    def workspace(self, name):
+        """Return a tenant's workspace, creating it on first use. None for an unknown tenant."""
+        workspace = self._workspaces.get(name)
+        if workspace is None:
+            tenant = self.tenants.get(name)
+            if tenant is None:
+                return None
+            with self._lock:
+                workspace = self._workspaces.get(name)
+                if workspace is None:
+                    workspace = self._workspaces[name] = Workspace(tenant, self.factories)
+        return workspace
+
+    def loaded(self):
+        """Workspaces created so far."""
+        return list(self._workspaces.values())
+
+    def every(self):
+        """Workspaces of all tenants, created if needed."""
+        return [self.workspace(name) for name in self.tenants]
+
+    def preloaded(self):
+        """Workspaces of the tenants marked preload, created if needed."""
+        return [self.workspace(name) for name, tenant in self.tenants.items() if tenant.preload]
+
+    def default_workspace(self):
+        return self.workspace(self.default) if self.default is not None else None
+
+
+def leave(token):
+    """Undo the Workspace.enter() that returned token."""
+    _current.reset(token)
+
+
+def current_workspace(directory):
+    """Return the workspace of the code running now, or the default one outside any."""
+    workspace = _current.get()
+    if workspace is None:
+        workspace = directory.default_workspace()
+        if workspace is None:
+            raise RuntimeError("No workspace: there is no default tenant")
+    return workspace
+
+
+class WorkspaceLocal:
+    """Stands in for a per-tenant service, resolving to the current workspace's one.
+
+    Behaves like a Lazy: get and built belong to the proxy, any other
+    attribute is the service's.
+    """
+
+    def __init__(self, directory, name):
+        self._directory = directory
+        self._name = name
+
+    def _lazy(self):
+        return current_workspace(self._directory).service(self._name)
+
+    @property
+    def built(self):
+        return self._lazy().built
+
+    def get(self):
+        return self._lazy().get()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __bool__(self):
+        return self.get() is not None
+
+
+class WorkspaceDict:
+    """Stands in for a per-tenant dict, or dict-like view, of the current workspace.
+
+    Unlike WorkspaceLocal, every attribute - get included - is the mapping's.
+    """
+
+    def __init__(self, directory, name):
+        self._directory = directory
+        self._name = name
+
+    def _target(self):
+        return current_workspace(self._directory).service(self._name).get()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._target(), name)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __contains__(self, key):
+        return key in self._target()
+
+    def __len__(self):
+        return len(self._target())
@@ -0,0 +1,375 @@
+import json
+import threading
+import time
+
+import pytest
+
+from ratelimit import SenderLimiter
+from sessions import SessionNamespace
+
+ADMIN = 'whatsapp:+15555550100'
+WORKER = 'whatsapp:+15555550101'
+ACME_NUMBER = 'whatsapp:+15555550200'
+BISTRO_NUMBER = 'whatsapp:+15555550300'
+BISTRO_ADMIN = 'whatsapp:+15555550301'
+
+
+@pytest.fixture(scope='module')
+def bot(tmp_path_factory):
+    # The app reads its settings when imported, so they are set first, with
+    # absolute paths as the files are closed at exit
+    directory = tmp_path_factory.mktemp('app')
+    # Two tenants: acme, the default, keeps the files where the settings
+    # say, and bistro gets its own directory under TENANTS_DIR
+    (directory / 'tenants.json').write_text(json.dumps({
+        'default': 'acme',
+        'tenants': [
+            {'name': 'acme', 'admins': [ADMIN], 'numbers': [ACME_NUMBER], 'directory': None, 'preload': True},
+            {'name': 'bistro', 'admins': [BISTRO_ADMIN], 'numbers': [BISTRO_NUMBER]},
+        ]
+    }))
+    settings = {
+        'TENANTS_FILE': 'tenants.json',
+        'TENANTS_DIR': 'tenants',
+        'ADMIN_NUMBER': ADMIN,
+        'OUTBOUND_TRANSPORT': 'fake',
+        'ADMIN_DIGEST_WINDOW': '0',
+        'ADMIN_RATE_LIMIT': '0',
+        'WORKER_RATE_LIMIT': '0',
+        'JOURNAL_FSYNC': 'never',
+        'CATERING_DATA_FILE': 'catering_data.json',
+        'CATERING_DB_FILE': 'catering_data.db',
+        'BACKUP_DIR': 'backups',
+        'ARCHIVE_DIR': 'archive',
+        'STATS_FILE': 'stats.db',
+        'OUTBOX_FILE': 'outbox.db',
+        'OUTBOUND_RATE_FILE': 'send_rate.db',
+        'REMINDER_LOCK_FILE': 'scheduler.lock',
+        'DEDUP_FILE': 'dedup.db',
+        'ROSTER_FILE': 'roster.db',
+        'SESSION_FILE': 'sessions.db',
+    }
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in settings.items():
+            mp.setenv(name, str(directory / value) if name.endswith(('_FILE', '_DIR')) else value)
+        import app
+    return app
+
+
+@pytest.fixture
+def client(bot):
+    """A test client on an empty store."""
+    client = bot.app.test_client()
+    client.get('/')
+    with bot.tenants.default_workspace().active():
+        bot.store.restore({'work_opportunities': {}, 'current_work_id': None})
+        bot.admin_state.clear()
+        bot.info_choices.clear()
+    return client
+
+
+def send(client, sender, body, **values):
+    return client.post('/whatsapp', data=dict(values, From=sender, Body=body)).get_data(as_text=True)
+
+
+def test_every_tenant_fires_reminders_before_its_first_message(bot, client):
+    # bistro has had no message yet and is not preloaded
+    bistro = bot.tenants.workspace('bistro')
+    assert bistro.built('reminder_scheduler')
+    assert not bistro.built('broadcaster')
+    assert wait_for(lambda: bistro.service('reminder_scheduler').get().is_leader)
+
+
+def test_api_etag_is_stable_until_a_change(bot, client):
+    bot.create_work("Dinner", "Hall", "June 1 at 6pm", 2, "500")
+    first = client.get('/api/works')
+    second = client.get('/api/works')
+    assert first.status_code == second.status_code == 200
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert first.get_data() == second.get_data()
+    assert [work['title'] for work in first.get_json()['works']] == ["Dinner"]
+
+    unchanged = client.get('/api/works', headers={'If-None-Match': first.headers['ETag']})
+    assert unchanged.status_code == 304
+    assert unchanged.headers['ETag'] == first.headers['ETag']
+    assert unchanged.get_data() == b''
+
+    send(client, WORKER, 'Yes')
+    changed = client.get('/api/works', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag']
+    assert changed.get_json()['works'][0]['selected_workers'] == 1
+
+
+def test_api_long_poll_wakes_up_on_a_change(bot, client, monkeypatch):
+    monkeypatch.setattr(bot, 'API_POLL_INTERVAL', 0.02)
+    etag = client.get('/api/works').headers['ETag']
+    timer = threading.Timer(0.2, bot.create_work, ("Lunch", "Hall", "June 2 at noon", 1, "300"))
+    timer.start()
+    start = time.monotonic()
+    response = client.get('/api/works?wait=10', headers={'If-None-Match': etag})
+    timer.join()
+    assert 0.2 <= time.monotonic() - start < 5
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert [work['title'] for work in response.get_json()['works']] == ["Lunch"]
+
+
+def test_api_long_poll_times_out_with_not_modified(bot, client, monkeypatch):
+    monkeypatch.setattr(bot, 'API_POLL_INTERVAL', 0.02)
+    etag = client.get('/api/works').headers['ETag']
+    start = time.monotonic()
+    response = client.get('/api/works?wait=0.3', headers={'If-None-Match': etag})
+    assert time.monotonic() - start >= 0.3
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_api_pages_follow_next_and_reject_bad_cursors(bot, client):
+    for n in range(3):
+        bot.create_work(f"Dinner {n}", "Hall", "June 1 at 6pm", 2, "500")
+    first = client.get('/api/works?limit=2').get_json()
+    second = client.get('/api/works', query_string={'limit': 2, 'after': first['next']}).get_json()
+    titles = [work['title'] for work in first['works'] + second['works']]
+    assert sorted(titles) == ["Dinner 0", "Dinner 1", "Dinner 2"]
+    assert second['next'] is None
+
+    for after in ('garbage', '2025-06-01 10:00:00|', 'yesterday|a1b2c3d4'):
+        response = client.get('/api/works', query_string={'after': after})
+        assert response.status_code == 400
+        assert response.get_json() == {"error": "Invalid cursor"}
+
+
+def test_flood_is_shed_after_the_burst(bot, client, monkeypatch):
+    monkeypatch.setitem(bot.rate_limiters, 'worker', SenderLimiter(1 / 60, 2))
+    assert 'Info' in send(client, WORKER, 'hello')
+    assert 'Info' in send(client, WORKER, 'hello')
+    assert 'too quickly' in send(client, WORKER, 'hello')
+    assert '<Message>' not in send(client, WORKER, 'hello')
+    # Other senders have their own limit
+    assert 'Info' in send(client, 'whatsapp:+15555550102', 'hello')
+
+
+def test_retry_is_replayed_without_counting_against_the_limit(bot, client, monkeypatch):
+    limiter = SenderLimiter(1 / 60, 1)
+    monkeypatch.setitem(bot.rate_limiters, 'worker', limiter)
+    first = send(client, WORKER, 'hello', MessageSid='SMlimit1')
+    assert 'Info' in first
+    assert send(client, WORKER, 'hello', MessageSid='SMlimit1') == first
+    assert send(client, WORKER, 'hello', MessageSid='SMlimit1') == first
+    assert (limiter.allowed, limiter.shed) == (1, 0)
+    assert 'too quickly' in send(client, WORKER, 'hello', MessageSid='SMlimit2')
+
+
+def test_retried_claim_gets_the_same_reply_and_one_slot(bot, client):
+    work_id = bot.create_work("Dinner", "Hall", "June 1 at 6pm", 2, "500")
+    first = send(client, WORKER, 'Yes', MessageSid='SMclaim1')
+    assert 'worker #1 of 2' in first
+    assert send(client, WORKER, 'Yes', MessageSid='SMclaim1') == first
+    assert bot.store.get_work(work_id)['selected_workers'] == [WORKER]
+    # A new message from the same worker is handled, and finds the claim
+    assert 'already selected' in send(client, WORKER, 'Yes', MessageSid='SMclaim2')
+    assert 'worker #2 of 2' in send(client, 'whatsapp:+15555550102', 'Yes', MessageSid='SMclaim3')
+
+
+def create_dinner(bot, work_id):
+    # All in the same second, as a burst of CREATEs could be
+    bot.store.create_work(work_id, {
+        "title": f"Dinner {work_id}", "location": "Hall", "time": "June 1 at 6pm", "event_at": None,
+        "required_workers": 2, "payment": "500", "selected_workers": [], "created_at": "2026-06-01 10:00:00"
+    })
+
+
+def test_yes_numbers_are_the_ones_info_showed_in_any_process(bot, client):
+    for work_id in ('cc000003', 'aa000001', 'bb000002'):
+        create_dinner(bot, work_id)
+    reply = send(client, WORKER, 'Info')
+    # Works created in the same second are numbered by ID
+    assert reply.index('1. Dinner aa000001') < reply.index('2. Dinner bb000002') < reply.index('3. Dinner cc000003')
+    # The numbers are kept in the shared session store, not in this process
+    assert SessionNamespace(bot.sessions, 'acme/info')[WORKER] == ['aa000001', 'bb000002', 'cc000003']
+
+    # A work created since does not shift the numbers INFO showed
+    create_dinner(bot, 'ab000001')
+    assert 'Dinner bb000002' in send(client, WORKER, 'Yes 2')
+    # IDs can be typed in any case
+    assert 'Dinner cc000003' in send(client, WORKER, 'Yes CC000003')
+    assert bot.store.get_work('cc000003')['selected_workers'] == [WORKER]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_each_tenant_is_served_from_its_own_workspace(bot, client):
+    reply = send(client, BISTRO_ADMIN, 'CREATE Brunch, Cafe, June 3 at 11am, 1, 200', To=BISTRO_NUMBER)
+    assert 'Work opportunity created' in reply
+    acme, bistro = bot.tenants.workspace('acme'), bot.tenants.workspace('bistro')
+    with bistro.active():
+        (work_id, work), = bot.store.list_works()
+        assert bot.store.data_file.startswith(bot.TENANTS_DIR)
+    assert work['title'] == 'Brunch'
+    with acme.active():
+        assert bot.store.list_works() == []
+
+    # Workers see the works of the number they write to
+    assert 'Brunch' in send(client, WORKER, 'Info', To=BISTRO_NUMBER)
+    assert 'No open work' in send(client, WORKER, 'Info', To=ACME_NUMBER)
+    assert 'worker #1 of 1' in send(client, WORKER, 'Yes', To=BISTRO_NUMBER)
+    with bistro.active():
+        assert bot.store.get_work(work_id)['selected_workers'] == [WORKER]
+
+    # The digest thread tells bistro's admin through bistro's outbox
+    with bistro.active():
+        bistro_sent = bot.delivery_engine.transport.sent
+    with acme.active():
+        acme_sent = bot.delivery_engine.transport.sent
+    assert wait_for(lambda: any(body.startswith("✅ Brunch") for _, body in bistro_sent))
+    assert {number for number, _ in bistro_sent} == {BISTRO_ADMIN}
+    assert not any('Brunch' in body for _, body in acme_sent)
+
+
+def test_my_and_worker_list_a_workers_works(bot, client):
+    dinner = bot.create_work("Dinner", "Hall", "June 1 at 6pm", 2, "500")
+    lunch = bot.create_work("Lunch", "Garden", "June 2 at noon", 1, "300")
+    assert 'no upcoming confirmed work' in send(client, WORKER, 'My')
+    send(client, 'whatsapp:+15555550102', f'Yes {dinner}')
+    send(client, WORKER, f'Yes {dinner}')
+    send(client, WORKER, f'Yes {lunch}')
+
+    reply = send(client, WORKER, 'My')
+    assert 'Event: Dinner' in reply and 'Event: Lunch' in reply
+    assert 'You are worker #2 of 2.' in reply
+    assert 'You are worker #1 of 1.' in reply
+
+    reply = send(client, ADMIN, 'WORKER 1 555 555 0101')
+    assert '+15555550101 is selected for 2 work opportunities' in reply
+    assert f'ID: {dinner}' in reply and 'Worker #2 of 2 (full)' in reply
+    assert f'ID: {lunch}' in reply and 'Worker #1 of 1 (full)' in reply
+    assert 'is not selected for any' in send(client, ADMIN, 'WORKER +15555550199')
+    for number in ('+abc', '12345', '+1234567890123456', '+1555555abcd'):
+        assert 'country code' in send(client, ADMIN, f'WORKER {number}')
+    assert 'country code' in send(client, ADMIN, 'TAG +abc waiter')
+    assert client.get('/stats?worker=abc').status_code == 400
+
+
+def test_restore_needs_the_token_and_restores_a_backup(bot, client, monkeypatch):
+    assert client.post('/restore').status_code == 403
+    monkeypatch.setattr(bot, 'BACKUP_TOKEN', 'secret')
+    assert client.post('/restore').status_code == 401
+    assert client.post('/restore', headers={'Authorization': 'Bearer guess'}).status_code == 401
+
+    auth = {'Authorization': 'Bearer secret'}
+    work_id = bot.create_work("Dinner", "Hall", "June 1 at 6pm", 2, "500")
+    entry = bot.backup_manager.backup(force=True)
+    bot.store.delete_work(work_id)
+    assert 'There is no work opportunity' in send(client, WORKER, f'Yes {work_id}')
+
+    response = client.post('/restore', headers=auth)
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "status": "success", "message": f"Restored {entry['name']}", "work_opportunities": 1
+    }
+    assert bot.store.get_work(work_id)['title'] == "Dinner"
+    assert 'worker #1 of 2' in send(client, WORKER, f'Yes {work_id}')
+
+    response = client.post('/restore', headers=auth, data={'name': 'missing.json.gz'})
+    assert response.status_code == 400
+
+
+def test_stats_count_claims_per_work_and_worker(bot, client):
+    # None until the first work is counted
+    before = client.get('/stats').get_json()['all_time'] or {'works': 0, 'claims': 0, 'filled': 0}
+    work_id = bot.create_work("Gala", "Hall", "June 4 at 7pm", 2, "800")
+    send(client, 'whatsapp:+15555550401', f'Yes {work_id}')
+    send(client, 'whatsapp:+15555550402', f'Yes {work_id}')
+
+    stats = client.get(f'/stats?work_id={work_id}&worker=%2B15555550401').get_json()
+    assert stats['all_time']['works'] == before['works'] + 1
+    assert stats['all_time']['claims'] == before['claims'] + 2
+    assert stats['all_time']['filled'] == before['filled'] + 1
+    assert stats['work']['claims'] == 2 and stats['work']['fill_rate'] == 1
+    assert stats['work']['time_to_full'] is not None
+    assert [claim['worker'] for claim in stats['work']['claim_times']] == \
+        ['whatsapp:+15555550401', 'whatsapp:+15555550402']
+    assert stats['worker'] == {"worker": 'whatsapp:+15555550401', "claims": 1}
+    assert stats['weeks'][0]['works'] >= 1
+
+    assert client.get('/stats?work_id=unknown').get_json()['work'] is None
+    assert client.get('/stats?tenant=nobody').status_code == 404
+
+
+def test_stats_count_the_restored_works_after_a_restore(bot, client, monkeypatch):
+    monkeypatch.setattr(bot, 'BACKUP_TOKEN', 'secret')
+    kept = bot.create_work("Brunch", "Hall", "June 5 at 11am", 2, "300")
+    send(client, 'whatsapp:+15555550501', f'Yes {kept}')
+    bot.backup_manager.backup(force=True)
+    replaced = bot.create_work("Supper", "Hall", "June 6 at 8pm", 1, "400")
+    send(client, 'whatsapp:+15555550502', f'Yes {replaced}')
+    send(client, 'whatsapp:+15555550501', f'Yes {replaced}')
+
+    assert client.post('/restore', headers={'Authorization': 'Bearer secret'}).status_code == 200
+    stats = client.get(f'/stats?work_id={replaced}&worker=%2B15555550502').get_json()
+    # Counted exactly as the restored store holds them
+    works = [work for work_id, work in bot.store.list_works()]
+    assert stats['all_time']['works'] == len(works)
+    assert stats['all_time']['claims'] == sum(len(work['selected_workers']) for work in works)
+    assert stats['work'] is None
+    assert stats['worker'] == {"worker": 'whatsapp:+15555550502', "claims": 0}
+    assert client.get(f'/stats?work_id={kept}').get_json()['work']['claims'] == 1
+
+
+class LoadedOnce(dict):
+    """Sessions that may be loaded with get() but never read again by a handler."""
+
+    def __getitem__(self, key):
+        raise AssertionError(f"session of {key} read again")
+
+
+def test_interactive_create_steps_use_the_loaded_session(bot, client, monkeypatch):
+    monkeypatch.setattr(bot, 'admin_state', LoadedOnce())
+    assert 'event name' in send(client, ADMIN, 'CREATE')
+    assert 'location' in send(client, ADMIN, 'Wedding')
+    assert 'When is this event' in send(client, ADMIN, 'Lawn')
+    assert 'How many workers' in send(client, ADMIN, 'June 5 at 7pm')
+    assert 'valid number' in send(client, ADMIN, 'many')
+    assert 'payment' in send(client, ADMIN, '3')
+    assert 'Work opportunity created' in send(client, ADMIN, '900')
+    assert bot.admin_state == {}
+    (work_id, work), = bot.store.list_works()
+    assert (work['title'], work['location'], work['required_workers'], work['payment']) == ('Wedding', 'Lawn', 3, '900')
+
+
+def test_reminder_is_sent_only_when_it_was_queued(bot, client):
+    work_id = bot.create_work("Dinner", "Hall", "June 1 at 6pm", 2, "500")
+
+    def fire(reminder_id):
+        reminder = {"id": reminder_id, "message": "Be on time", "scheduled_for": "2099-01-01 00:00:00", "status": bot.SCHEDULED}
+        bot.store.add_scheduled_reminder(work_id, reminder)
+        bot.fire_reminder(bot.reminder_job(work_id, reminder))
+        return {r["id"]: r["status"] for r in bot.store.get_work(work_id)["scheduled_reminders"]}[reminder_id]
+
+    # Nobody to remind yet
+    assert fire('r1') == bot.MISSED
+    send(client, WORKER, 'Yes')
+    assert fire('r2') == bot.SENT
+    sent = bot.delivery_engine.transport.sent
+    assert wait_for(lambda: (WORKER, "REMINDER for Dinner: Be on time") in sent)
+
+
+class NoSessions(dict):
+    """A session store that must not be read."""
+
+    def get(self, key, default=None):
+        raise AssertionError(f"session of {key} loaded")
+
+
+def test_worker_messages_do_not_load_a_session(bot, client, monkeypatch):
+    bot.create_work("Dinner", "Hall", "June 1 at 6pm", 2, "500")
+    monkeypatch.setattr(bot, 'admin_state', NoSessions())
+    assert 'Dinner' in send(client, WORKER, 'Info')
+    assert 'worker #1 of 2' in send(client, WORKER, 'Yes')
+    assert 'Info' in send(client, WORKER, 'hello')
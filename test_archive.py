@@ -0,0 +1,99 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from archive import Archive, ArchiveError
+from storage import JSONStorage, SQLiteStorage
+
+
+def make_work(title, event_at):
+    return {
+        "title": title,
+        "location": "Hall",
+        "time": event_at,
+        "event_at": event_at,
+        "required_workers": 2,
+        "payment": "500",
+        "selected_workers": [],
+        "created_at": "2025-05-01 10:00:00"
+    }
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        engine = JSONStorage(str(tmp_path / 'data.json'), fsync='never')
+    else:
+        engine = SQLiteStorage(str(tmp_path / 'data.db'))
+    engine.load()
+    yield engine
+    engine.close()
+
+
+def test_past_works_move_to_monthly_segments(store, tmp_path):
+    archive = Archive(store, str(tmp_path / 'archive'), after_days=7, batch_size=2)
+    store.create_work('may1', make_work('May dinner', '2025-05-10 18:00:00'))
+    store.create_work('may2', make_work('May lunch', '2025-05-20 12:00:00'))
+    store.create_work('jun1', make_work('June dinner', '2025-06-02 18:00:00'))
+    store.create_work('recent', make_work('Last night', '2025-06-14 18:00:00'))
+    store.create_work('next', make_work('Next week', '2025-06-22 18:00:00'))
+    store.claim_slot('may1', 'whatsapp:+1')
+
+    assert archive.archive_past(now=datetime(2025, 6, 15)) == 3
+    assert sorted(work_id for work_id, _ in store.list_works()) == ['next', 'recent']
+    assert sorted(name for name in os.listdir(tmp_path / 'archive') if name.endswith('.json.gz')) == [
+        '2025-05-0001.json.gz', '2025-05-0002.json.gz', '2025-06-0001.json.gz'
+    ]
+    assert archive.months() == {'2025-06': 1, '2025-05': 2}
+    assert [row['work_id'] for row in archive.history()] == ['jun1', 'may2', 'may1']
+    assert [row['work_id'] for row in archive.history('2025-05')] == ['may1', 'may2']
+    assert archive.get_work('may1')['selected_workers'] == ['whatsapp:+1']
+    assert archive.get_work('next') is None
+
+    # Nothing left to move until more events go by
+    assert archive.archive_past(now=datetime(2025, 6, 15)) == 0
+    assert archive.archive_past(now=datetime(2025, 6, 30)) == 2
+    assert archive.count() == 5
+    assert archive.count('2025-06') == 3
+
+
+def test_works_without_an_event_date_move_by_age(store, tmp_path):
+    archive = Archive(store, str(tmp_path / 'archive'), after_days=7, undated_after_days=30, batch_size=1)
+    for work_id, created_at in [('old1', '2025-04-01 10:00:00'), ('old2', '2025-04-20 10:00:00'),
+                                ('new', '2025-06-01 10:00:00')]:
+        store.create_work(work_id, dict(make_work('Party', None), time='soonish', created_at=created_at))
+    store.create_work('dated', make_work('Last night', '2025-06-14 18:00:00'))
+
+    assert archive.archive_past(now=datetime(2025, 5, 15)) == 1
+    assert archive.archive_past(now=datetime(2025, 6, 15)) == 1
+    assert sorted(work_id for work_id, _ in store.list_works()) == ['dated', 'new']
+    assert archive.months() == {'2025-04': 2}
+    assert [row['work_id'] for row in archive.history('2025-04')] == ['old1', 'old2']
+    assert archive.get_work('old2')['time'] == 'soonish'
+
+
+def test_work_indexed_before_a_crash_is_not_archived_twice(store, tmp_path):
+    archive = Archive(store, str(tmp_path / 'archive'))
+    work = make_work('May dinner', '2025-05-10 18:00:00')
+    store.create_work('may1', work)
+    archive._archive_batch([('may1', store.get_work('may1'))])
+
+    # The process died before deleting the work from storage
+    assert archive.archive_past(now=datetime(2025, 6, 15)) == 1
+    assert store.get_work('may1') is None
+    assert archive.count() == 1
+    assert len([name for name in os.listdir(tmp_path / 'archive') if name.endswith('.json.gz')]) == 1
+
+
+def test_corrupt_segment_is_refused(store, tmp_path):
+    archive = Archive(store, str(tmp_path / 'archive'))
+    store.create_work('may1', make_work('May dinner', '2025-05-10 18:00:00'))
+    archive.archive_past(now=datetime(2025, 6, 15))
+    with open(tmp_path / 'archive' / '2025-05-0001.json.gz', 'ab') as f:
+        f.write(b'junk')
+
+    fresh = Archive(store, str(tmp_path / 'archive'))
+    with pytest.raises(ArchiveError):
+        fresh.get_work('may1')
+    assert fresh.history()[0]['title'] == 'May dinner'
@@ -0,0 +1,113 @@
+import gzip
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from backups import BackupManager, BackupError, FULL_BACKUP, DELTA_BACKUP
+from storage import JSONStorage, SQLiteStorage
+
+
+def make_work(title):
+    return {
+        "title": title,
+        "location": "Hall",
+        "time": "June 1 6pm",
+        "required_workers": 2,
+        "payment": "500",
+        "selected_workers": [],
+        "created_at": "2025-06-01 10:00:00"
+    }
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        engine = JSONStorage(str(tmp_path / 'data.json'), fsync='never')
+    else:
+        engine = SQLiteStorage(str(tmp_path / 'data.db'))
+    engine.load()
+    yield engine
+    engine.close()
+
+
+def test_delta_backup_restores_to_its_point_in_time(store, tmp_path):
+    manager = BackupManager(store, str(tmp_path / 'backups'))
+    start = datetime(2025, 6, 1, 10)
+    store.create_work('a1', make_work('Event 1'))
+    store.create_work('b2', make_work('Event 2'))
+    full = manager.backup(now=start)
+
+    store.claim_slot('a1', 'whatsapp:+1')
+    store.delete_work('b2')
+    store.create_work('c3', make_work('Event 3'))
+    delta = manager.backup(now=start + timedelta(hours=1))
+    assert (full['kind'], delta['kind']) == (FULL_BACKUP, DELTA_BACKUP)
+    assert delta['base'] == full['name']
+    expected = store.export()
+
+    store.create_work('d4', make_work('Event 4'))
+    store.claim_slot('a1', 'whatsapp:+2')
+    manager.restore(delta['name'])
+    assert store.export() == expected
+    assert store.get_work('a1')["selected_workers"] == ['whatsapp:+1']
+
+    manager.restore(full['name'])
+    assert sorted(work_id for work_id, _ in store.list_works()) == ['a1', 'b2']
+    assert store.get_current_work_id() == 'b2'
+
+
+def test_restore_gives_works_new_versions(store, tmp_path):
+    manager = BackupManager(store, str(tmp_path / 'backups'))
+    store.create_work('a1', make_work('Event 1'))
+    backup = manager.backup()
+    version = store.work_version('a1')
+    manager.restore(backup['name'])
+    assert store.work_version('a1') != version
+
+
+def test_retention_keeps_hourly_and_daily_backups(store, tmp_path):
+    manager = BackupManager(store, str(tmp_path / 'backups'), interval=600, full_interval=6 * 3600,
+                            keep_hourly=3, keep_daily=2)
+    store.create_work('a1', make_work('Event 1'))
+    start = datetime(2025, 6, 1, 0, 0)
+    for n in range(6 * 24 * 3):  # Every 10 minutes for three days
+        manager.backup(now=start + timedelta(minutes=10 * n))
+
+    manifest = manager.manifest()
+    names = {entry['name'] for entry in manifest}
+    assert sorted(os.listdir(tmp_path / 'backups')) == sorted(names | {'manifest.json', 'backup.lock'})
+    times = [entry['created_at'] for entry in manifest]
+    # Last three hours, last two days (the newest of yesterday and today)
+    assert '2025-06-03T23:50:00' in times
+    assert '2025-06-03T22:50:00' in times
+    assert '2025-06-03T21:50:00' in times
+    assert '2025-06-02T23:50:00' in times
+    # Every kept delta still has its base
+    for entry in manifest:
+        if entry['kind'] == DELTA_BACKUP:
+            assert entry['base'] in names
+            manager.load(entry['name'])
+    assert len(manifest) <= 3 + 2 + 2
+
+
+def test_recent_backup_is_not_repeated_unless_forced(store, tmp_path):
+    manager = BackupManager(store, str(tmp_path / 'backups'), interval=3600)
+    now = datetime(2025, 6, 1, 10)
+    assert manager.backup(now=now) is not None
+    assert manager.backup(now=now + timedelta(minutes=5)) is None
+    assert manager.backup(force=True, now=now + timedelta(minutes=5)) is not None
+
+
+def test_corrupt_backup_is_not_restored(store, tmp_path):
+    manager = BackupManager(store, str(tmp_path / 'backups'))
+    store.create_work('a1', make_work('Event 1'))
+    backup = manager.backup()
+    with gzip.open(tmp_path / 'backups' / backup['name'], 'wt') as f:
+        f.write('{"work_opportunities": {}, "current_work_id": null}')
+    store.create_work('b2', make_work('Event 2'))
+    with pytest.raises(BackupError):
+        manager.restore(backup['name'])
+    with pytest.raises(BackupError):
+        manager.restore('missing.json.gz')
+    assert store.count_works() == 2
@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+
+from bench_load import percentile, reply_text, summarize
+
+
+def test_reply_text_joins_messages():
+    twiml = '<?xml version="1.0" encoding="UTF-8"?><Response><Message>One</Message><Message>Two &amp; three</Message></Response>'
+    assert reply_text(twiml) == "One\nTwo & three"
+
+
+def test_percentiles_use_nearest_rank():
+    values = [n / 1000 for n in range(1, 101)]
+    assert percentile(values, 0.50) == 0.05
+    assert percentile(values, 0.99) == 0.099
+    summary = summarize(values, seconds=2.0)
+    assert summary['requests'] == 100
+    assert summary['requests_per_second'] == 50
+    assert summary['p95_ms'] == 95
+    assert 'seconds' not in summarize(values)
+
+
+def test_small_run_keeps_claim_invariants():
+    # A fresh interpreter, as the app reads its settings when imported
+    output = subprocess.run(
+        [sys.executable, 'bench_load.py', '--json', '--workers', '40', '--slots', '5', '--rounds', '2',
+         '--requests', '100', '--history', '200', '--concurrency', '8'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    ).stdout
+    results = json.loads(output.splitlines()[-1])
+    assert results['failures'] == []
+    assert set(results['scenarios']) == {'race', 'mix', 'history'}
+    assert results['scenarios']['race']['requests'] == 2 * (40 + 4 + 1)
+    assert results['commands']['race:YES']['p99_ms'] >= results['commands']['race:YES']['p50_ms']
@@ -0,0 +1,48 @@
+from cache import ResponseCache, render
+
+
+def test_replies_are_rendered_once():
+    cache = ResponseCache()
+    calls = []
+
+    def build():
+        calls.append(1)
+        return "Hello"
+
+    first = cache.get_or_render(('help',), build)
+    assert cache.get_or_render(('help',), build) is first
+    assert first == render("Hello")
+    assert '<Message>Hello</Message>' in first
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_list_of_texts_renders_one_message_each():
+    reply = ResponseCache().get_or_render(('info',), lambda: ["One", "Two"])
+    assert '<Message>One</Message><Message>Two</Message>' in reply
+
+
+def test_new_version_renders_again():
+    cache = ResponseCache()
+    assert cache.get_or_render(('info', 'a1', 1), lambda: "1/2 filled") != \
+        cache.get_or_render(('info', 'a1', 2), lambda: "2/2 filled")
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(maxsize=2)
+    cache.get_or_render('a', lambda: "a")
+    cache.get_or_render('b', lambda: "b")
+    cache.get_or_render('a', lambda: "a")
+    cache.get_or_render('c', lambda: "c")
+    assert len(cache) == 2
+    cache.get_or_render('a', lambda: "a")
+    cache.get_or_render('b', lambda: "b")
+    assert cache.misses == 4
+
+
+def test_size_zero_disables_caching():
+    cache = ResponseCache(maxsize=0)
+    cache.get_or_render('a', lambda: "a")
+    cache.get_or_render('a', lambda: "a")
+    assert len(cache) == 0
+    assert cache.hits == 0
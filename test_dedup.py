@@ -0,0 +1,81 @@
+import threading
+import time
+
+from dedup import ReplyLog
+
+
+def test_retry_gets_the_stored_reply(tmp_path):
+    log = ReplyLog(str(tmp_path / 'dedup.db'))
+    assert log.begin('SM1') == (True, None)
+    log.finish('SM1', '<Response>first</Response>')
+    assert log.begin('SM1') == (False, '<Response>first</Response>')
+
+    # Another process sees the same reply
+    other = ReplyLog(str(tmp_path / 'dedup.db'))
+    assert other.begin('SM1') == (False, '<Response>first</Response>')
+    assert other.begin('SM2') == (True, None)
+
+
+def test_lookup_only_sees_finished_replies(tmp_path):
+    log = ReplyLog(str(tmp_path / 'dedup.db'), ttl=0.2)
+    assert log.lookup('SM1') is None
+    log.begin('SM1')
+    assert log.lookup('SM1') is None
+    log.finish('SM1', 'reply')
+    assert log.lookup('SM1') == 'reply'
+    time.sleep(0.25)
+    assert log.lookup('SM1') is None
+
+
+def test_retry_waits_for_the_first_request(tmp_path):
+    log = ReplyLog(str(tmp_path / 'dedup.db'), wait=5, poll_interval=0.01)
+    assert log.begin('SM1') == (True, None)
+    results = []
+    retry = threading.Thread(target=lambda: results.append(log.begin('SM1')))
+    retry.start()
+    time.sleep(0.05)
+    log.finish('SM1', 'reply')
+    retry.join()
+    assert results == [(False, 'reply')]
+
+
+def test_only_one_concurrent_request_handles_a_message(tmp_path):
+    log = ReplyLog(str(tmp_path / 'dedup.db'), wait=0)
+    start = threading.Barrier(8)
+    results = []
+
+    def deliver():
+        start.wait()
+        results.append(log.begin('SM1')[0])
+
+    threads = [threading.Thread(target=deliver) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] * 7 + [True]
+
+
+def test_abandoned_and_stale_leases_are_handled_again(tmp_path):
+    log = ReplyLog(str(tmp_path / 'dedup.db'), lease_seconds=0.05, wait=0)
+    assert log.begin('SM1') == (True, None)
+    log.abandon('SM1')
+    assert log.begin('SM1') == (True, None)
+    assert log.begin('SM1') == (False, None)
+    time.sleep(0.1)
+    assert log.begin('SM1') == (True, None)
+
+
+def test_entries_expire_and_are_bounded(tmp_path):
+    log = ReplyLog(str(tmp_path / 'dedup.db'), ttl=0.05, max_entries=3)
+    for n in range(5):
+        log.begin(f'SM{n}')
+        log.finish(f'SM{n}', 'reply')
+        time.sleep(0.001)
+    log.purge()
+    assert len(log) == 3
+    assert log.begin('SM0') == (True, None)
+    time.sleep(0.1)
+    assert log.begin('SM4') == (True, None)
+    log.purge()
+    assert len(log) == 1
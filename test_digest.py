@@ -0,0 +1,64 @@
+import time
+
+from digest import AdminDigest, MAX_NUMBERS
+from outbox import Outbox, DeliveryEngine, FakeTransport
+
+ADMINS = ['whatsapp:+911', 'whatsapp:+912']
+
+
+def test_signups_in_a_window_become_one_digest():
+    transport = FakeTransport()
+    digest = AdminDigest(transport.send, ADMINS, window=60)
+    digest.claimed('w1', 'Dinner', 'whatsapp:+1', 1, 50, now=0)
+    digest.claimed('w2', 'Lunch', 'whatsapp:+2', 1, 3, now=10)
+    digest.claimed('w1', 'Dinner', 'whatsapp:+3', 2, 50, now=20)
+    assert digest.flush(now=59) == []
+    assert transport.sent == []
+
+    (text,) = digest.flush(now=60)
+    assert text == "👥 3 new sign-ups:\n\nDinner (w1): 2/50 filled\n+1, +3\n\nLunch (w2): 1/3 filled\n+2"
+    assert transport.sent == [(admin, text) for admin in ADMINS]
+    assert digest.flush(now=200) == []
+    assert digest.sent == {'digest': 1, 'full': 0}
+
+
+def test_full_work_is_sent_at_once_with_its_waiting_signups():
+    transport = FakeTransport()
+    digest = AdminDigest(transport.send, ADMINS[:1], window=60)
+    digest.claimed('w1', 'Dinner', 'whatsapp:+1', 1, 2, now=0)
+    digest.claimed('w2', 'Lunch', 'whatsapp:+2', 1, 3, now=1)
+    digest.claimed('w1', 'Dinner', 'whatsapp:+3', 2, 2, now=2)
+    (alert,) = digest.flush(now=2)
+    assert alert == "✅ Dinner (w1) is full: 2/2 workers.\nLatest sign-ups: +1, +3"
+    # Lunch still waits for the end of the window
+    (text,) = digest.flush(now=60)
+    assert text == "👥 1 new sign-up:\n\nLunch (w2): 1/3 filled\n+2"
+
+    for n in range(MAX_NUMBERS + 2):
+        digest.claimed('w3', 'Gala', f'whatsapp:+{n}', n + 1, 100, now=100)
+    (text,) = digest.flush(force=True)
+    assert text.endswith(", +9 and 2 more")
+
+
+def test_thread_delivers_through_the_outbox_off_the_caller(tmp_path):
+    transport = FakeTransport()
+    engine = DeliveryEngine(Outbox(str(tmp_path / 'outbox.db')), transport, workers=1, rate=1000)
+    digest = AdminDigest(lambda number, text: engine.enqueue(number, text), ADMINS[:1], window=0.2)
+    engine.start()
+    digest.start()
+    try:
+        start = time.monotonic()
+        for n in range(20):
+            digest.claimed('w1', 'Dinner', f'whatsapp:+{n}', n + 1, 50)
+        assert time.monotonic() - start < 0.1
+        digest.claimed('w2', 'Lunch', 'whatsapp:+99', 1, 1)
+        deadline = time.monotonic() + 5
+        while len(transport.sent) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        digest.stop()
+        engine.stop()
+    bodies = [body for _, body in transport.sent]
+    assert bodies[0].startswith("✅ Lunch (w2) is full")
+    assert bodies[1].startswith("👥 20 new sign-ups:")
+    assert len(bodies) == 2
@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+
+from journal import Journal
+
+
+def make_journal(tmp_path, state, **kwargs):
+    lock = threading.Lock()
+
+    def snapshot():
+        with lock:
+            seq = journal.last_seq
+            return json.dumps({'items': state, 'journal_seq': seq}), seq
+
+    journal = Journal(str(tmp_path / 'data.journal'), str(tmp_path / 'data.json'), snapshot=snapshot, **kwargs)
+    return journal, lock
+
+
+def test_replay_returns_records_in_order(tmp_path):
+    journal, _ = make_journal(tmp_path, [], fsync='always')
+    journal.replay()
+    for i in range(5):
+        journal.append('add', value=i)
+    journal.close()
+
+    reopened, _ = make_journal(tmp_path, [])
+    records = reopened.replay()
+    assert [r['value'] for r in records] == [0, 1, 2, 3, 4]
+    assert reopened.last_seq == 5
+
+
+def test_torn_tail_is_discarded(tmp_path):
+    journal, _ = make_journal(tmp_path, [], fsync='always')
+    journal.replay()
+    journal.append('add', value=1)
+    journal.append('add', value=2)
+    journal.close()
+    with open(tmp_path / 'data.journal', 'a') as f:
+        f.write('0000abcd {"seq": 3, "op": "ad')
+
+    reopened, _ = make_journal(tmp_path, [])
+    assert [r['value'] for r in reopened.replay()] == [1, 2]
+    # The torn bytes are gone, so new records follow the last good one
+    reopened.append('add', value=3)
+    reopened.close()
+    again, _ = make_journal(tmp_path, [])
+    assert [r['value'] for r in again.replay()] == [1, 2, 3]
+
+
+def test_compaction_writes_snapshot_and_trims_journal(tmp_path):
+    state = []
+    journal, lock = make_journal(tmp_path, state, fsync='never')
+    journal.replay()
+    for i in range(10):
+        with lock:
+            state.append(i)
+            journal.append('add', value=i)
+    journal.compact()
+    with lock:
+        state.append(10)
+        journal.append('add', value=10)
+    journal.close()
+
+    with open(tmp_path / 'data.json') as f:
+        snapshot = json.load(f)
+    assert snapshot['items'] == list(range(10))
+
+    reopened, _ = make_journal(tmp_path, [])
+    records = reopened.replay(snapshot['journal_seq'])
+    assert [r['value'] for r in records] == [10]
+
+
+def test_concurrent_appends_are_group_committed(tmp_path):
+    journal, _ = make_journal(tmp_path, [], fsync='always')
+    journal.replay()
+    threads = [threading.Thread(target=journal.append, args=('add',), kwargs={'value': i}) for i in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    journal.close()
+
+    reopened, _ = make_journal(tmp_path, [])
+    records = reopened.replay()
+    assert sorted(r['value'] for r in records) == list(range(50))
+    assert [r['seq'] for r in records] == list(range(1, 51))
+
+
+def test_concurrent_compactions_never_lose_records(tmp_path):
+    state = []
+    lock = threading.Lock()
+    first_taken = threading.Event()
+    calls = []
+
+    def snapshot():
+        with lock:
+            seq = journal.last_seq
+            text = json.dumps({'items': list(state), 'journal_seq': seq})
+        calls.append(seq)
+        if len(calls) == 1:
+            # Let the other compaction run between this snapshot and its write
+            first_taken.set()
+            time.sleep(0.2)
+        return text, seq
+
+    journal = Journal(str(tmp_path / 'data.journal'), str(tmp_path / 'data.json'), snapshot=snapshot, fsync='never')
+    journal.replay()
+    with lock:
+        state.append(1)
+        journal.append('add', value=1)
+    older = threading.Thread(target=journal.compact)
+    older.start()
+    first_taken.wait()
+    with lock:
+        state.append(2)
+        journal.append('add', value=2)
+    newer = threading.Thread(target=journal.compact)
+    newer.start()
+    older.join()
+    newer.join()
+    journal.close()
+
+    with open(tmp_path / 'data.json') as f:
+        snapshot_data = json.load(f)
+    reopened, _ = make_journal(tmp_path, [])
+    records = reopened.replay(snapshot_data['journal_seq'])
+    assert snapshot_data['items'] + [r['value'] for r in records] == [1, 2]
+
+
+def test_writes_and_compactions_are_timed(tmp_path):
+    timings = []
+    journal, lock = make_journal(tmp_path, [], fsync='never', on_write=lambda kind, elapsed: timings.append(kind))
+    journal.replay()
+    journal.append('add', value=1)
+    journal.flush()
+    journal.compact()
+    journal.close()
+    assert timings == ['journal', 'snapshot']
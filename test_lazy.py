@@ -0,0 +1,48 @@
+import threading
+from types import SimpleNamespace
+
+from lazy import Lazy
+
+
+def test_built_once_on_first_use():
+    calls = []
+
+    def build():
+        calls.append(1)
+        return SimpleNamespace(answer=42)
+
+    service = Lazy(build)
+    assert not service.built
+    assert calls == []
+    assert service.answer == 42
+    assert service.get() is service.get()
+    assert service.built
+    assert calls == [1]
+
+
+def test_concurrent_first_use_builds_once():
+    calls = []
+    start = threading.Barrier(8)
+
+    def build():
+        calls.append(1)
+        return object()
+
+    service = Lazy(build)
+    results = []
+
+    def use():
+        start.wait()
+        results.append(service.get())
+
+    threads = [threading.Thread(target=use) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len({id(result) for result in results}) == 1
+
+
+def test_none_service_is_falsy():
+    assert not Lazy(lambda: None)
@@ -0,0 +1,74 @@
+import json
+import os
+import time
+
+from metrics import Registry, SlowRequestProfiler
+
+
+def test_render_counters_and_histograms():
+    registry = Registry()
+    requests = registry.counter('requests_total', "Requests", ['role'])
+    latency = registry.histogram('latency_seconds', "Latency", buckets=(0.1, 1.0))
+    requests.inc('admin')
+    requests.inc('admin')
+    requests.inc('worker', amount=3)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{role="admin"} 2' in text
+    assert 'requests_total{role="worker"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'latency_seconds_count 3' in text
+    assert 'latency_seconds_sum 5.55' in text
+
+
+def test_callbacks_are_read_at_collection_time():
+    registry = Registry()
+    queue = []
+    registry.gauge('queue_depth', "Queue depth", lambda: len(queue))
+    registry.counter_callback('bytes_total', "Bytes", lambda: None)
+    queue.extend([1, 2])
+    text = registry.render()
+    assert 'queue_depth 2' in text
+    assert '# TYPE bytes_total counter' in text
+    assert '\nbytes_total ' not in text
+
+
+def test_processes_are_combined(tmp_path):
+    directory = str(tmp_path)
+    registry = Registry(directory)
+    registry.counter('requests_total', "Requests").inc()
+    registry.gauge('sessions', "Sessions", lambda: 2)
+    registry.gauge('works', "Works", lambda: 7, mode='max')
+
+    other = Registry()
+    other.counter('requests_total', "Requests").inc(amount=4)
+    other.gauge('sessions', "Sessions", lambda: 3)
+    other.gauge('works', "Works", lambda: 5, mode='max')
+    # A live worker process, and one that has exited
+    for pid in (os.getppid(), 2 ** 22 + 1):
+        with open(os.path.join(directory, f"metrics_{pid}.json"), 'w') as f:
+            json.dump(other.snapshot(), f)
+
+    text = registry.render()
+    assert 'requests_total 9' in text
+    assert 'sessions 5' in text
+    assert 'works 7' in text
+
+
+def test_profiler_reports_slow_blocks():
+    profiler = SlowRequestProfiler(threshold=0.05, interval=0.001)
+    with profiler.track('fast'):
+        pass
+    with profiler.track('worker:YES'):
+        time.sleep(0.1)
+
+    assert [report['name'] for report in profiler.reports] == ['worker:YES']
+    report = profiler.reports[0]
+    assert report['samples'] > 0
+    assert any('test_profiler_reports_slow_blocks' in frame for frame in report['stacks'][0]['stack'])
@@ -0,0 +1,177 @@
+import sqlite3
+import threading
+import time
+
+from outbox import (
+    Outbox, DeliveryEngine, FakeTransport, PermanentError, SharedTokenBucket, TokenBucket, SENT, SENDING, FAILED, PENDING
+)
+
+
+class FlakyTransport(FakeTransport):
+    """Fails the first failures sends, then succeeds."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def send(self, to, body):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("provider down")
+        return super().send(to, body)
+
+
+class RejectingTransport:
+    def send(self, to, body):
+        raise PermanentError("invalid number")
+
+
+def run_until(engine, statuses, count, timeout=5):
+    deadline = time.time() + timeout
+    engine.start()
+    while len([s for s in statuses if s != 'retrying']) < count and time.time() < deadline:
+        time.sleep(0.01)
+    engine.stop()
+
+
+def test_queued_messages_survive_restart(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    outbox.enqueue('whatsapp:+1', 'Hello', work_id='a1', reminder_id='r1')
+
+    reopened = Outbox(str(tmp_path / 'outbox.db'))
+    message = reopened.claim()
+    assert message['to_number'] == 'whatsapp:+1'
+    assert message['reminder_id'] == 'r1'
+    assert reopened.claim() is None
+
+
+def test_expired_lease_is_sent_again(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'), lease_seconds=0)
+    outbox.enqueue('whatsapp:+1', 'Hello')
+    first = outbox.claim()
+    # The process that claimed it died before marking it sent
+    time.sleep(0.01)
+    again = outbox.claim()
+    assert again['id'] == first['id']
+    assert again['attempts'] == 2
+
+
+def test_failed_sends_are_retried_with_backoff(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    statuses = []
+    engine = DeliveryEngine(outbox, FlakyTransport(failures=2), workers=1, rate=1000, base_delay=0.01,
+                            on_status=lambda message, status, error: statuses.append(status))
+    message_id = engine.enqueue('whatsapp:+1', 'Hello')
+    run_until(engine, statuses, 1)
+
+    assert statuses == ['retrying', 'retrying', SENT]
+    row = outbox.get(message_id)
+    assert row['status'] == SENT
+    assert row['attempts'] == 3
+
+
+def test_gives_up_after_max_attempts_or_permanent_error(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    statuses = []
+    engine = DeliveryEngine(outbox, FlakyTransport(failures=10), workers=1, rate=1000, base_delay=0.01,
+                            max_attempts=3, on_status=lambda message, status, error: statuses.append(status))
+    flaky_id = engine.enqueue('whatsapp:+1', 'Hello')
+    run_until(engine, statuses, 1)
+    assert outbox.get(flaky_id)['status'] == FAILED
+    assert outbox.get(flaky_id)['attempts'] == 3
+
+    engine.transport = RejectingTransport()
+    rejected_id = engine.enqueue('whatsapp:+2', 'Hello')
+    run_until(engine, statuses, 2)
+    assert outbox.get(rejected_id)['status'] == FAILED
+    assert outbox.get(rejected_id)['attempts'] == 1
+    assert outbox.counts().get(PENDING, 0) == 0
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=5)
+    start = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(30)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 5 tokens are available at once, the other 25 arrive at 50 per second
+    assert time.monotonic() - start >= 0.45
+
+
+def test_shared_token_bucket_is_one_limit_per_key(tmp_path):
+    db_file = str(tmp_path / 'send_rate.db')
+    # As opened by two processes sending from one number
+    buckets = [SharedTokenBucket(db_file, 'whatsapp:+1', rate=50, capacity=5) for _ in range(2)]
+    start = time.monotonic()
+    threads = [threading.Thread(target=buckets[n % 2].acquire) for n in range(30)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.monotonic() - start >= 0.45
+
+    # Another number has its own limit
+    other = SharedTokenBucket(db_file, 'whatsapp:+2', rate=1, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        other.acquire()
+    assert time.monotonic() - start < 0.5
+
+
+def test_pool_delivers_every_message_once(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    transport = FakeTransport()
+    statuses = []
+    engine = DeliveryEngine(outbox, transport, workers=4, rate=1000,
+                            on_status=lambda message, status, error: statuses.append(status))
+    for n in range(100):
+        outbox.enqueue(f'whatsapp:+{n}', 'Hello')
+    run_until(engine, statuses, 100)
+    assert sorted(to for to, _ in transport.sent) == sorted(f'whatsapp:+{n}' for n in range(100))
+
+
+def test_counts_are_kept_as_messages_change_state(tmp_path):
+    db_file = str(tmp_path / 'outbox.db')
+    outbox = Outbox(db_file)
+    ids = [outbox.enqueue(f'whatsapp:+{n}', 'Hello') for n in range(3)]
+    assert outbox.counts() == {PENDING: 3}
+    outbox.claim()
+    assert outbox.counts() == {PENDING: 2, SENDING: 1}
+    outbox.mark_sent(ids[0], 'SM1')
+    outbox.mark_failed(ids[1], 'invalid number')
+    assert outbox.counts() == {PENDING: 1, SENT: 1, FAILED: 1}
+
+    # An outbox from before the counts were kept is counted when opened
+    conn = sqlite3.connect(db_file)
+    conn.executescript("DROP TABLE outbox_counts; DROP TRIGGER outbox_count_insert; "
+                       "DROP TRIGGER outbox_count_update; DROP TRIGGER outbox_count_delete;")
+    conn.close()
+    reopened = Outbox(db_file)
+    assert reopened.counts() == {PENDING: 1, SENT: 1, FAILED: 1}
+    reopened.enqueue('whatsapp:+9', 'Hello')
+    assert reopened.counts()[PENDING] == 2
+
+
+def test_finished_messages_are_pruned_after_the_retention(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    sent_id, failed_id, pending_id = (outbox.enqueue(f'whatsapp:+{n}', 'Hello') for n in range(3))
+    outbox.mark_sent(sent_id, 'SM1')
+    outbox.mark_failed(failed_id, 'invalid number')
+    assert outbox.prune(time.time() - 60) == 0
+
+    assert outbox.prune(time.time() + 1) == 2
+    assert outbox.get(sent_id) is None and outbox.get(failed_id) is None
+    assert outbox.get(pending_id)['status'] == PENDING
+    assert outbox.counts() == {PENDING: 1}
+
+    # The engine prunes while it is idle, here as soon as a message is sent
+    engine = DeliveryEngine(outbox, FakeTransport(), workers=1, rate=1000, retention=0, prune_interval=0,
+                            poll_interval=0.01)
+    engine.start()
+    deadline = time.time() + 5
+    while outbox.counts() and time.time() < deadline:
+        time.sleep(0.01)
+    engine.stop()
+    assert outbox.get(pending_id) is None
@@ -0,0 +1,42 @@
+from ratelimit import SenderLimiter
+
+
+def test_bucket_allows_bursts_then_sheds_until_refilled():
+    limiter = SenderLimiter(rate=1, burst=3)
+    assert [limiter.check('a', now=0)[0] for _ in range(3)] == [True] * 3
+    assert limiter.check('a', now=0) == (False, True)
+    assert limiter.check('a', now=0.5) == (False, False)
+    # Other senders have their own bucket
+    assert limiter.check('b', now=0.5) == (True, False)
+    assert limiter.check('a', now=1.1) == (True, False)
+    assert limiter.check('a', now=1.2) == (False, True)
+    assert (limiter.allowed, limiter.shed) == (5, 3)
+
+
+def test_idle_and_excess_buckets_are_evicted():
+    limiter = SenderLimiter(rate=1, burst=2, max_senders=3)
+    for n in range(3):
+        limiter.check(n, now=n / 10)
+    assert len(limiter) == 3
+    # A fourth sender pushes out the least recently used one
+    limiter.check(0, now=0.3)
+    limiter.check(3, now=0.4)
+    assert list(limiter._buckets) == [2, 0, 3]
+    # Two seconds idle refill a bucket of two, so it is dropped
+    limiter.check(4, now=2.25)
+    assert list(limiter._buckets) == [0, 3, 4]
+    limiter.check(5, now=10)
+    assert len(limiter) == 1
+
+
+def test_zero_rate_turns_the_limit_off():
+    limiter = SenderLimiter(rate=0, burst=0)
+    assert all(limiter.check('a')[0] for _ in range(100))
+    assert len(limiter) == 0
+
+
+def test_zero_burst_turns_the_limit_off():
+    # Not a bucket that can never hold a token
+    limiter = SenderLimiter(rate=1, burst=0)
+    assert all(limiter.check('a', now=0)[0] for _ in range(100))
+    assert len(limiter) == 0
@@ -0,0 +1,94 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from reminders import ReminderScheduler, parse_event_time, event_time
+
+REFERENCE = datetime(2025, 6, 1, 10, 0)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("June 15 at 6PM", datetime(2025, 6, 15, 18, 0)),
+    ("15th June, 6:30 pm", datetime(2025, 6, 15, 18, 30)),
+    ("2025-06-20 18:00", datetime(2025, 6, 20, 18, 0)),
+    ("15/06/2025 18:00", datetime(2025, 6, 15, 18, 0)),
+    ("tomorrow 7pm", datetime(2025, 6, 2, 19, 0)),
+    ("Saturday 8pm", datetime(2025, 6, 7, 20, 0)),
+    ("Jan 3 9am", datetime(2026, 1, 3, 9, 0)),
+    ("June 15", None),
+    ("sometime next week", None),
+])
+def test_parse_event_time(text, expected):
+    assert parse_event_time(text, REFERENCE) == expected
+
+
+def test_event_time_is_relative_to_creation():
+    work = {"time": "Jan 3 9am", "created_at": "2024-12-20 10:00:00"}
+    assert event_time(work) == datetime(2025, 1, 3, 9, 0)
+    assert event_time({"time": "whenever", "event_at": "2025-02-01 08:00:00"}) == datetime(2025, 2, 1, 8, 0)
+
+
+def job(job_id, delay):
+    return {"id": job_id, "work_id": "a1", "message": "Hi", "run_at": time.time() + delay}
+
+
+def wait_for(condition, timeout=3):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_fires_jobs_in_due_order(tmp_path):
+    fired = []
+    scheduler = ReminderScheduler(lambda j: fired.append(j['id']), lambda: [], str(tmp_path / 'lock'))
+    scheduler.start()
+    wait_for(lambda: scheduler.is_leader)
+    for job_id, delay in (('c', 0.3), ('a', 0.1), ('b', 0.2)):
+        scheduler.schedule(job(job_id, delay))
+    wait_for(lambda: len(fired) == 3)
+    scheduler.stop()
+    assert fired == ['a', 'b', 'c']
+
+
+def test_rebuilds_pending_jobs_from_storage(tmp_path):
+    persisted = [job('a', 0.05), job('b', 60), job('late', -10), job('missed', -7200)]
+    fired, missed = [], []
+    scheduler = ReminderScheduler(lambda j: fired.append(j['id']), lambda: list(persisted),
+                                  str(tmp_path / 'lock'), on_missed=lambda j: missed.append(j['id']))
+    scheduler.start()
+    wait_for(lambda: len(fired) == 2)
+    assert scheduler.pending == 1
+    scheduler.stop()
+    assert sorted(fired) == ['a', 'late']
+    assert missed == ['missed']
+
+
+def test_only_one_process_fires(tmp_path):
+    fired = []
+    lock = threading.Lock()
+
+    def fire(j):
+        with lock:
+            fired.append(j['id'])
+
+    def load_pending():
+        # Storage only returns reminders that have not been sent yet
+        with lock:
+            return [j for j in persisted if j['id'] not in fired]
+
+    persisted = [job(str(n), 0.05) for n in range(20)]
+    schedulers = [
+        ReminderScheduler(fire, load_pending, str(tmp_path / 'lock'), resync_interval=0.05)
+        for _ in range(3)
+    ]
+    for scheduler in schedulers:
+        scheduler.start()
+    wait_for(lambda: len(fired) >= 20)
+    time.sleep(0.2)
+    leaders = [scheduler.is_leader for scheduler in schedulers]
+    for scheduler in schedulers:
+        scheduler.stop()
+    assert leaders.count(True) == 1
+    assert sorted(fired, key=int) == [str(n) for n in range(20)]
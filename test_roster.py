@@ -0,0 +1,97 @@
+import threading
+import time
+
+from roster import Roster, Broadcaster, DONE, RUNNING, STOPPED
+
+
+def number(n):
+    return f"whatsapp:+91{n:010d}"
+
+
+def test_segments_walk_workers_with_every_tag(tmp_path):
+    roster = Roster(str(tmp_path / 'roster.db'))
+    for n in range(10):
+        roster.add(number(n))
+        if n % 2 == 0:
+            roster.tag(number(n), ['Waiter', 'north'])
+        if n % 3 == 0:
+            roster.tag(number(n), ['reliable'])
+    roster.add(number(0))
+    roster.untag(number(6), ['north'])
+
+    assert roster.count() == 10
+    assert roster.count(['waiter']) == 5
+    assert roster.count(['north', 'RELIABLE']) == 1
+    assert roster.segment(['waiter', 'north']) == [number(0), number(2), number(4), number(8)]
+    assert roster.segment(['waiter', 'north'], after=number(2), limit=2) == [number(4), number(8)]
+    assert roster.segment(limit=3) == [number(0), number(1), number(2)]
+    assert roster.tags(number(6)) == ['reliable', 'waiter']
+    assert roster.tag_counts() == {'north': 4, 'reliable': 4, 'waiter': 5}
+
+
+def test_broadcast_sends_in_batches_and_skips_selected(tmp_path):
+    roster = Roster(str(tmp_path / 'roster.db'))
+    for n in range(7):
+        roster.tag(number(n), ['waiter'])
+    roster.add(number(99))
+    sent = []
+    broadcaster = Broadcaster(roster, lambda work_id: ("New work", {number(3)}),
+                              lambda to, text, work_id: sent.append(to), batch_size=3, interval=0)
+    broadcast = roster.create_broadcast('w1', ['waiter'])
+    assert broadcast['total'] == 7
+    broadcaster.run_broadcast(roster.claim_broadcast())
+
+    assert sent == [number(n) for n in (0, 1, 2, 4, 5, 6)]
+    broadcast = roster.get_broadcast(broadcast['id'])
+    assert (broadcast['status'], broadcast['sent']) == (DONE, 6)
+
+
+def test_broadcast_stops_once_the_work_is_full(tmp_path):
+    roster = Roster(str(tmp_path / 'roster.db'))
+    for n in range(10):
+        roster.add(number(n))
+    sent = []
+
+    def prepare(work_id):
+        return "full" if len(sent) >= 4 else ("New work", set())
+
+    broadcaster = Broadcaster(roster, prepare, lambda to, text, work_id: sent.append(to), batch_size=2, interval=0)
+    broadcast = roster.create_broadcast('w1')
+    broadcaster.run_broadcast(roster.claim_broadcast())
+    assert len(sent) == 4
+    broadcast = roster.get_broadcast(broadcast['id'])
+    assert (broadcast['status'], broadcast['reason']) == (STOPPED, 'full')
+
+
+def test_interrupted_broadcast_resumes_where_it_stopped(tmp_path):
+    roster = Roster(str(tmp_path / 'roster.db'), lease_seconds=0.05)
+    for n in range(5):
+        roster.add(number(n))
+    broadcast = roster.create_broadcast('w1')
+    claimed = roster.claim_broadcast()
+    assert roster.claim_broadcast() is None
+    # A process that sent the first batch and then died
+    roster.advance(claimed['id'], number(1), 2)
+    time.sleep(0.1)
+
+    other = Roster(str(tmp_path / 'roster.db'))
+    resumed = other.claim_broadcast()
+    assert (resumed['id'], resumed['status'], resumed['cursor']) == (broadcast['id'], RUNNING, number(1))
+    sent = []
+    Broadcaster(other, lambda work_id: ("New work", set()), lambda to, text, work_id: sent.append(to),
+                interval=0).run_broadcast(resumed)
+    assert sent == [number(2), number(3), number(4)]
+    assert other.get_broadcast(broadcast['id'])['sent'] == 5
+
+
+def test_thread_picks_up_new_broadcasts(tmp_path):
+    roster = Roster(str(tmp_path / 'roster.db'))
+    roster.add(number(1))
+    done = threading.Event()
+    broadcaster = Broadcaster(roster, lambda work_id: ("New work", set()),
+                              lambda to, text, work_id: done.set(), interval=0, poll_interval=5)
+    broadcaster.start()
+    roster.create_broadcast('w1')
+    broadcaster.notify()
+    assert done.wait(2)
+    broadcaster.stop()
@@ -0,0 +1,75 @@
+import pytest
+
+from router import CommandRouter, Message, split_message
+
+
+@pytest.fixture
+def router():
+    router = CommandRouter()
+    router.command('admin', 'LIST')(lambda message, out: out.append('list'))
+    router.command('admin', 'SELECT', args=True)(lambda message, out: out.append(f'select {message.args}'))
+    router.command('admin', 'STATUS', 'COUNT')(lambda message, out: out.append('status'))
+    router.command('admin', 'CANCEL', interrupts_flow=True)(lambda message, out: out.append('cancel'))
+    router.step('creating_event', 'title')(lambda message, session, out: out.append(f"title {message.text} {session['step']}"))
+    router.fallback('admin')(lambda message, out: out.append('unknown'))
+    router.fallback('worker')(lambda message, out: out.append('prompt'))
+    return router
+
+
+def dispatch(router, text, role='admin', session=None):
+    out = []
+    router.dispatch(role, Message(text, 'whatsapp:+1'), session, out)
+    return out[0]
+
+
+def test_message_is_tokenized_once():
+    message = Message('  select   abc123 ', 'whatsapp:+1')
+    assert message.text == 'select   abc123'
+    assert message.keyword == 'SELECT'
+    assert message.args == 'abc123'
+
+
+def test_routes_on_keyword_and_arguments(router):
+    assert dispatch(router, 'list') == 'list'
+    assert dispatch(router, 'List') == 'list'
+    assert dispatch(router, 'SELECT abc123') == 'select abc123'
+    assert dispatch(router, 'count') == 'status'
+    # LIST takes no arguments and SELECT needs one
+    assert dispatch(router, 'list everything') == 'unknown'
+    assert dispatch(router, 'select') == 'unknown'
+    assert dispatch(router, 'list', role='worker') == 'prompt'
+
+
+def test_conversation_steps_take_priority_except_interrupting_commands(router):
+    session = {'action': 'creating_event', 'step': 'title'}
+    assert dispatch(router, 'LIST', session=session) == 'title LIST title'
+    assert dispatch(router, 'cancel', session=session) == 'cancel'
+
+
+def test_records_handling_time_per_command(router):
+    dispatch(router, 'list')
+    dispatch(router, 'list')
+    dispatch(router, 'status')
+    dispatch(router, 'title', session={'action': 'creating_event', 'step': 'title'})
+    stats = router.stats()
+    assert stats['admin:LIST']['count'] == 2
+    assert stats['admin:STATUS']['count'] == 1
+    assert stats['creating_event:title']['count'] == 1
+    assert stats['admin:LIST']['max_ms'] >= 0
+
+
+def test_failing_handler_is_counted_as_error(router):
+    def broken(message, out):
+        raise RuntimeError("boom")
+
+    router.command('admin', 'BROKEN')(broken)
+    with pytest.raises(RuntimeError):
+        dispatch(router, 'broken')
+    assert router.stats()['admin:BROKEN']['errors'] == 1
+
+
+def test_split_message_stays_under_the_limit():
+    parts = ["a" * 40, "b" * 40, "c" * 40, "d" * 250]
+    chunks = split_message(parts, limit=100)
+    assert chunks == ["a" * 40 + "\n\n" + "b" * 40, "c" * 40, "d" * 100, "d" * 100, "d" * 50]
+    assert all(len(chunk) <= 100 for chunk in chunks)
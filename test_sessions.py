@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from sessions import SessionStore
+
+
+def test_sessions_are_shared_between_stores(tmp_path):
+    first = SessionStore(str(tmp_path / 'sessions.db'))
+    second = SessionStore(str(tmp_path / 'sessions.db'))
+    admin = first.namespace('admin')
+    admin['whatsapp:+1'] = {'action': 'creating_event', 'step': 'title', 'data': {}}
+
+    session = second.namespace('admin')['whatsapp:+1']
+    session['step'] = 'location'
+    second.namespace('admin')['whatsapp:+1'] = session
+    assert admin.get('whatsapp:+1')['step'] == 'location'
+    assert 'whatsapp:+1' not in first.namespace('list')
+    assert len(admin) == 1
+
+    assert admin.pop('whatsapp:+1')['step'] == 'location'
+    assert admin.pop('whatsapp:+1') is None
+    with pytest.raises(KeyError):
+        del admin['whatsapp:+1']
+
+
+def test_expired_sessions_are_evicted_on_read(tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.db'), ttl=0.05)
+    admin = store.namespace('admin')
+    admin['whatsapp:+1'] = {'step': 'title'}
+    admin['whatsapp:+2'] = {'step': 'title'}
+    time.sleep(0.1)
+    # Writing a session starts its time to live again
+    admin['whatsapp:+2'] = {'step': 'location'}
+
+    assert admin.get('whatsapp:+1') is None
+    assert admin['whatsapp:+2'] == {'step': 'location'}
+    assert store.evictions == 1
+    assert store.counts() == {'admin': 1}
+
+
+def test_sweeper_deletes_abandoned_sessions(tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.db'), ttl=0.01, sweep_interval=0.02)
+    cursors = store.namespace('list', ttl=10)
+    store.namespace('admin')['whatsapp:+1'] = {'step': 'title'}
+    cursors['whatsapp:+1'] = {'page': 1}
+    store.start()
+    deadline = time.time() + 2
+    while store.evictions == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    store.stop()
+    assert store.evictions == 1
+    assert store.counts() == {'list': 1}
+    cursors.clear()
+    assert len(cursors) == 0
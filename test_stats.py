@@ -0,0 +1,86 @@
+from datetime import datetime
+
+from stats import StaffingStats, ALL_TIME, week_of
+
+MONDAY = datetime(2025, 6, 2, 10).timestamp()
+NEXT_MONDAY = datetime(2025, 6, 9, 10).timestamp()
+
+
+def test_claims_update_work_week_and_worker_counters(tmp_path):
+    stats = StaffingStats(str(tmp_path / 'stats.db'))
+    stats.record_created('w1', 2, now=MONDAY)
+    stats.record_created('w2', 3, now=MONDAY + 60)
+    stats.record_created('w3', 1, now=NEXT_MONDAY)
+    stats.record_claim('w1', 'a', now=MONDAY + 100)
+    stats.record_claim('w1', 'a', now=MONDAY + 150)
+    stats.record_claim('w1', 'b', now=MONDAY + 300)
+    stats.record_claim('w2', 'a', now=MONDAY + 260)
+    stats.record_claim('w3', 'c', now=NEXT_MONDAY + 50)
+
+    assert stats.work('w1') == {
+        'work_id': 'w1', 'week': '2025-W23', 'required_workers': 2, 'claims': 2,
+        'fill_rate': 1.0, 'time_to_first_claim': 100, 'time_to_full': 300
+    }
+    assert stats.claims('w1') == [('a', MONDAY + 100), ('b', MONDAY + 300)]
+    week = stats.summary('2025-W23')
+    assert (week['works'], week['claims'], week['required_workers'], week['filled']) == (2, 3, 5, 1)
+    assert week['fill_rate'] == 0.6
+    assert week['avg_time_to_first_claim'] == 150
+    assert week['avg_time_to_full'] == 300
+    assert [week['period'] for week in stats.weeks()] == ['2025-W24', '2025-W23']
+    total = stats.summary(ALL_TIME)
+    assert (total['works'], total['claims'], total['filled']) == (3, 4, 2)
+    assert total['avg_time_to_full'] == 175
+    assert stats.top_workers(2) == [('a', 2), ('b', 1)]
+
+    stats.record_deleted('w1')
+    total = stats.summary()
+    assert (total['works'], total['claims'], total['filled'], total['avg_time_to_full']) == (2, 2, 1, 50)
+    assert total['avg_time_to_first_claim'] == 125
+    assert stats.worker_claims('a') == 1
+    assert stats.worker_claims('b') == 0
+    assert stats.work('w1') is None
+
+
+def test_backfill_counts_existing_works_without_times(tmp_path):
+    stats = StaffingStats(str(tmp_path / 'stats.db'))
+    assert stats.is_empty()
+    works = [
+        ('w1', {"required_workers": 2, "selected_workers": ['a', 'b'], "created_at": "2025-06-02 10:00:00"}),
+        ('w2', {"required_workers": 3, "selected_workers": ['a'], "created_at": "2025-06-03 10:00:00"}),
+    ]
+    assert stats.backfill(works) == 2
+    assert stats.backfill(works) == 0
+    stats.record_claim('w2', 'c', now=MONDAY + 3600)
+
+    total = stats.summary()
+    assert (total['works'], total['claims'], total['filled'], total['fill_rate']) == (2, 4, 1, 0.8)
+    assert total['avg_time_to_first_claim'] is None
+    assert stats.work('w2')['time_to_first_claim'] is None
+    assert stats.top_workers() == [('a', 2), ('b', 1), ('c', 1)]
+    assert week_of(MONDAY) == '2025-W23'
+
+
+def test_rebuild_counts_the_replacing_works(tmp_path):
+    stats = StaffingStats(str(tmp_path / 'stats.db'))
+    stats.record_created('w1', 2, now=MONDAY)
+    stats.record_claim('w1', 'a', now=MONDAY + 100)
+    stats.record_created('w2', 1, now=MONDAY)
+    stats.record_claim('w2', 'b', now=MONDAY + 200)
+    stats.record_created('w3', 1, now=MONDAY)
+    stats.record_created('old', 1, now=MONDAY)
+    works = [
+        ('w1', {"required_workers": 2, "selected_workers": ['a'], "created_at": "2025-06-02 10:00:00"}),
+        ('w2', {"required_workers": 1, "selected_workers": [], "created_at": "2025-06-02 10:00:00"}),
+        ('w4', {"required_workers": 3, "selected_workers": ['c'], "created_at": "2025-06-03 10:00:00"}),
+    ]
+    # w3 is gone, old was archived meanwhile, w2 lost its claim and w4 is new
+    assert stats.rebuild(works, archived=lambda work_ids: {'old'} & set(work_ids)) == (2, 2)
+
+    total = stats.summary()
+    assert (total['works'], total['claims'], total['required_workers']) == (4, 2, 7)
+    assert stats.work('w3') is None and stats.work('old') is not None
+    assert stats.claims('w1') == [('a', MONDAY + 100)]
+    assert stats.claims('w2') == []
+    assert stats.top_workers() == [('a', 1), ('c', 1)]
+    assert stats.rebuild(works) == (0, 1)
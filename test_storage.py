@@ -0,0 +1,413 @@
+import json
+import multiprocessing
+import pickle
+import threading
+
+import pytest
+
+from storage import (
+    JSONStorage, SQLiteStorage, migrate_json_to_sqlite,
+    work_status, CLAIMED, ALREADY_SELECTED, FULL, NOT_FOUND, OPEN, PAST
+)
+
+
+def make_work(title, required_workers=2):
+    return {
+        "title": title,
+        "location": "Hall",
+        "time": "June 1 6pm",
+        "required_workers": required_workers,
+        "payment": "500",
+        "selected_workers": [],
+        "created_at": f"2025-06-01 10:00:0{title[-1]}"
+    }
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        engine = JSONStorage(str(tmp_path / 'data.json'), fsync='never')
+    else:
+        engine = SQLiteStorage(str(tmp_path / 'data.db'))
+    engine.load()
+    yield engine
+    engine.close()
+
+
+def test_create_select_and_delete(store):
+    store.create_work('a1', make_work('Event 1'))
+    store.create_work('b2', make_work('Event 2'))
+    assert store.get_current_work_id() == 'b2'
+    assert [work_id for work_id, _ in store.list_works()] == ['a1', 'b2']
+
+    store.set_current_work_id('a1')
+    assert store.get_current_work_id() == 'a1'
+    assert store.delete_work('a1')
+    assert not store.delete_work('a1')
+    assert store.get_work('a1') is None
+    assert store.get_current_work_id() is None
+    assert store.count_works() == 1
+
+
+def test_claims_keep_join_order(store):
+    store.create_work('a1', make_work('Event 1', required_workers=2))
+    assert store.claim_slot('a1', 'whatsapp:+3') == (CLAIMED, 1)
+    assert store.claim_slot('a1', 'whatsapp:+1') == (CLAIMED, 2)
+    assert store.claim_slot('a1', 'whatsapp:+3') == (ALREADY_SELECTED, 1)
+    assert store.claim_slot('a1', 'whatsapp:+4') == (FULL, None)
+    assert store.claim_slot('zz', 'whatsapp:+4') == (NOT_FOUND, None)
+    assert store.get_work('a1')["selected_workers"] == ['whatsapp:+3', 'whatsapp:+1']
+
+
+def test_concurrent_claims_never_overfill(store):
+    store.create_work('a1', make_work('Event 1', required_workers=10))
+    store.create_work('b2', make_work('Event 2', required_workers=5))
+    outcomes = []
+    start = threading.Barrier(40)
+
+    def worker(n):
+        start.wait()
+        for work_id in ('a1', 'b2'):
+            # Every worker taps "Yes" twice, like an impatient user
+            outcomes.append((work_id, store.claim_slot(work_id, f"whatsapp:+{n}")))
+            outcomes.append((work_id, store.claim_slot(work_id, f"whatsapp:+{n}")))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(40)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for work_id, required in (('a1', 10), ('b2', 5)):
+        selected = store.get_work(work_id)["selected_workers"]
+        claimed = [result for wid, result in outcomes if wid == work_id and result[0] == CLAIMED]
+        assert len(selected) == required
+        assert len(set(selected)) == required
+        assert sorted(position for _, position in claimed) == list(range(1, required + 1))
+
+
+def _claim_in_process(db_file, first, count, results):
+    store = SQLiteStorage(db_file)
+    for n in range(first, first + count):
+        outcome, _ = store.claim_slot('a1', f"whatsapp:+{n}")
+        if outcome == CLAIMED:
+            results.put(n)
+    store.close()
+
+
+def test_concurrent_claims_across_processes(tmp_path):
+    db_file = str(tmp_path / 'data.db')
+    store = SQLiteStorage(db_file)
+    store.load()
+    store.create_work('a1', make_work('Event 1', required_workers=25))
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_claim_in_process, args=(db_file, n * 50, 50, results))
+        for n in range(4)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    claimed = [results.get() for _ in range(results.qsize())]
+    selected = store.get_work('a1')["selected_workers"]
+    assert len(claimed) == 25
+    assert sorted(selected) == sorted(f"whatsapp:+{n}" for n in claimed)
+
+
+def test_reminders_are_stored_on_the_work(store):
+    store.create_work('a1', make_work('Event 1'))
+    store.add_scheduled_reminder('a1', {"message": "Bring uniform", "hours_before": 2})
+    store.add_reminder('a1', {"message": "Bring uniform", "recipients": 0})
+    work = store.get_work('a1')
+    assert work["scheduled_reminders"] == [{"message": "Bring uniform", "hours_before": 2}]
+    assert work["reminders"] == [{"message": "Bring uniform", "recipients": 0}]
+
+
+def test_delivery_status_is_recorded_on_the_reminder(store):
+    store.create_work('a1', make_work('Event 1'))
+    store.add_reminder('a1', {"id": "r1", "message": "Hi", "deliveries": {"whatsapp:+1": "queued"}})
+    store.update_delivery('a1', 'r1', 'whatsapp:+1', 'sent')
+    store.update_delivery('a1', 'missing', 'whatsapp:+1', 'sent')
+    assert store.get_work('a1')["reminders"][0]["deliveries"] == {"whatsapp:+1": "sent"}
+
+
+def test_work_version_changes_with_the_work(store):
+    assert store.work_version('a1') is None
+    store.create_work('a1', make_work('Event 1'))
+    store.create_work('b2', make_work('Event 2'))
+    seen = {store.work_version('a1')}
+    for change in (
+        lambda: store.claim_slot('a1', 'whatsapp:+1'),
+        lambda: store.add_reminder('a1', {'id': 'r1', 'message': 'Hi'}),
+        lambda: store.add_scheduled_reminder('a1', {'id': 's1', 'status': 'scheduled'}),
+        lambda: store.set_reminder_status('a1', 's1', 'sent'),
+        lambda: store.create_work('a1', make_work('Event 1')),
+    ):
+        change()
+        assert store.work_version('a1') not in seen
+        seen.add(store.work_version('a1'))
+    # Reads, selecting, delivery statuses and changes to other works leave it alone
+    version = store.work_version('a1')
+    store.get_work('a1')
+    store.set_current_work_id('a1')
+    state = store.state_version()
+    store.update_delivery('a1', 'r1', 'whatsapp:+1', 'sent')
+    assert store.work_version('a1') == version and store.state_version() == state
+    store.claim_slot('b2', 'whatsapp:+1')
+    assert store.work_version('a1') == version
+    store.delete_work('a1')
+    assert store.work_version('a1') is None
+    # Created again, it still gets a version it never had
+    store.create_work('a1', make_work('Event 1'))
+    assert store.work_version('a1') not in seen
+
+
+def test_state_version_increases_with_every_change(store):
+    seen = [store.state_version()]
+    for change in (
+        lambda: store.create_work('a1', make_work('Event 1')),
+        lambda: store.create_work('b2', make_work('Event 2')),
+        lambda: store.set_current_work_id('a1'),
+        lambda: store.claim_slot('a1', 'whatsapp:+1'),
+        lambda: store.add_reminder('a1', {'id': 'r1', 'message': 'Hi'}),
+        lambda: store.delete_work('b2'),
+        lambda: store.restore(store.export()),
+    ):
+        change()
+        assert store.state_version() > seen[-1]
+        seen.append(store.state_version())
+    # Reads and refused claims change nothing
+    store.get_work('a1')
+    store.list_works()
+    store.claim_slot('a1', 'whatsapp:+1')
+    assert store.state_version() == seen[-1]
+    assert store.state_epoch
+
+
+def test_pages_follow_the_cursor(store):
+    for n in range(7):
+        store.create_work(f'w{n}', make_work(f'Event {n}'))
+    store.delete_work('w3')
+    pages = []
+    cursor = None
+    while True:
+        works, cursor = store.page_works(after=cursor, limit=2)
+        pages.append([work_id for work_id, _ in works])
+        if cursor is None:
+            break
+    assert pages == [['w0', 'w1'], ['w2', 'w4'], ['w5', 'w6']]
+    assert [work_id for work_id, _ in store.page_works(offset=4, limit=2)[0]] == ['w5', 'w6']
+
+
+def test_pages_filter_by_status(store):
+    store.create_work('w1', make_work('Event 1', required_workers=1))
+    store.create_work('w2', dict(make_work('Event 2'), event_at='2025-06-01 18:00:00'))
+    store.create_work('w3', make_work('Event 3'))
+    store.claim_slot('w1', 'whatsapp:+1')
+    now = '2025-06-02 09:00:00'
+
+    def ids(status):
+        return [work_id for work_id, _ in store.page_works(status, now=now)[0]]
+
+    assert ids(OPEN) == ['w3']
+    assert ids(FULL) == ['w1']
+    assert ids(PAST) == ['w2']
+    assert ids(None) == ['w1', 'w2', 'w3']
+    assert work_status(store.get_work('w1'), now) == FULL
+
+
+def test_status_pages_follow_claims_deletes_and_time(store):
+    for n in range(7):
+        event_at = f'2025-06-0{n + 1} 18:00:00'
+        store.create_work(f'w{n}', dict(make_work(f'Event {n}', required_workers=1), event_at=event_at))
+    store.claim_slot('w1', 'whatsapp:+1')
+    store.claim_slot('w4', 'whatsapp:+1')
+    store.delete_work('w5')
+
+    def pages(status, now, limit=2):
+        result, cursor = [], None
+        while True:
+            works, cursor = store.page_works(status, cursor, 0, limit, now=now)
+            result.append([work_id for work_id, _ in works])
+            if cursor is None:
+                return result
+
+    now = '2025-06-01 09:00:00'
+    assert pages(OPEN, now) == [['w0', 'w2'], ['w3', 'w6']]
+    assert pages(FULL, now) == [['w1', 'w4']]
+    assert pages(PAST, now) == [[]]
+    assert [work_id for work_id, _ in store.page_works(OPEN, None, 2, 2, now=now)[0]] == ['w3', 'w6']
+
+    now = '2025-06-03 09:00:00'
+    assert pages(OPEN, now) == [['w2', 'w3'], ['w6']]
+    assert pages(FULL, now) == [['w4']]
+    assert pages(PAST, now) == [['w0', 'w1']]
+    # An earlier now, like the archive's cutoff, narrows the past works
+    assert pages(PAST, '2025-06-02 09:00:00') == [['w0']]
+    store.claim_slot('w3', 'whatsapp:+1')
+    assert pages(FULL, now) == [['w3', 'w4']]
+    assert [work_id for work_id, _ in store.open_works(now=now)] == ['w2', 'w6']
+
+
+def test_open_works_close_when_full_or_past(store):
+    store.create_work('w1', make_work('Event 1', required_workers=1))
+    store.create_work('w2', dict(make_work('Event 2'), event_at='2025-06-01 18:00:00'))
+    store.create_work('w3', make_work('Event 3'))
+    store.create_work('w4', make_work('Event 4'))
+
+    def ids(now):
+        return [work_id for work_id, _ in store.open_works(now=now)]
+
+    assert ids('2025-06-01 09:00:00') == ['w1', 'w2', 'w3', 'w4']
+    store.claim_slot('w1', 'whatsapp:+1')
+    store.claim_slot('w3', 'whatsapp:+1')
+    assert ids('2025-06-02 09:00:00') == ['w3', 'w4']
+    assert store.open_works(now='2025-06-02 09:00:00')[0][1]['selected_workers'] == ['whatsapp:+1']
+    store.delete_work('w4')
+    store.claim_slot('w3', 'whatsapp:+2')
+    assert ids('2025-06-02 09:00:00') == []
+
+
+def test_open_work_versions_follow_the_open_works(store):
+    store.create_work('w1', make_work('Event 1'))
+    store.create_work('w2', make_work('Event 2', required_workers=1))
+    store.add_reminder('w1', {'id': 'r1', 'message': 'Bring ID'})
+    before = store.open_work_versions()
+    assert [work_id for work_id, _ in before] == ['w1', 'w2']
+    assert before == [(work_id, store.work_version(work_id)) for work_id, _ in store.open_works()]
+    assert store.open_work_versions() == before
+
+    store.claim_slot('w1', 'whatsapp:+1')
+    store.claim_slot('w2', 'whatsapp:+1')
+    (after,) = store.open_work_versions()
+    assert after[0] == 'w1' and after != before[0]
+    (work_id, work), = store.open_works()
+    assert work['selected_workers'] == ['whatsapp:+1']
+    assert work['reminders'][0]['id'] == 'r1'
+
+
+def test_open_works_after_restore(store):
+    store.create_work('w1', make_work('Event 1', required_workers=1))
+    store.create_work('w2', make_work('Event 2'))
+    store.claim_slot('w1', 'whatsapp:+1')
+    data = store.export()
+    store.delete_work('w2')
+    store.restore(data)
+    assert [work_id for work_id, _ in store.open_works()] == ['w2']
+
+
+def test_worker_index_follows_claims_and_deletes(store):
+    for n in range(3):
+        store.create_work(f'w{n}', make_work(f'Event {n}'))
+    store.claim_slot('w2', 'whatsapp:+1')
+    store.claim_slot('w0', 'whatsapp:+1')
+    store.claim_slot('w0', 'whatsapp:+2')
+    assert [work_id for work_id, _ in store.worker_works('whatsapp:+1')] == ['w0', 'w2']
+    assert store.claim_slot('w0', 'whatsapp:+2') == (ALREADY_SELECTED, 2)
+    store.delete_work('w0')
+    assert [work_id for work_id, _ in store.worker_works('whatsapp:+1')] == ['w2']
+    assert store.worker_works('whatsapp:+2') == []
+
+
+def test_json_worker_index_is_rebuilt_on_load(tmp_path):
+    store = JSONStorage(str(tmp_path / 'data.json'), fsync='never')
+    store.load()
+    store.create_work('w1', make_work('Event 1'))
+    store.claim_slot('w1', 'whatsapp:+1')
+    store.save()
+    store.create_work('w2', make_work('Event 2'))
+    store.claim_slot('w2', 'whatsapp:+1')
+    store.close()
+
+    store = JSONStorage(str(tmp_path / 'data.json'), fsync='never')
+    store.load()
+    assert [work_id for work_id, _ in store.worker_works('whatsapp:+1')] == ['w1', 'w2']
+    assert store.claim_slot('w1', 'whatsapp:+1') == (ALREADY_SELECTED, 1)
+    store.close()
+
+
+def test_json_storage_survives_restart(tmp_path):
+    store = JSONStorage(str(tmp_path / 'data.json'), fsync='never')
+    store.load()
+    store.create_work('a1', make_work('Event 1'))
+    store.claim_slot('a1', 'whatsapp:+1')
+    store.close()
+
+    reopened = JSONStorage(str(tmp_path / 'data.json'))
+    reopened.load()
+    assert reopened.get_work('a1')["selected_workers"] == ['whatsapp:+1']
+    assert reopened.get_current_work_id() == 'a1'
+
+
+def test_pickle_snapshots_and_switching_formats(tmp_path):
+    data_file = str(tmp_path / 'data.json')
+    store = JSONStorage(data_file, fsync='never')
+    store.load()
+    store.create_work('a1', make_work('Event 1'))
+    store.save()
+    store.close()
+
+    store = JSONStorage(data_file, fsync='never', snapshot_format='pickle')
+    store.load()
+    store.create_work('b2', make_work('Event 2'))
+    store.save()
+    store.create_work('c3', make_work('Event 3'))
+    store.close()
+    assert (tmp_path / 'data.snapshot').read_bytes()[:2] == b'\x80\x04'
+
+    store = JSONStorage(data_file, fsync='never', snapshot_format='pickle')
+    store.load()
+    assert [work_id for work_id, _ in store.list_works()] == ['a1', 'b2', 'c3']
+    store.save()
+    store.close()
+
+    # Back to the JSON data file: the newer binary snapshot is still read
+    store = JSONStorage(data_file, fsync='never')
+    store.load()
+    assert store.count_works() == 3
+    store.close()
+
+
+def test_writes_go_on_while_a_snapshot_is_serialized(tmp_path, monkeypatch):
+    store = JSONStorage(str(tmp_path / 'data.json'), fsync='never', snapshot_format='pickle')
+    store.load()
+    store.create_work('a1', make_work('Event 1'))
+    store.add_reminder('a1', {"id": "r1", "message": "Hi", "deliveries": {}})
+    dumps = pickle.dumps
+
+    def slow_dumps(data, **options):
+        # Writers run to completion while the snapshot is being serialized...
+        writer = threading.Thread(target=lambda: (store.claim_slot('a1', 'whatsapp:+1'),
+                                                  store.update_delivery('a1', 'r1', 'whatsapp:+1', 'sent')))
+        writer.start()
+        writer.join(timeout=5)
+        assert not writer.is_alive()
+        return dumps(data, **options)
+
+    monkeypatch.setattr('storage.pickle.dumps', slow_dumps)
+    text, seq = store._snapshot()
+    # ...and the snapshot is of the data as it was when it was taken
+    work = pickle.loads(text)['work_opportunities']['a1']
+    assert work['selected_workers'] == []
+    assert work['reminders'][0]['deliveries'] == {}
+    assert store.get_work('a1')['selected_workers'] == ['whatsapp:+1']
+    assert store.get_work('a1')['reminders'][0]['deliveries'] == {'whatsapp:+1': 'sent'}
+    store.close()
+
+
+def test_migrate_json_file_to_sqlite(tmp_path):
+    work = make_work('Event 1')
+    work["selected_workers"] = ['whatsapp:+1', 'whatsapp:+2']
+    work["reminders"] = [{"message": "Hi", "sent_at": "2025-06-01 09:00:00", "recipients": 2}]
+    with open(tmp_path / 'data.json', 'w') as f:
+        json.dump({'work_opportunities': {'a1': work}, 'current_work_id': 'a1'}, f)
+
+    assert migrate_json_to_sqlite(str(tmp_path / 'data.json'), str(tmp_path / 'data.db')) == 1
+
+    store = SQLiteStorage(str(tmp_path / 'data.db'))
+    store.load()
+    assert store.get_work('a1') == work
+    assert store.get_current_work_id() == 'a1'
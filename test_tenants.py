@@ -0,0 +1,73 @@
+import json
+import threading
+
+import pytest
+
+from tenants import Directory, Tenant, WorkspaceDict, WorkspaceLocal, current_workspace
+
+
+def make_directory(tmp_path, default='acme'):
+    built = []
+
+    def build_store():
+        built.append(current_workspace(directory).name)
+        return {'path': current_workspace(directory).path('catering_data.json')}
+
+    tenants = [
+        Tenant('acme', ['whatsapp:+911'], ['whatsapp:+100'], str(tmp_path / 'acme')),
+        Tenant('bistro', ['whatsapp:+922'], ['whatsapp:+200'], str(tmp_path / 'bistro'), preload=True),
+    ]
+    directory = Directory(tenants, {'store': build_store, 'choices': dict}, default)
+    return directory, built
+
+
+def test_messages_are_routed_by_to_then_admin_then_default(tmp_path):
+    directory, _ = make_directory(tmp_path)
+    assert directory.resolve('whatsapp:+200', 'whatsapp:+911').name == 'bistro'
+    assert directory.resolve('whatsapp:+999', 'whatsapp:+922').name == 'bistro'
+    assert directory.resolve('whatsapp:+999', 'whatsapp:+555').name == 'acme'
+    directory, _ = make_directory(tmp_path, default=None)
+    assert directory.resolve('whatsapp:+999', 'whatsapp:+555') is None
+    with pytest.raises(ValueError):
+        Directory([Tenant('a', ['x']), Tenant('b', ['x'])], {})
+
+
+def test_workspaces_are_built_lazily_and_kept_apart(tmp_path):
+    directory, built = make_directory(tmp_path)
+    store = WorkspaceLocal(directory, 'store')
+    choices = WorkspaceDict(directory, 'choices')
+    assert directory.loaded() == []
+
+    bistro = directory.workspace('bistro')
+    with bistro.active():
+        assert store.get()['path'] == str(tmp_path / 'bistro' / 'catering_data.json')
+        choices['worker'] = ['w1']
+        assert choices.get('worker') == ['w1']
+    assert built == ['bistro']
+    # Outside any workspace, the default tenant's
+    assert store.get()['path'] == str(tmp_path / 'acme' / 'catering_data.json')
+    assert 'worker' not in choices and choices.get('worker') is None
+    assert built == ['bistro', 'acme']
+    assert directory.workspace('nope') is None
+    assert [workspace.name for workspace in directory.preloaded()] == ['bistro']
+
+    # Background threads do not inherit the workspace unless the callback is bound
+    seen = []
+    thread = threading.Thread(target=bistro.bind(lambda: seen.append(current_workspace(directory).name)))
+    thread.start()
+    thread.join()
+    assert seen == ['bistro']
+
+
+def test_tenants_file(tmp_path):
+    path = tmp_path / 'tenants.json'
+    path.write_text(json.dumps({'default': 'acme', 'tenants': [
+        {'name': 'acme', 'admins': ['whatsapp:+911'], 'directory': None},
+        {'name': 'bistro', 'admins': ['whatsapp:+922'], 'numbers': ['whatsapp:+200'], 'preload': True},
+    ]}))
+    directory = Directory.from_file(str(path), str(tmp_path / 'tenants'), {})
+    assert directory.workspace('acme').path('data/catering_data.json') == 'data/catering_data.json'
+    bistro = directory.workspace('bistro')
+    assert bistro.path('backups') == str(tmp_path / 'tenants' / 'bistro' / 'backups')
+    assert bistro.is_admin('whatsapp:+922') and not bistro.is_admin('whatsapp:+911')
+    assert (tmp_path / 'tenants' / 'bistro').is_dir()